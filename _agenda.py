@@ -0,0 +1,133 @@
+"""Índice de agendamento em memória (min-heap por dta_proxima) e regras de reagendamento."""
+
+import heapq
+from calendar import monthrange
+from datetime import datetime as dt, timedelta
+from itertools import count
+from threading import Condition
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def somar_meses(data: dt, meses: int) -> dt:
+    """Soma meses mantendo o dia (limitado ao último dia do mês de destino)."""
+    total = data.month - 1 + meses
+    ano, mes = data.year + total // 12, total % 12 + 1
+    return data.replace(year=ano, month=mes, day=min(data.day, monthrange(ano, mes)[1]))
+
+
+def proxima_execucao(periodo: str, intervalo: int, dta_agendada: dt) -> Optional[dt]:
+    """
+    Espelho em Python das SQL_UPDATE_SCHEDULE_*: próxima data a partir da agendada.
+    Retorna None para períodos sem repetição ('U') ou desconhecidos.
+    """
+    intervalo = intervalo or 1
+    if periodo == 'Mi':
+        return dta_agendada + timedelta(minutes=intervalo)
+    if periodo == 'H':
+        return dta_agendada + timedelta(hours=intervalo)
+    if periodo == 'D':
+        return dta_agendada + timedelta(days=intervalo)
+    if periodo == 'M':
+        return somar_meses(dta_agendada, intervalo)
+    return None
+
+
+class ScheduleIndex:
+    """
+    Agenda em memória das rotinas ativas, ordenada pela próxima execução.
+
+    Atualizações substituem a entrada da rotina; entradas antigas continuam no heap
+    e são descartadas quando chegam ao topo (remoção preguiçosa). Rotinas retiradas
+    para execução só voltam ao índice por concluir(), ignorando leituras do banco
+    feitas enquanto rodam.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[dt, int, int]] = []
+        self._rotinas: Dict[int, Tuple[dt, Any]] = {}
+        self._executando: set = set()
+        self._seq = count()
+        self._cond = Condition()
+
+    def __len__(self) -> int:
+        return len(self._rotinas)
+
+    def carregar(self, rotinas: List[Any]):
+        """Substitui todo o conteúdo do índice."""
+        with self._cond:
+            self._heap.clear()
+            self._rotinas.clear()
+            for routine in rotinas:
+                if routine.id in self._executando:
+                    continue
+                self._inserir(routine, routine.dta_proxima or routine.dta_inicial)
+            self._cond.notify_all()
+
+    def _inserir(self, routine: Any, quando: Optional[dt]):
+        if quando is None:
+            self._rotinas.pop(routine.id, None)
+            return
+        self._rotinas[routine.id] = (quando, routine)
+        heapq.heappush(self._heap, (quando, next(self._seq), routine.id))
+
+    def atualizar(self, routine: Any, quando: Optional[dt] = None):
+        """Insere ou substitui a rotina; 'quando' sobrepõe a data lida da rotina."""
+        with self._cond:
+            if routine.id in self._executando:
+                return
+            self._inserir(routine, quando or routine.dta_proxima or routine.dta_inicial)
+            self._cond.notify_all()
+
+    def concluir(self, routine: Any, quando: Optional[dt]):
+        """Devolve ao índice uma rotina retirada para execução (None = desativada)."""
+        with self._cond:
+            self._executando.discard(routine.id)
+            self._inserir(routine, quando)
+            self._cond.notify_all()
+
+    def remover(self, id_routine: int):
+        with self._cond:
+            if id_routine not in self._executando:
+                self._rotinas.pop(id_routine, None)
+
+    def _topo(self) -> Optional[Tuple[dt, int]]:
+        """Descarta entradas obsoletas e retorna (data, id) da próxima rotina válida."""
+        while self._heap:
+            quando, _, id_routine = self._heap[0]
+            atual = self._rotinas.get(id_routine)
+            if atual is not None and atual[0] == quando:
+                return quando, id_routine
+            heapq.heappop(self._heap)
+        return None
+
+    def retirar_devidas(self, agora: dt) -> List[Any]:
+        """Remove do índice e retorna as rotinas com data <= agora."""
+        devidas = []
+        with self._cond:
+            while True:
+                topo = self._topo()
+                if topo is None or topo[0] > agora:
+                    break
+                heapq.heappop(self._heap)
+                devidas.append(self._rotinas.pop(topo[1])[1])
+                self._executando.add(topo[1])
+        return devidas
+
+    def proxima(self) -> Optional[dt]:
+        with self._cond:
+            topo = self._topo()
+            return topo[0] if topo else None
+
+    def aguardar(self, limite: float):
+        """Bloqueia até a próxima rotina vencer, o índice mudar ou 'limite' segundos."""
+        with self._cond:
+            topo = self._topo()
+            espera = limite
+            if topo is not None:
+                espera = min(limite, max(0.0, (topo[0] - dt.now()).total_seconds()))
+            if espera > 0:
+                self._cond.wait(espera)
+
+    def acordar(self):
+        with self._cond:
+            self._cond.notify_all()
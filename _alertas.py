@@ -0,0 +1,202 @@
+"""Alertas de erro por e-mail: deduplicados, agrupados em resumos e enviados fora da thread da rotina."""
+
+import logging
+import re
+import traceback
+from atexit import register
+from collections import deque
+from datetime import datetime as dt
+from os import getenv
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from _metricas import metricas
+
+# Intervalo entre resumos de erros repetidos (segundos)
+ALERT_DIGEST_SECONDS = float(getenv("ALERT_DIGEST_SECONDS", "900"))
+# Tempo em que a mesma falha (rotina + erro) não gera novo alerta imediato (segundos)
+ALERT_DEDUP_SECONDS = float(getenv("ALERT_DEDUP_SECONDS", "3600"))
+# Alertas imediatos por intervalo de resumo; o excedente vai para o próximo resumo
+ALERT_MAX_IMMEDIATE = int(getenv("ALERT_MAX_IMMEDIATE", "5"))
+
+# Números variáveis (ids, horários, portas) não devem separar falhas iguais
+_NUMEROS = re.compile(r"\d+")
+_MENSAGEM_MAX = 200
+
+_Assinatura = Tuple[str, str]
+
+
+def assinatura(err: "str | Exception") -> _Assinatura:
+    """Tipo do erro e primeira linha da mensagem, sem os números."""
+    tipo = type(err).__name__ if isinstance(err, Exception) else "Erro"
+    linhas = str(err).strip().splitlines()
+    return tipo, _NUMEROS.sub("#", linhas[0] if linhas else "")[:_MENSAGEM_MAX]
+
+
+def detalhes(err: "str | Exception") -> str:
+    # Se for uma exceção real, pegamos o rastro completo (traceback)
+    if isinstance(err, Exception):
+        return "".join(traceback.format_exception(None, err, err.__traceback__))
+    return str(err)
+
+
+class _Ocorrencias:
+    """Falhas de mesma assinatura acumuladas para o resumo."""
+
+    def __init__(self, exemplo: str):
+        self.total = 0
+        self.rotinas: Dict[str, int] = {}
+        self.primeira = dt.now()
+        self.ultima = self.primeira
+        self.exemplo = exemplo
+
+    def somar(self, rotina: str):
+        self.total += 1
+        self.rotinas[rotina] = self.rotinas.get(rotina, 0) + 1
+        self.ultima = dt.now()
+
+
+class ErrorNotifier:
+    """
+    Recebe as falhas das rotinas e envia os alertas em uma thread própria.
+
+    A primeira ocorrência de cada rotina + erro gera um alerta imediato, limitado a
+    ALERT_MAX_IMMEDIATE por ALERT_DIGEST_SECONDS. Repetições dentro de ALERT_DEDUP_SECONDS
+    e o que passar do limite são agrupados por erro e enviados em um único resumo a cada
+    ALERT_DIGEST_SECONDS, com a contagem e as rotinas afetadas. Assim uma queda do banco
+    gera poucos e-mails em vez de um por rotina a cada minuto.
+    """
+
+    _instancia: Optional["ErrorNotifier"] = None
+    _instancia_lock = Lock()
+
+    def __init__(self, intervalo: float = ALERT_DIGEST_SECONDS, dedup: float = ALERT_DEDUP_SECONDS,
+                 max_imediatos: int = ALERT_MAX_IMMEDIATE):
+        self.intervalo = intervalo
+        self.dedup = dedup
+        self.max_imediatos = max_imediatos
+        self._lock = Lock()
+        self._acordar = Event()
+        self._imediatos: Deque[Tuple[str, str]] = deque()
+        self._enviados: Deque[float] = deque()
+        # (rotina, assinatura) -> momento do último alerta imediato
+        self._notificados: Dict[Tuple[str, _Assinatura], float] = {}
+        self._resumo: Dict[_Assinatura, _Ocorrencias] = {}
+        self._proximo_resumo = monotonic() + intervalo
+        self._thread = Thread(target=self._loop, name="alertas-erro", daemon=True)
+        self._thread.start()
+        register(self.encerrar)
+
+    @classmethod
+    def instancia(cls) -> "ErrorNotifier":
+        with cls._instancia_lock:
+            if cls._instancia is None:
+                cls._instancia = cls()
+            return cls._instancia
+
+    def _permitir_imediato(self, agora: float) -> bool:
+        while self._enviados and agora - self._enviados[0] > self.intervalo:
+            self._enviados.popleft()
+        if len(self._enviados) >= self.max_imediatos:
+            return False
+        self._enviados.append(agora)
+        return True
+
+    def registrar(self, err: "str | Exception", rotina: str):
+        """Registra a falha e retorna sem esperar pelo SMTP."""
+        chave = (rotina, assinatura(err))
+        texto = detalhes(err)
+        agora = monotonic()
+        with self._lock:
+            visto = self._notificados.get(chave)
+            if (visto is None or agora - visto >= self.dedup) and self._permitir_imediato(agora):
+                self._notificados[chave] = agora
+                self._imediatos.append((rotina, texto))
+                acao = "imediato"
+            else:
+                ocorrencias = self._resumo.get(chave[1])
+                if ocorrencias is None:
+                    ocorrencias = self._resumo[chave[1]] = _Ocorrencias(texto)
+                ocorrencias.somar(rotina)
+                acao = "agrupado"
+        metricas.incrementar("alertas_erro_total", acao=acao)
+        if acao == "imediato":
+            self._acordar.set()
+        else:
+            logging.info(f"Falha em '{rotina}' agrupada no próximo resumo de erros.")
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(max(0.0, self._proximo_resumo - monotonic()))
+            self._acordar.clear()
+            self._enviar_imediatos()
+            if monotonic() >= self._proximo_resumo:
+                self._proximo_resumo = monotonic() + self.intervalo
+                self._enviar_resumo()
+
+    def _enviar_imediatos(self):
+        while True:
+            with self._lock:
+                if not self._imediatos:
+                    return
+                rotina, texto = self._imediatos.popleft()
+            corpo = (
+                f"⚠️ ALERTA DE FALHA EM ROTINA\n"
+                f"------------------------------------------\n"
+                f"Rotina: {rotina}\n"
+                f"Data/Hora: {dt.now().strftime('%d/%m/%Y %H:%M:%S')}\n"
+                f"\nDetalhes Técnicos:\n"
+                f"{texto}\n"
+                f"------------------------------------------\n"
+                f"Repetições desta falha serão enviadas no resumo de erros.\n"
+                f"Favor verificar o servidor de automações."
+            )
+            self._enviar(f"🚨 ERRO CRÍTICO: {rotina}", corpo)
+
+    def _enviar_resumo(self):
+        with self._lock:
+            resumo, self._resumo = self._resumo, {}
+            # Libera a memória de falhas que já saíram da janela de deduplicação
+            limite = monotonic() - self.dedup
+            self._notificados = {k: v for k, v in self._notificados.items() if v >= limite}
+        if not resumo:
+            return
+
+        total = sum(o.total for o in resumo.values())
+        rotinas: Set[str] = set()
+        blocos: List[str] = []
+        for (tipo, mensagem), o in sorted(resumo.items(), key=lambda item: -item[1].total):
+            rotinas.update(o.rotinas)
+            afetadas = ", ".join(f"{nome} ({qtd}x)" for nome, qtd in sorted(o.rotinas.items()))
+            blocos.append(
+                f"{tipo}: {mensagem}\n"
+                f"Ocorrências: {o.total} | Primeira: {o.primeira.strftime('%d/%m/%Y %H:%M:%S')} | "
+                f"Última: {o.ultima.strftime('%d/%m/%Y %H:%M:%S')}\n"
+                f"Rotinas: {afetadas}\n"
+                f"\nExemplo:\n{o.exemplo}"
+            )
+        corpo = (
+            f"⚠️ RESUMO DE FALHAS EM ROTINAS\n"
+            f"------------------------------------------\n"
+            f"{total} ocorrência(s) de {len(resumo)} erro(s) em {len(rotinas)} rotina(s).\n\n"
+            + "\n------------------------------------------\n".join(blocos)
+            + "\n------------------------------------------\n"
+            f"Favor verificar o servidor de automações."
+        )
+        self._enviar(f"🚨 Resumo de erros: {total} falha(s) em {len(rotinas)} rotina(s)", corpo)
+
+    def _enviar(self, titulo: str, corpo: str):
+        try:
+            # Importado aqui para que o módulo não carregue o e-mail na inicialização
+            from _emails import Email
+            Email(para=getenv("EMAIL_RECIPIENTS_ERROR"), titulo=titulo, corpo_texto=corpo).enviar()
+            metricas.incrementar("alertas_erro_enviados_total")
+            logging.warning(f"Notificação de erro enviada: {titulo}")
+        except Exception as e:
+            logging.critical(f"Falha ao enviar e-mail de notificação de erro: {e}", exc_info=True)
+
+    def encerrar(self):
+        """Envia os alertas pendentes e o resumo acumulado antes de sair."""
+        self._enviar_imediatos()
+        self._enviar_resumo()
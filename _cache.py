@@ -0,0 +1,167 @@
+"""Caches em memória compartilhados entre as threads do serviço."""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+_AUSENTE = object()
+
+
+class TTLCache:
+    """Cache chave -> valor com expiração por tempo e invalidação explícita."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._dados: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = Lock()
+
+    def get(self, chave: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._dados.get(chave, _AUSENTE)
+            if item is _AUSENTE:
+                return default
+            expira, valor = item
+            if expira < monotonic():
+                del self._dados[chave]
+                return default
+            return valor
+
+    def __contains__(self, chave: Hashable) -> bool:
+        return self.get(chave, _AUSENTE) is not _AUSENTE
+
+    def set(self, chave: Hashable, valor: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._dados[chave] = (monotonic() + (self.ttl if ttl is None else ttl), valor)
+
+    def invalidar(self, chave: Hashable = _AUSENTE):
+        """Remove uma chave ou, sem argumento, todo o conteúdo."""
+        with self._lock:
+            if chave is _AUSENTE:
+                self._dados.clear()
+            else:
+                self._dados.pop(chave, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._dados)
+
+
+class SizedLRUCache:
+    """Cache LRU limitado pela soma dos tamanhos (bytes) informados para os valores."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.tamanho = 0
+        self._dados: "OrderedDict[Hashable, Tuple[int, Any]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, chave: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._dados.get(chave, _AUSENTE)
+            if item is _AUSENTE:
+                return default
+            self._dados.move_to_end(chave)
+            return item[1]
+
+    def set(self, chave: Hashable, valor: Any, tamanho: int):
+        with self._lock:
+            antigo = self._dados.pop(chave, None)
+            if antigo is not None:
+                self.tamanho -= antigo[0]
+            if tamanho > self.max_bytes:
+                return
+            self._dados[chave] = (tamanho, valor)
+            self.tamanho += tamanho
+            while self.tamanho > self.max_bytes:
+                _, (removido, _) = self._dados.popitem(last=False)
+                self.tamanho -= removido
+
+    def invalidar(self, chave: Hashable = _AUSENTE):
+        with self._lock:
+            if chave is _AUSENTE:
+                self._dados.clear()
+                self.tamanho = 0
+            else:
+                item = self._dados.pop(chave, None)
+                if item is not None:
+                    self.tamanho -= item[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._dados)
+
+
+class DirectoryIndex:
+    """
+    Listagem de pastas em memória, refeita apenas quando o mtime da pasta muda
+    (arquivo criado, removido ou renomeado). Alterações no conteúdo de um arquivo
+    são detectadas por quem o lê (ex.: cache de partes MIME por mtime/tamanho).
+    """
+
+    def __init__(self):
+        self._pastas: Dict[Path, Tuple[int, List[Path]]] = {}
+        self._lock = Lock()
+
+    def listar(self, pasta: Path) -> List[Path]:
+        try:
+            carimbo = pasta.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            item = self._pastas.get(pasta)
+        if item is None or item[0] != carimbo:
+            item = (carimbo, list(pasta.glob("*")))
+            with self._lock:
+                self._pastas[pasta] = item
+        return list(item[1])
+
+
+class SingleFlight:
+    """
+    Chamadas com a mesma chave executam a função uma única vez: quem chega enquanto
+    ela roda aguarda o mesmo resultado. Com 'janela' > 0, o resultado concluído ainda
+    vale por esse tempo, mas só para chamadas da mesma 'rodada' (ex.: horário agendado)
+    e de outra 'origem' que não a que o produziu. A espera por uma execução em andamento
+    também exige a mesma rodada. Erros são repassados a todos que aguardavam, mas não
+    ficam guardados.
+    """
+
+    def __init__(self, janela: float):
+        self.janela = janela
+        self._lock = Lock()
+        self._em_voo: Dict[Tuple[Hashable, Hashable], Future] = {}
+        self._resultados = TTLCache(janela)
+
+    def executar(self, chave: Hashable, fn: Callable[..., Any], *args,
+                 rodada: Hashable = None, origem: Hashable = None) -> Tuple[Any, bool]:
+        """Retorna (resultado, compartilhado) — compartilhado=False para quem executou 'fn'."""
+        with self._lock:
+            item = self._resultados.get(chave)
+            if item is not None and item[0] == rodada and item[1] != origem:
+                return item[2], True
+            # Uma pré-geração de outro horário não serve a esta chamada, mesmo em andamento
+            voo = (chave, rodada)
+            futuro = self._em_voo.get(voo)
+            dono = futuro is None
+            if dono:
+                futuro = self._em_voo[voo] = Future()
+
+        if not dono:
+            return futuro.result(), True
+
+        try:
+            valor = fn(*args)
+        except BaseException as e:
+            with self._lock:
+                self._em_voo.pop(voo, None)
+            futuro.set_exception(e)
+            raise
+        with self._lock:
+            if self.janela > 0:
+                self._resultados.set(chave, (rodada, origem, valor))
+            self._em_voo.pop(voo, None)
+        futuro.set_result(valor)
+        return valor, False
@@ -1,8 +1,14 @@
 """Manipulação de banco de dados Oracle utilizando python-oracledb."""
 
 import logging
+from concurrent.futures import Future, TimeoutError as FuturoTimeout
+from contextlib import ExitStack, contextmanager
 from os import getenv
-from typing import Any, Dict, List, Optional
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from _metricas import metricas
 
 try:
     import oracledb
@@ -10,6 +16,9 @@ try:
 except ImportError:
     logging.error("Biblioteca 'oracledb' não instalada. Execute: pip install oracledb")
 
+    class InterfaceError(Exception):
+        """Substituto usado quando 'oracledb' não está instalado (ex.: banco local)."""
+
 try:
     from dotenv import load_dotenv
     load_dotenv()
@@ -21,32 +30,301 @@ DB_USER = getenv("DB_USER")
 DB_PASS = getenv("DB_PASS")
 DB_DSN = getenv("DB_DSN")
 
-class DB:
-    def __init__(self):
-        """Inicializa o Pool de Conexões Oracle."""
+# Tamanho do pool: DB_POOL_MIN conexões são abertas na criação, até DB_POOL_MAX sob demanda
+DB_POOL_MIN = int(getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(getenv("DB_POOL_MAX", "10"))
+
+# Espera máxima por uma conexão livre do pool (segundos)
+DB_ACQUIRE_TIMEOUT = float(getenv("DB_ACQUIRE_TIMEOUT_SECONDS", "30"))
+# Tempo máximo de cada chamada ao banco (segundos; 0 = sem limite). A coluna TIMEOUT da rotina tem precedência.
+DB_CALL_TIMEOUT = float(getenv("DB_CALL_TIMEOUT_SECONDS", "0"))
+# Teto do ajuste automático do pool conforme a demanda (0 = tamanho fixo em DB_POOL_MAX)
+DB_POOL_ADAPTIVE_MAX = int(getenv("DB_POOL_ADAPTIVE_MAX", "0"))
+# Ciclos seguidos com demanda menor antes de reduzir o pool
+_CICLOS_PARA_REDUZIR = 5
+
+# Tamanho dos lotes de leitura para consultas em streaming
+DB_ARRAYSIZE = int(getenv("DB_ARRAYSIZE", "5000"))
+DB_PREFETCHROWS = int(getenv("DB_PREFETCHROWS", str(DB_ARRAYSIZE + 1)))
+
+# Janela de agrupamento das escritas com chave (ms). 0 desativa o agrupamento.
+DB_WRITE_FLUSH_MS = int(getenv("DB_WRITE_FLUSH_MS", "200"))
+# Espera máxima por uma escrita agrupada (s): algumas janelas mais a obtenção de conexão
+DB_WRITE_WAIT_SECONDS = float(getenv(
+    "DB_WRITE_WAIT_SECONDS", str(5 * DB_WRITE_FLUSH_MS / 1000 + DB_ACQUIRE_TIMEOUT)
+))
+
+
+_pyarrow_modulo: Any = None
+
+
+def _pyarrow() -> Any:
+    """pyarrow, carregado no primeiro uso (é pesado); None se não estiver instalado."""
+    global _pyarrow_modulo
+    if _pyarrow_modulo is None:
         try:
-            # O Pool gerencia as conexões automaticamente, evitando 'Timed Out'
-            self.pool = create_pool(
-                user=DB_USER,
-                password=DB_PASS,
-                dsn=DB_DSN,
-                min=2,
-                max=10,
-                increment=1
-            )
-            logging.info("Pool de conexões Oracle estabelecido com sucesso.")
-        except Exception as e:
-            logging.critical(f"Falha crítica ao conectar no Banco: {e}")
-            raise
+            import pyarrow
+            _pyarrow_modulo = pyarrow
+        except ImportError:
+            logging.warning("Biblioteca 'pyarrow' não instalada: relatórios em colunas usam o cursor comum.")
+            _pyarrow_modulo = False
+    return _pyarrow_modulo or None
+
+
+def _numeros_como_cursor(pa: Any, coluna: Any) -> Any:
+    """
+    Colunas NUMBER chegam do Arrow como decimal128; o cursor comum entrega int (escala 0)
+    ou float. Converte para que os dois caminhos gerem o mesmo relatório.
+    """
+    tipo = coluna.type
+    if not pa.types.is_decimal(tipo):
+        return coluna
+    try:
+        return coluna.cast(pa.int64() if tipo.scale == 0 else pa.float64())
+    except (pa.ArrowInvalid, OverflowError):
+        # Inteiros maiores que int64: valores Python, como no cursor comum
+        converter = int if tipo.scale == 0 else float
+        return [None if v is None else converter(v) for v in coluna.to_pylist()]
+
 
-    def consultar(self, query: str, params: Optional[List] = None) -> Dict[str, Any]:
+class WriteBatcher:
+    """
+    Agrupa comandos de escrita enviados dentro de uma janela de tempo.
+
+    A cada descarga os comandos são distribuídos em rodadas: o n-ésimo comando de
+    uma chave (ex.: id da rotina) vai para a rodada n, preservando a ordem por chave.
+    Dentro de cada rodada, comandos com o mesmo SQL viram um único executemany, e
+    toda a descarga usa um único commit.
+    """
+
+    def __init__(self, db: "DB", janela_ms: int = DB_WRITE_FLUSH_MS):
+        self._db = db
+        self._janela = janela_ms / 1000
+        self._pendentes: List[Tuple[Hashable, str, List, Future]] = []
+        # Último comando enfileirado de cada chave, para quem precisa esperar a gravação
+        self._ultimos: Dict[Hashable, Future] = {}
+        self._cond = Condition()
+        self._descarga = Lock()
+        self._ativo = True
+        Thread(target=self._loop, name="db-write-batcher", daemon=True).start()
+
+    def enfileirar(self, chave: Hashable, sql: str, params: List) -> Future:
+        futuro = Future()
+        with self._cond:
+            ativo = self._ativo
+            if ativo:
+                self._pendentes.append((chave, sql, params, futuro))
+                self._ultimos[chave] = futuro
+                self._cond.notify()
+        if not ativo:
+            # Após o encerramento grava na hora, fora do lock para não travar os demais
+            futuro.set_result(self._db.executar(sql, params))
+        return futuro
+
+    def aguardar(self, chave: Hashable, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a descarga do último comando enfileirado com a chave; True se foi gravado,
+        False se falhou ou não terminou em 'timeout'. Só o sucesso é esquecido, para
+        que uma espera posterior ainda veja a falha.
+        """
+        with self._cond:
+            futuro = self._ultimos.get(chave)
+        if futuro is None:
+            return True
+        try:
+            gravado = futuro.result(timeout)
+        except FuturoTimeout:
+            logging.warning(f"Escritas da chave {chave} não descarregadas em {timeout:g}s.")
+            return False
+        if gravado:
+            with self._cond:
+                if self._ultimos.get(chave) is futuro:
+                    del self._ultimos[chave]
+        return gravado
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._ativo and not self._pendentes:
+                    self._cond.wait()
+                if not self._ativo:
+                    return
+                # Espera a janela fechar (o wait libera o lock para acumular mais comandos)
+                prazo = monotonic() + self._janela
+                while self._ativo and prazo > monotonic():
+                    self._cond.wait(prazo - monotonic())
+            self.descarregar()
+
+    def descarregar(self):
+        """Grava imediatamente tudo o que está pendente."""
+        with self._descarga:
+            with self._cond:
+                lote, self._pendentes = self._pendentes, []
+            if not lote:
+                return
+
+            rodadas: List[Dict[str, List[List]]] = []
+            vistos: Dict[Hashable, int] = {}
+            for chave, sql, params, _ in lote:
+                n = vistos.get(chave, 0)
+                vistos[chave] = n + 1
+                if n == len(rodadas):
+                    rodadas.append({})
+                rodadas[n].setdefault(sql, []).append(params)
+
+            grupos = [(sql, lista) for rodada in rodadas for sql, lista in rodada.items()]
+            if self._db.executar_lote(grupos):
+                for *_, futuro in lote:
+                    futuro.set_result(True)
+                return
+
+            # Falha no lote: reexecuta um a um, na ordem original, para isolar o comando com erro
+            logging.warning(f"Lote de {len(lote)} comando(s) falhou; reexecutando individualmente.")
+            for _, sql, params, futuro in lote:
+                futuro.set_result(self._db.executar(sql, params))
+
+    def encerrar(self):
+        with self._cond:
+            self._ativo = False
+            self._cond.notify_all()
+        self.descarregar()
+
+
+class PoolEsgotado(Exception):
+    """Nenhuma conexão do pool ficou livre dentro de DB_ACQUIRE_TIMEOUT_SECONDS."""
+
+
+def criar_pool(minimo: int, maximo: int, nome: str = "principal") -> Any:
+    """Cria um pool de conexões Oracle com as credenciais do .env."""
+    try:
+        # O Pool gerencia as conexões automaticamente, evitando 'Timed Out'.
+        # TIMEDWAIT: sem conexão livre, espera no máximo DB_ACQUIRE_TIMEOUT em vez de indefinidamente.
+        pool = create_pool(
+            user=DB_USER,
+            password=DB_PASS,
+            dsn=DB_DSN,
+            min=minimo,
+            max=max(maximo, minimo),
+            increment=1,
+            getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+            wait_timeout=int(DB_ACQUIRE_TIMEOUT * 1000)
+        )
+        logging.info(f"Pool de conexões Oracle '{nome}' estabelecido com sucesso.")
+        return pool
+    except Exception as e:
+        logging.critical(f"Falha crítica ao conectar no Banco: {e}")
+        raise
+
+
+class DB:
+    def __init__(self, pool: Any = None):
+        """
+        Inicializa o Pool de Conexões Oracle.
+
+        'pool' permite injetar um substituto compatível (ex.: _local_db.LocalPool).
+        """
+        self._batcher: Optional[WriteBatcher] = None
+        self._batcher_lock = Lock()
+        self._esgotamentos = 0
+        self._espera_max = 0.0
+        self._estatisticas_lock = Lock()
+        self._ciclos_abaixo = 0
+
+        if pool is not None:
+            self.pool = pool
+            return
+
+        self.pool = criar_pool(DB_POOL_MIN, DB_POOL_MAX)
+
+    @contextmanager
+    def _conexao(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Conexão do pool com espera limitada e tempo máximo por chamada ('timeout' em
+        segundos; padrão DB_CALL_TIMEOUT). O limite é desfeito antes de devolver a conexão.
+        """
+        inicio = monotonic()
+        with ExitStack() as pilha:
+            try:
+                connection = pilha.enter_context(self.pool.acquire())
+            except Exception as e:
+                espera = monotonic() - inicio
+                if "DPY-4005" in str(e) or isinstance(e, TimeoutError):
+                    with self._estatisticas_lock:
+                        self._esgotamentos += 1
+                    metricas.incrementar("db_pool_esgotado_total")
+                    raise PoolEsgotado(
+                        f"Nenhuma conexão livre em {espera:.1f}s "
+                        f"(ocupadas {self.pool.busy}/{self.pool.max}). Aumente DB_POOL_MAX ou reduza as filas do executor."
+                    ) from e
+                raise
+
+            espera = monotonic() - inicio
+            with self._estatisticas_lock:
+                self._espera_max = max(self._espera_max, espera)
+            metricas.observar("db_pool_espera_segundos", espera)
+
+            limite = DB_CALL_TIMEOUT if timeout is None else timeout
+            connection.call_timeout = int(limite * 1000)
+            try:
+                yield connection
+            finally:
+                try:
+                    connection.call_timeout = 0
+                except Exception:
+                    pass
+
+    def estatisticas_pool(self) -> Dict[str, Any]:
+        """Uso atual do pool e contadores de espera desde o início do serviço."""
+        with self._estatisticas_lock:
+            esgotamentos, espera_max = self._esgotamentos, self._espera_max
+        return {
+            "ocupadas": self.pool.busy,
+            "abertas": self.pool.opened,
+            "min": self.pool.min,
+            "max": self.pool.max,
+            "esgotamentos": esgotamentos,
+            "espera_max_s": round(espera_max, 3),
+        }
+
+    def ajustar_pool(self, demanda: int):
+        """
+        Com DB_POOL_ADAPTIVE_MAX, ajusta o máximo do pool à demanda (conexões que as
+        rotinas devidas vão usar), entre DB_POOL_MAX e DB_POOL_ADAPTIVE_MAX. Cresce na
+        hora; só reduz depois de alguns ciclos seguidos com demanda menor.
+        """
+        if DB_POOL_ADAPTIVE_MAX <= 0 or not hasattr(self.pool, "reconfigure"):
+            return
+        alvo = max(DB_POOL_MAX, min(DB_POOL_ADAPTIVE_MAX, demanda))
+        atual = self.pool.max
+        if alvo < atual:
+            self._ciclos_abaixo += 1
+            if self._ciclos_abaixo < _CICLOS_PARA_REDUZIR:
+                return
+        self._ciclos_abaixo = 0
+        if alvo != atual:
+            self.pool.reconfigure(max=alvo)
+            logging.info(f"Pool de conexões ajustado: máximo {atual} -> {alvo} (demanda {demanda}).")
+
+    def aquecer(self, conexoes: int) -> int:
+        """
+        Abre e valida 'conexoes' conexões simultâneas (limitado ao máximo do pool) e as
+        devolve ao pool, para que o primeiro ciclo não pague o custo de conexão.
+        Retorna quantas conexões ficaram prontas.
+        """
+        conexoes = min(conexoes, getattr(self.pool, "max", conexoes))
+        with ExitStack() as pilha:
+            for _ in range(conexoes):
+                pilha.enter_context(self._conexao()).ping()
+        return conexoes
+
+    def consultar(self, query: str, params: Optional[List] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
         """
         Executa uma consulta e retorna um dicionário com:
         - 'data': Lista de registros (cada registro é uma lista)
         - 'description': Metadados das colunas
         """
         try:
-            with self.pool.acquire() as connection:
+            with self._conexao(timeout) as connection:
                 with connection.cursor() as cursor:
                     if params:
                         cursor.execute(query, params)
@@ -66,10 +344,118 @@ class DB:
             logging.error(f"Erro ao executar consulta SQL: {e}")
             raise Exception(f"Erro ao executar consulta SQL: {e}")
 
-    def executar(self, sql: str, params: Optional[List] = None) -> bool:
-        """Executa comandos de INSERT, UPDATE, DELETE ou PROCEDURE."""
+    def consultar_stream(
+        self,
+        query: str,
+        params: Optional[List] = None,
+        arraysize: Optional[int] = None,
+        prefetchrows: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Iterator[Any]:
+        """
+        Executa a consulta uma única vez e devolve os resultados sob demanda:
+        - 1º item: metadados das colunas (cursor.description)
+        - demais itens: lotes de registros (lista de tuplas) com até 'arraysize' linhas
+
+        A conexão fica reservada até o gerador ser consumido ou fechado; 'timeout'
+        limita cada ida ao banco (execução e cada busca de lote).
+        """
         try:
-            with self.pool.acquire() as connection:
+            with self._conexao(timeout) as connection:
+                with connection.cursor() as cursor:
+                    cursor.arraysize = arraysize or DB_ARRAYSIZE
+                    cursor.prefetchrows = prefetchrows or DB_PREFETCHROWS
+                    if params:
+                        cursor.execute(query, params)
+                    else:
+                        cursor.execute(query)
+
+                    yield cursor.description
+
+                    while True:
+                        lote = cursor.fetchmany()
+                        if not lote:
+                            break
+                        yield lote
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            logging.error(f"Erro ao executar consulta SQL (streaming): {e}")
+            raise Exception(f"Erro ao executar consulta SQL: {e}")
+
+    def consultar_colunas(
+        self,
+        query: str,
+        params: Optional[List] = None,
+        tamanho: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Iterator[Any]:
+        """
+        Como consultar_stream, mas cada lote vem em colunas:
+        - 1º item: nomes das colunas
+        - demais itens: lista com os valores de cada coluna (até 'tamanho' linhas)
+
+        Com pyarrow instalado e o driver oracledb, a busca usa fetch_df_batches e as
+        colunas são arrays Arrow (sem criar uma tupla Python por linha), com NUMBER
+        convertido para inteiro/float como no cursor comum; caso contrário, os lotes do
+        cursor são transpostos.
+        """
+        tamanho = tamanho or DB_ARRAYSIZE
+        try:
+            with self._conexao(timeout) as connection:
+                pa = _pyarrow() if hasattr(connection, "fetch_df_batches") else None
+                if pa is not None:
+                    nomes = None
+                    for df in connection.fetch_df_batches(query, params or [], size=tamanho):
+                        tabela = pa.table(df)
+                        if nomes is None:
+                            nomes = tabela.column_names
+                            yield nomes
+                        yield [_numeros_como_cursor(pa, coluna.combine_chunks()) for coluna in tabela.columns]
+                    if nomes is None:
+                        # Resultado vazio não traz lotes: os nomes vêm do parse, sem executar a consulta de novo
+                        with connection.cursor() as cursor:
+                            cursor.parse(query)
+                            yield [c[0] for c in cursor.description]
+                    return
+
+                # Sem Arrow: cursor comum
+                with connection.cursor() as cursor:
+                    cursor.arraysize = tamanho
+                    cursor.prefetchrows = DB_PREFETCHROWS
+                    if params:
+                        cursor.execute(query, params)
+                    else:
+                        cursor.execute(query)
+
+                    yield [c[0] for c in cursor.description]
+
+                    while True:
+                        lote = cursor.fetchmany()
+                        if not lote:
+                            break
+                        yield list(zip(*lote))
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            logging.error(f"Erro ao executar consulta SQL (colunas): {e}")
+            raise Exception(f"Erro ao executar consulta SQL: {e}")
+
+    def executar(self, sql: str, params: Optional[List] = None, chave: Optional[Hashable] = None) -> bool:
+        """
+        Executa comandos de INSERT, UPDATE, DELETE ou PROCEDURE.
+
+        Com 'chave' (ex.: id da rotina), o comando entra no WriteBatcher e é gravado
+        na próxima descarga, mantendo a ordem entre comandos da mesma chave. Nesse caso
+        o retorno só indica que o comando foi aceito (ou o resultado, se já gravado);
+        o resultado da gravação vem de aguardar_escritas.
+        """
+        if chave is not None and DB_WRITE_FLUSH_MS > 0:
+            futuro = self._get_batcher().enfileirar(chave, sql, params or [])
+            return futuro.result() if futuro.done() else True
+
+        try:
+            with self._conexao() as connection:
                 with connection.cursor() as cursor:
                     if params:
                         cursor.execute(sql, params)
@@ -79,4 +465,87 @@ class DB:
                     return True
         except Exception as e:
             logging.error(f"Erro ao executar comando SQL (Commit cancelado): {e}")
-            return False
\ No newline at end of file
+            return False
+
+    def executar_lote(self, grupos: List[Tuple[str, List[List]]]) -> bool:
+        """Executa um executemany por grupo (sql, lista de params) com um único commit."""
+        try:
+            with self._conexao() as connection:
+                with connection.cursor() as cursor:
+                    for sql, lista in grupos:
+                        cursor.executemany(sql, lista)
+                    connection.commit()
+                    return True
+        except Exception as e:
+            logging.error(f"Erro ao executar lote de comandos SQL (Commit cancelado): {e}")
+            return False
+
+    def _get_batcher(self) -> WriteBatcher:
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = WriteBatcher(self)
+            return self._batcher
+
+    def aguardar_escritas(self, chave: Hashable, timeout: float = DB_WRITE_WAIT_SECONDS) -> bool:
+        """
+        Espera a gravação das escritas agrupadas com 'chave' (até o último comando
+        enfileirado), por no máximo 'timeout' segundos. True se não havia pendência ou
+        se o último comando foi gravado; False se ele falhou ou não terminou no prazo.
+        """
+        batcher = self._batcher
+        return batcher.aguardar(chave, timeout) if batcher is not None else True
+
+    def descarregar_escritas(self):
+        """Grava as escritas agrupadas pendentes (usar antes de encerrar o serviço)."""
+        if self._batcher is not None:
+            self._batcher.encerrar()
+            self._batcher = None
+
+    def reivindicar_rotinas(
+        self,
+        sql_candidatas: str,
+        sql_claim: str,
+        dono: str,
+        lease_segundos: int
+    ) -> Dict[str, Any]:
+        """
+        Seleciona e reivindica as rotinas devidas em uma única transação.
+
+        'sql_candidatas' pode usar FOR UPDATE SKIP LOCKED para que outras instâncias
+        ignorem as linhas já travadas. 'sql_claim' é um UPDATE condicional
+        (params: dono, lease_segundos, id) que só afeta a linha se ela estiver livre
+        ou com o lease vencido; apenas as linhas efetivamente atualizadas são devolvidas,
+        no mesmo formato de consultar().
+        """
+        try:
+            with self._conexao() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql_candidatas)
+                    description = cursor.description
+                    candidatas = [list(row) for row in cursor.fetchall()]
+
+                    reivindicadas = []
+                    for row in candidatas:
+                        cursor.execute(sql_claim, [dono, lease_segundos, row[0]])
+                        if cursor.rowcount == 1:
+                            reivindicadas.append(row)
+                    connection.commit()
+                    return {
+                        "data": reivindicadas,
+                        "description": description
+                    }
+        except Exception as e:
+            logging.error(f"Erro ao reivindicar rotinas: {e}")
+            raise Exception(f"Erro ao reivindicar rotinas: {e}")
+
+    def reivindicar(self, sql_claim: str, dono: str, lease_segundos: int, id_rotina: int) -> bool:
+        """Reivindica uma única rotina; True se o UPDATE condicional afetou a linha."""
+        try:
+            with self._conexao() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql_claim, [dono, lease_segundos, id_rotina])
+                    connection.commit()
+                    return cursor.rowcount == 1
+        except Exception as e:
+            logging.error(f"Erro ao reivindicar a rotina {id_rotina}: {e}")
+            return False
@@ -1,18 +1,446 @@
 """Módulo de envio de e-mails via SMTP_SSL com suporte a imagens inline (cid)."""
 
+import asyncio
 import logging
+import re
 import smtplib
-from base64 import b64encode
-from email import encoders
+from atexit import register
+from base64 import b64encode, encodebytes
+from concurrent.futures import Future
 from email.mime.base import MIMEBase
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.utils import formatdate
+from email.utils import formatdate, getaddresses
 from os import getenv
 from pathlib import Path
-from time import sleep
-from typing import List, Optional, Any
+from queue import Queue
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, Iterator, List, Optional, Any, Tuple
+from uuid import uuid4
+
+from _cache import SizedLRUCache
+from _metricas import metricas
+
+# Cliente SMTP assíncrono opcional (engine asyncio)
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    logging.warning("Biblioteca 'python-dotenv' não instalada. Certifique-se de que as variáveis de ambiente estão configuradas.")
+
+# Sessões ociosas há mais tempo que isso são descartadas antes do reuso (segundos)
+EMAIL_SESSION_MAX_IDLE = float(getenv("EMAIL_SESSION_MAX_IDLE", "120"))
+# Limite de envios por segundo (substitui o antigo sleep(1) após cada envio)
+EMAIL_RATE_LIMIT = float(getenv("EMAIL_RATE_LIMIT", "1"))
+# Quantidade de threads que esvaziam a fila de saída
+EMAIL_DISPATCH_WORKERS = int(getenv("EMAIL_DISPATCH_WORKERS", "1"))
+# Tamanho máximo dos anexos (já em base64) de uma única mensagem
+EMAIL_MAX_SIZE_MB = float(getenv("EMAIL_MAX_SIZE_MB", "20"))
+# Memória máxima das partes MIME já codificadas reaproveitadas entre envios (informativos)
+EMAIL_PART_CACHE_MB = float(getenv("EMAIL_PART_CACHE_MB", "64"))
+
+# Tempo máximo para conectar/responder do servidor SMTP (segundos)
+EMAIL_TIMEOUT = float(getenv("EMAIL_TIMEOUT", "60"))
+
+# Bytes lidos por vez ao codificar anexos (múltiplo de 57 = uma linha base64 de 76 caracteres)
+_BLOCO_BASE64 = 57 * 1024
+# Linhas iniciadas por '.' são duplicadas no DATA do SMTP (RFC 5321, 4.5.2)
+_PONTO_INICIAL = re.compile(rb"(?m)^\.")
+
+
+def _usar_ssl() -> bool:
+    return getenv("EMAIL_SSL", "1") != "0"
+
+
+def _tamanho_base64(tamanho: int) -> int:
+    """Bytes do anexo codificado: cada 57 bytes viram uma linha de 76 caracteres + CRLF."""
+    return -(-tamanho // 57) * 78
+
+
+def agrupar_anexos(anexos: List[str], max_bytes: int = int(EMAIL_MAX_SIZE_MB * 1024 * 1024)) -> List[List[str]]:
+    """
+    Distribui os anexos em grupos cujo tamanho codificado (base64) cabe em uma mensagem.
+    Levanta ValueError se um anexo sozinho passar do limite: o servidor recusaria a mensagem.
+    """
+    grupos: List[List[str]] = []
+    atual: List[str] = []
+    tamanho_atual = 0
+    for caminho in anexos:
+        tamanho = _tamanho_base64(Path(caminho).stat().st_size)
+        if tamanho > max_bytes:
+            raise ValueError(
+                f"Anexo '{Path(caminho).name}' tem {tamanho / 1024 / 1024:.1f} MB codificado, acima de "
+                f"EMAIL_MAX_SIZE_MB ({max_bytes / 1024 / 1024:.1f} MB). Use FORMATO csv, csv.gz ou zip (divididos "
+                f"em partes de até REPORT_MAX_FILE_MB)."
+            )
+        if atual and tamanho_atual + tamanho > max_bytes:
+            grupos.append(atual)
+            atual, tamanho_atual = [], 0
+        atual.append(caminho)
+        tamanho_atual += tamanho
+    if atual:
+        grupos.append(atual)
+    return grupos
+
+
+def _anexo_base64(path: Path) -> MIMEBase:
+    """Anexo codificado em base64 lendo o arquivo em blocos (sem cópia bruta + cópia codificada)."""
+    part = MIMEBase('application', 'octet-stream')
+    linhas = []
+    with open(path, 'rb') as f:
+        while bloco := f.read(_BLOCO_BASE64):
+            linhas.append(encodebytes(bloco).decode('ascii'))
+    part.set_payload("".join(linhas))
+    part['Content-Transfer-Encoding'] = 'base64'
+    return part
+
+
+def _anexo_marcado(path: Path, marcacoes: Dict[str, Path]) -> MIMEBase:
+    """Anexo com uma marcação no lugar do conteúdo, codificado só durante a transmissão."""
+    marca = f"<anexo-{uuid4().hex}>"
+    marcacoes[marca] = path
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(marca)
+    part['Content-Transfer-Encoding'] = 'base64'
+    return part
+
+
+def _base64_em_blocos(path: Path) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while bloco := f.read(_BLOCO_BASE64):
+            yield encodebytes(bloco).replace(b"\n", b"\r\n")
+
+
+def _blocos_mensagem(msg: MIMEMultipart, marcacoes: Dict[str, Path]) -> Iterator[bytes]:
+    """
+    A mensagem no formato do DATA (CRLF e pontos duplicados), com cada marcação
+    substituída pelo arquivo codificado em base64 bloco a bloco a partir do disco.
+    """
+    # Mesma geração do send_message (política da mensagem, com CRLF)
+    texto = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+    posicao = 0
+    if marcacoes:
+        padrao = re.compile(b"|".join(re.escape(marca.encode('ascii')) for marca in marcacoes))
+        for achado in padrao.finditer(texto):
+            yield _PONTO_INICIAL.sub(b"..", texto[posicao:achado.start()])
+            yield from _base64_em_blocos(marcacoes[achado.group().decode('ascii')])
+            posicao = achado.end()
+    yield _PONTO_INICIAL.sub(b"..", texto[posicao:])
+
+
+def _transmitir(server: smtplib.SMTP, msg: MIMEMultipart, marcacoes: Dict[str, Path]):
+    """
+    Equivalente ao send_message, mas a mensagem vai ao servidor em blocos: os anexos
+    nunca ficam inteiros (nem codificados) na memória.
+    """
+    remetente = getaddresses([msg['From']])[0][1]
+    destinatarios = [
+        endereco for _, endereco in getaddresses(msg.get_all('To', []) + msg.get_all('Cc', []) + msg.get_all('Bcc', []))
+        if endereco
+    ]
+    # Cópia oculta não é transmitida no cabeçalho
+    del msg['Bcc']
+
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(remetente)
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, remetente)
+    recusados = {}
+    for destino in destinatarios:
+        code, resp = server.rcpt(destino)
+        if code not in (250, 251):
+            recusados[destino] = (code, resp)
+    if len(recusados) == len(destinatarios):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(recusados)
+
+    server.putcmd("data")
+    code, resp = server.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    final = b""
+    for bloco in _blocos_mensagem(msg, marcacoes):
+        if bloco:
+            server.send(bloco)
+            final = bloco[-2:]
+    server.send(b".\r\n" if final == b"\r\n" else b"\r\n.\r\n")
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    if recusados:
+        logging.warning(f"Destinatários recusados pelo servidor SMTP: {', '.join(recusados)}")
+
+
+def _codificar(path: Path, imagem: bool) -> Tuple[str, str]:
+    """(content-type, payload base64) do arquivo."""
+    if imagem:
+        with open(path, 'rb') as f:
+            part = MIMEImage(f.read())
+    else:
+        part = _anexo_base64(path)
+    return part.get_content_type(), part.get_payload()
+
+
+def _parte_cacheada(path: Path, imagem: bool = False) -> Optional[MIMEBase]:
+    """
+    Parte MIME do arquivo reaproveitando a codificação base64 enquanto o mtime e o
+    tamanho não mudarem. Retorna None se o arquivo não existir.
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    carimbo = (st.st_mtime_ns, st.st_size)
+    item = _partes.get(str(path))
+    if item is None or item[0] != carimbo:
+        tipo, payload = _codificar(path, imagem)
+        item = (carimbo, tipo, payload)
+        _partes.set(str(path), item, len(payload))
+        metricas.incrementar("email_partes_cache_total", resultado="miss")
+    else:
+        metricas.incrementar("email_partes_cache_total", resultado="hit")
+
+    _, tipo, payload = item
+    part = MIMEBase(*tipo.split('/', 1))
+    part.set_payload(payload)
+    part['Content-Transfer-Encoding'] = 'base64'
+    return part
+
+
+def _autenticar(server: smtplib.SMTP, user: str, password: str):
+    """Autenticação manual via AUTH LOGIN."""
+    user_b64 = b64encode(user.encode('utf-8')).decode('ascii')
+    pass_b64 = b64encode(password.encode('utf-8')).decode('ascii')
+
+    code, resp = server.docmd("AUTH", "LOGIN")
+    if code != 334:
+        raise PermissionError(f"Servidor recusou AUTH LOGIN: {resp}")
+
+    server.docmd(user_b64)
+    code, resp = server.docmd(pass_b64)
+
+    if code != 235:
+        raise PermissionError(f"Autenticação recusada: {resp}")
+
+
+class SMTPPool:
+    """Sessões SMTP autenticadas e reutilizáveis, agrupadas por (host, porta, usuário)."""
+
+    def __init__(self, max_idle: float = EMAIL_SESSION_MAX_IDLE):
+        self.max_idle = max_idle
+        self._lock = Lock()
+        # chave -> lista de (sessão, instante do último uso)
+        self._livres: Dict[Tuple[str, int, str], List[Tuple[smtplib.SMTP, float]]] = {}
+
+    @staticmethod
+    def _conectar(host: str, port: int, user: str, password: str) -> smtplib.SMTP:
+        # EMAIL_SSL=0 permite servidores sem TLS (ex.: sink local do benchmark)
+        classe = smtplib.SMTP_SSL if _usar_ssl() else smtplib.SMTP
+        server = classe(host, port, timeout=EMAIL_TIMEOUT)
+        server.ehlo()
+        _autenticar(server, user, password)
+        return server
+
+    @staticmethod
+    def _fechar(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _saudavel(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def obter(self, host: str, port: int, user: str, password: str) -> smtplib.SMTP:
+        """Retorna uma sessão livre e saudável ou abre uma nova."""
+        chave = (host, port, user)
+        agora = monotonic()
+        while True:
+            with self._lock:
+                livres = self._livres.get(chave)
+                item = livres.pop() if livres else None
+            if item is None:
+                return self._conectar(host, port, user, password)
+
+            server, ultimo_uso = item
+            if agora - ultimo_uso <= self.max_idle and self._saudavel(server):
+                return server
+            self._fechar(server)
+
+    def devolver(self, host: str, port: int, user: str, server: smtplib.SMTP):
+        with self._lock:
+            self._livres.setdefault((host, port, user), []).append((server, monotonic()))
+
+    def descartar(self, server: smtplib.SMTP):
+        self._fechar(server)
+
+    def fechar_todas(self):
+        with self._lock:
+            sessoes = [s for livres in self._livres.values() for s, _ in livres]
+            self._livres.clear()
+        for server in sessoes:
+            self._fechar(server)
+
+
+class _RateLimiter:
+    """Token bucket simples: no máximo 'taxa' envios por segundo."""
+
+    def __init__(self, taxa: float):
+        self.intervalo = 1 / taxa if taxa > 0 else 0
+        self._lock = Lock()
+        self._proximo = 0.0
+
+    def reservar(self) -> float:
+        """Reserva o próximo horário de envio e retorna quantos segundos esperar."""
+        if not self.intervalo:
+            return 0.0
+        with self._lock:
+            agora = monotonic()
+            espera = self._proximo - agora
+            self._proximo = max(agora, self._proximo) + self.intervalo
+        return max(0.0, espera)
+
+    def aguardar(self):
+        espera = self.reservar()
+        if espera > 0:
+            sleep(espera)
+
+
+class EmailDispatcher:
+    """Fila de saída de e-mails esvaziada por threads dedicadas."""
+
+    _instancia: Optional["EmailDispatcher"] = None
+    _instancia_lock = Lock()
+
+    def __init__(self, workers: int = EMAIL_DISPATCH_WORKERS):
+        self._fila: Queue = Queue()
+        self._threads = [
+            Thread(target=self._loop, name=f"email-dispatcher-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+        metricas.registrar_gauge("email_fila", "fila", lambda: {"saida": self.pendentes()})
+        register(self.encerrar)
+
+    @classmethod
+    def instancia(cls) -> "EmailDispatcher":
+        with cls._instancia_lock:
+            if cls._instancia is None:
+                cls._instancia = cls()
+            return cls._instancia
+
+    def enfileirar(self, email: "Email") -> Future:
+        futuro = Future()
+        self._fila.put((email, futuro))
+        return futuro
+
+    def pendentes(self) -> int:
+        return self._fila.qsize()
+
+    def aguardar(self):
+        """Bloqueia até todas as mensagens enfileiradas terem sido processadas."""
+        self._fila.join()
+
+    def _loop(self):
+        while True:
+            item = self._fila.get()
+            if item is None:
+                self._fila.task_done()
+                break
+            email, futuro = item
+            try:
+                if futuro.set_running_or_notify_cancel():
+                    futuro.set_result(email.enviar())
+            except Exception as e:
+                logging.error(f"Falha no envio em segundo plano de '{email.titulo}': {e}")
+                futuro.set_exception(e)
+            finally:
+                self._fila.task_done()
+
+    def encerrar(self):
+        """Aguarda o envio das mensagens pendentes e encerra as threads."""
+        for _ in self._threads:
+            self._fila.put(None)
+        self._fila.join()
+        _pool.fechar_todas()
+
+
+class AsyncSMTPSessions:
+    """Uma sessão aiosmtplib autenticada por (host, porta, usuário), usada de forma serializada."""
+
+    def __init__(self):
+        self._sessoes: Dict[Tuple[str, int, str], Any] = {}
+        self._locks: Dict[Tuple[str, int, str], asyncio.Lock] = {}
+
+    async def _conectar(self, host: str, port: int, user: str, password: str):
+        smtp = aiosmtplib.SMTP(hostname=host, port=port, use_tls=_usar_ssl())
+        await smtp.connect()
+        await smtp.ehlo()
+        resp = await smtp.execute_command(b"AUTH", b"LOGIN")
+        if resp.code != 334:
+            raise PermissionError(f"Servidor recusou AUTH LOGIN: {resp.message}")
+        await smtp.execute_command(b64encode(user.encode('utf-8')))
+        resp = await smtp.execute_command(b64encode(password.encode('utf-8')))
+        if resp.code != 235:
+            raise PermissionError(f"Autenticação recusada: {resp.message}")
+        return smtp
+
+    async def enviar(self, host: str, port: int, user: str, password: str, msg: MIMEMultipart):
+        chave = (host, port, user)
+        lock = self._locks.setdefault(chave, asyncio.Lock())
+        async with lock:
+            for tentativa in range(2):
+                smtp = self._sessoes.get(chave)
+                try:
+                    if smtp is None or not smtp.is_connected:
+                        smtp = self._sessoes[chave] = await self._conectar(host, port, user, password)
+                    await smtp.send_message(msg)
+                    return
+                except aiosmtplib.SMTPServerDisconnected:
+                    self._sessoes.pop(chave, None)
+                    if tentativa:
+                        raise
+
+
+_pool = SMTPPool()
+_limiter = _RateLimiter(EMAIL_RATE_LIMIT)
+_sessoes_async = AsyncSMTPSessions()
+_partes = SizedLRUCache(int(EMAIL_PART_CACHE_MB * 1024 * 1024))
+
+
+def verificar_smtp() -> List[str]:
+    """
+    Abre uma sessão autenticada para cada conta configurada (padrão e informativo) e a
+    deixa no pool para o primeiro envio. Retorna as contas que falharam.
+    """
+    host, port = getenv("EMAIL_HOST"), int(getenv("EMAIL_PORT"))
+    contas = {
+        getenv("EMAIL_DEFAULT_USER"): getenv("EMAIL_DEFAULT_PASSWORD"),
+        getenv("EMAIL_INFORMATIVO_USER"): getenv("EMAIL_INFORMATIVO_PASS"),
+    }
+    falhas = []
+    for user, password in contas.items():
+        if not user:
+            continue
+        try:
+            _pool.devolver(host, port, user, _pool.obter(host, port, user, password))
+        except Exception as e:
+            logging.error(f"Falha ao conectar no SMTP {host}:{port} com '{user}': {e}")
+            falhas.append(user)
+    return falhas
 
 
 class Email:
@@ -26,7 +454,8 @@ class Email:
             titulo: str = "Sem Assunto",
             corpo_texto: Optional[str] = None,
             corpo_arq: Optional[List[str]] = None,
-            hyperlink: Optional[dict[str, Any]] = None
+            hyperlink: Optional[dict[str, Any]] = None,
+            reutilizar_partes: bool = False
     ) -> None:
         self._host = getenv("EMAIL_HOST")
         self._port = int(getenv("EMAIL_PORT"))
@@ -44,38 +473,50 @@ class Email:
         self.corpo_texto = corpo_texto
         self.corpo_arq = corpo_arq or []
         self.hyperlink = hyperlink or {}
+        # Arquivos estáveis (informativos): reaproveita a codificação de envios anteriores
+        self.reutilizar_partes = reutilizar_partes
+        # A mensagem só é montada no envio: e-mails na fila guardam apenas os caminhos dos arquivos
 
-        # Objeto da mensagem
-        self.msg = MIMEMultipart()
-        self._montar_cabecalho()
-        self._montar_corpo()
+    def _montar_mensagem(self, marcacoes: Optional[Dict[str, Path]] = None) -> MIMEMultipart:
+        """
+        Monta a mensagem. Com 'marcacoes', os anexos (exceto os reaproveitados do cache)
+        entram como marcações, preenchidas na transmissão (ver _transmitir).
+        """
+        msg = MIMEMultipart()
+        self._montar_cabecalho(msg)
+        self._montar_corpo(msg, marcacoes)
+        return msg
 
-    def _montar_cabecalho(self):
+    def _montar_cabecalho(self, msg: MIMEMultipart):
         """Preenche os metadados do e-mail."""
-        self.msg['Date'] = formatdate(localtime=True)
-        self.msg['From'] = self._user
-        self.msg['Subject'] = self.titulo
-        self.msg['To'] = ", ".join(self.para)
+        msg['Date'] = formatdate(localtime=True)
+        msg['From'] = self._user
+        msg['Subject'] = self.titulo
+        msg['To'] = ", ".join(self.para)
         if self.cco:
-            self.msg['Bcc'] = ", ".join(self.cco)
+            msg['Bcc'] = ", ".join(self.cco)
 
-    def _montar_corpo(self):
+    def _montar_corpo(self, msg: MIMEMultipart, marcacoes: Optional[Dict[str, Path]] = None):
         """Processa anexos, textos e imagens inline (informativos)."""
         try:
             # 1. Anexos de Arquivos (Excel, etc)
             for caminho in self.anexos:
                 path_anexo = Path(caminho)
-                if path_anexo.exists():
-                    with open(path_anexo, 'rb') as f:
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(f.read())
-                    encoders.encode_base64(part)
+                if self.reutilizar_partes:
+                    part = _parte_cacheada(path_anexo)
+                elif not path_anexo.exists():
+                    part = None
+                elif marcacoes is not None:
+                    part = _anexo_marcado(path_anexo, marcacoes)
+                else:
+                    part = _anexo_base64(path_anexo)
+                if part is not None:
                     part.add_header('Content-Disposition', f'attachment; filename={path_anexo.name}')
-                    self.msg.attach(part)
+                    msg.attach(part)
 
             # 2. Corpo de Texto Simples
             if self.corpo_texto:
-                self.msg.attach(MIMEText(self.corpo_texto, 'plain'))
+                msg.attach(MIMEText(self.corpo_texto, 'plain'))
 
             # 3. Informativos (Imagens Inline)
             elif self.corpo_arq:
@@ -90,46 +531,71 @@ class Email:
                         html += f'<img src="cid:image{i}" alt="Imagem {i}"><br>'
 
                 html += "</body></html>"
-                self.msg.attach(MIMEText(html, 'html'))
+                msg.attach(MIMEText(html, 'html'))
                 for i, img_path in enumerate(self.corpo_arq):
                     path_img = Path(img_path)
-                    if path_img.exists():
+                    if self.reutilizar_partes:
+                        mime_img = _parte_cacheada(path_img, imagem=True)
+                    elif path_img.exists():
                         with open(path_img, 'rb') as f:
                             mime_img = MIMEImage(f.read())
-                            mime_img.add_header('Content-ID', f'<image{i}>')
-                            mime_img.add_header('Content-Disposition', 'inline', filename=path_img.name)
-                            self.msg.attach(mime_img)
+                    else:
+                        mime_img = None
+                    if mime_img is not None:
+                        mime_img.add_header('Content-ID', f'<image{i}>')
+                        mime_img.add_header('Content-Disposition', 'inline', filename=path_img.name)
+                        msg.attach(mime_img)
 
         except Exception as e:
             logging.error(f"Erro ao montar estrutura do e-mail: {e}")
             raise
 
     def enviar(self) -> bool:
-        """Realiza a autenticação manual e envia o e-mail."""
+        """Envia o e-mail reutilizando uma sessão autenticada do pool."""
         try:
-            # Codificação para AUTH LOGIN
-            user_b64 = b64encode(self._user.encode('utf-8')).decode('ascii')
-            pass_b64 = b64encode(self._password.encode('utf-8')).decode('ascii')
-
-            with smtplib.SMTP_SSL(self._host, self._port) as server:
-                server.ehlo()
-
-                # Autenticação manual via comandos SMTP
-                code, resp = server.docmd("AUTH", "LOGIN")
-                if code != 334:
-                    raise PermissionError(f"Servidor recusou AUTH LOGIN: {resp}")
+            _limiter.aguardar()
+            for tentativa in range(2):
+                marcacoes: Dict[str, Path] = {}
+                msg = self._montar_mensagem(marcacoes)
+                server = _pool.obter(self._host, self._port, self._user, self._password)
+                try:
+                    with metricas.cronometrar("smtp_envio_segundos"):
+                        _transmitir(server, msg, marcacoes)
+                except smtplib.SMTPServerDisconnected:
+                    # Sessão derrubada pelo servidor entre o health check e o envio
+                    _pool.descartar(server)
+                    if tentativa:
+                        raise
+                    continue
+                except Exception:
+                    _pool.descartar(server)
+                    raise
+                _pool.devolver(self._host, self._port, self._user, server)
+                break
 
-                server.docmd(user_b64)
-                code, resp = server.docmd(pass_b64)
-
-                if code != 235:
-                    raise PermissionError(f"Autenticação recusada: {resp}")
+            logging.info(f"E-mail '{self.titulo}' enviado para os destinatarios")
+            metricas.incrementar("emails_total", resultado="sucesso")
+            return True
 
-                server.send_message(self.msg)
+        except Exception as e:
+            metricas.incrementar("emails_total", resultado="falha")
+            raise Exception(f"Falha crítica no envio de e-mail: {e}")
 
+    async def enviar_async(self) -> bool:
+        """Envio sem bloquear o event loop (aiosmtplib; sem ele, o envio síncrono roda em uma thread)."""
+        if aiosmtplib is None:
+            return await asyncio.to_thread(self.enviar)
+        try:
+            await asyncio.sleep(_limiter.reservar())
+            with metricas.cronometrar("smtp_envio_segundos"):
+                await _sessoes_async.enviar(self._host, self._port, self._user, self._password, self._montar_mensagem())
             logging.info(f"E-mail '{self.titulo}' enviado para os destinatarios")
-            sleep(1)
+            metricas.incrementar("emails_total", resultado="sucesso")
             return True
-
         except Exception as e:
-            raise Exception(f"Falha crítica no envio de e-mail: {e}")
\ No newline at end of file
+            metricas.incrementar("emails_total", resultado="falha")
+            raise Exception(f"Falha crítica no envio de e-mail: {e}")
+
+    def enfileirar(self) -> Future:
+        """Entrega a mensagem ao dispatcher e retorna imediatamente."""
+        return EmailDispatcher.instancia().enfileirar(self)
@@ -0,0 +1,157 @@
+"""Executor limitado e priorizado para as rotinas, com uma fila (lane) por tipo."""
+
+import logging
+from itertools import count
+from os import getenv
+from queue import Empty, Full, PriorityQueue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# Workers por tipo de rotina. A soma deve caber no pool de conexões do DB.
+LANES_PADRAO = {
+    'RE': int(getenv("EXECUTOR_WORKERS_RE", "4")),
+    'IN': int(getenv("EXECUTOR_WORKERS_IN", "3")),
+    'TRG': int(getenv("EXECUTOR_WORKERS_TRG", "2")),
+}
+EXECUTOR_QUEUE_MAX = int(getenv("EXECUTOR_QUEUE_MAX", "100"))
+EXECUTOR_DRAIN_TIMEOUT = float(getenv("EXECUTOR_DRAIN_TIMEOUT", "600"))
+
+_PARAR = object()
+
+
+class _Lane:
+    """Fila de prioridade atendida por um número fixo de threads."""
+
+    def __init__(self, nome: str, workers: int, max_fila: int):
+        self.nome = nome
+        self.fila: PriorityQueue = PriorityQueue(maxsize=max_fila)
+        self.executando = 0
+        self.concluidas = 0
+        self.espera_max = 0.0
+        self.espera_total = 0.0
+        self.threads = [
+            # daemon: o dreno é feito explicitamente em encerrar(), com prazo
+            Thread(target=self._loop, name=f"rotina-{nome}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        self._lock = Lock()
+        self._executor: Optional["RoutineExecutor"] = None
+
+    def iniciar(self, executor: "RoutineExecutor"):
+        self._executor = executor
+        for t in self.threads:
+            t.start()
+
+    def _loop(self):
+        while True:
+            _, _, enfileirado, chave, fn, args = self.fila.get()
+            if fn is _PARAR:
+                break
+
+            espera = monotonic() - enfileirado
+            with self._lock:
+                self.executando += 1
+                self.espera_max = max(self.espera_max, espera)
+                self.espera_total += espera
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Erro não tratado na fila '{self.nome}': {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self.executando -= 1
+                    self.concluidas += 1
+                self._executor._liberar(chave)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "fila": self.fila.qsize(),
+                "executando": self.executando,
+                "workers": len(self.threads),
+                "concluidas": self.concluidas,
+                "espera_max_s": round(self.espera_max, 3),
+                "espera_media_s": round(self.espera_total / self.concluidas, 3) if self.concluidas else 0.0,
+            }
+
+
+class RoutineExecutor:
+    """
+    Distribui as rotinas em filas por tipo (RE/IN/TRG), cada uma com workers fixos.
+
+    - Menor valor de prioridade é executado primeiro; empates seguem a ordem de chegada.
+    - Uma mesma chave (id da rotina) não é enfileirada duas vezes enquanto estiver pendente.
+    - encerrar() para de aceitar tarefas, descarta o que não começou e aguarda as em execução.
+    """
+
+    def __init__(self, lanes: Optional[Dict[str, int]] = None, max_fila: int = EXECUTOR_QUEUE_MAX):
+        self._lanes = {nome: _Lane(nome, workers, max_fila) for nome, workers in (lanes or LANES_PADRAO).items()}
+        self._seq = count()
+        self._pendentes: set = set()
+        self._lock = Lock()
+        self._aceitando = True
+        for lane in self._lanes.values():
+            lane.iniciar(self)
+
+    def submeter(self, tipo: str, chave: Hashable, fn: Callable, *args, prioridade: int = 0) -> bool:
+        """Enfileira 'fn(*args)' na fila do tipo. Retorna False se recusado."""
+        lane = self._lanes.get(tipo)
+        if lane is None:
+            logging.error(f"Tipo de rotina sem fila configurada: {tipo}")
+            return False
+
+        with self._lock:
+            if not self._aceitando or chave in self._pendentes:
+                return False
+            self._pendentes.add(chave)
+
+        try:
+            lane.fila.put_nowait((prioridade, next(self._seq), monotonic(), chave, fn, args))
+            return True
+        except Full:
+            self._liberar(chave)
+            logging.warning(f"Fila '{tipo}' cheia ({lane.fila.maxsize}); rotina {chave} fica para o próximo ciclo.")
+            return False
+
+    def _liberar(self, chave: Hashable):
+        with self._lock:
+            self._pendentes.discard(chave)
+
+    def ocioso(self) -> bool:
+        """True quando não há tarefas na fila nem em execução."""
+        with self._lock:
+            return not self._pendentes
+
+    def estatisticas(self) -> Dict[str, Dict[str, Any]]:
+        return {nome: lane.estatisticas() for nome, lane in self._lanes.items()}
+
+    def encerrar(self, timeout: float = EXECUTOR_DRAIN_TIMEOUT):
+        """Aguarda as rotinas em execução terminarem, descartando as que ainda não começaram."""
+        with self._lock:
+            if not self._aceitando:
+                return
+            self._aceitando = False
+
+        descartadas = 0
+        for lane in self._lanes.values():
+            while True:
+                try:
+                    item = lane.fila.get_nowait()
+                except Empty:
+                    break
+                descartadas += 1
+                self._liberar(item[3])
+            for _ in lane.threads:
+                lane.fila.put((float('-inf'), next(self._seq), monotonic(), None, _PARAR, ()))
+
+        if descartadas:
+            logging.warning(f"{descartadas} rotina(s) na fila descartadas no encerramento.")
+
+        limite = monotonic() + timeout
+        for lane in self._lanes.values():
+            for t in lane.threads:
+                t.join(max(0.0, limite - monotonic()))
+                if t.is_alive():
+                    logging.error(f"Thread '{t.name}' não terminou dentro do prazo de encerramento.")
+        logging.info("--- [ Executor de rotinas encerrado ] ---")
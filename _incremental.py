@@ -0,0 +1,145 @@
+"""Extração incremental de relatórios: só as linhas acima da última marca (watermark) gravada."""
+
+import json
+import logging
+import pickle
+import re
+from datetime import date, datetime as dt
+from decimal import Decimal
+from os import replace
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional
+
+# Valores da coluna MODO_INCREMENTAL
+MODOS_INCREMENTAIS = ("delta", "acumulado")
+
+# A coluna de marca entra no texto da SQL: só identificadores simples ou entre aspas
+_IDENTIFICADOR = re.compile(r'^([A-Za-z][\w$#]*|"[^"]+")$')
+
+
+# Tipo da marca -> conversão do texto gravado de volta ao valor do bind.
+# A marca é gravada como '<tipo>:<valor>' para que uma coluna texto continue sendo
+# comparada com texto (e não com DATE ou NUMBER) mesmo que o valor pareça uma data.
+_TIPOS_MARCA = {
+    "int": int,
+    "float": float,
+    "decimal": Decimal,
+    "datetime": dt.fromisoformat,
+    "date": date.fromisoformat,
+    "str": str,
+}
+
+
+def marca_para_texto(valor: Any) -> Optional[str]:
+    """Representação da marca gravada na coluna MARCA_INCREMENTAL: '<tipo>:<valor>'."""
+    if valor is None:
+        return None
+    if isinstance(valor, dt):
+        return f"datetime:{valor.isoformat(sep=' ')}"
+    if isinstance(valor, date):
+        return f"date:{valor.isoformat()}"
+    if isinstance(valor, bool) or not isinstance(valor, (int, float, Decimal)):
+        return f"str:{valor}"
+    return f"{type(valor).__name__.lower()}:{valor}"
+
+
+def texto_para_marca(texto: Any) -> Any:
+    """Volta a marca gravada ao tipo registrado junto dela; sem tipo, o texto é usado como está."""
+    if texto is None or not isinstance(texto, str):
+        return texto
+    tipo, separador, valor = texto.partition(":")
+    conversor = _TIPOS_MARCA.get(tipo) if separador else None
+    if conversor is None:
+        return texto
+    return conversor(valor)
+
+
+def sql_incremental(sql: str, coluna: str) -> str:
+    """SQL da rotina filtrada pela marca (bind :1), sem alterar a consulta original."""
+    if not _IDENTIFICADOR.match(coluna):
+        raise ValueError(f"Coluna incremental inválida: {coluna!r}")
+    return f"SELECT * FROM ({sql.strip().rstrip(';')}) WHERE {coluna} > :1"
+
+
+def posicao_coluna(colunas: List[str], coluna: str) -> int:
+    nome = coluna.strip('"').upper()
+    for i, atual in enumerate(colunas):
+        if atual.upper() == nome:
+            return i
+    raise ValueError(f"Coluna incremental '{coluna}' não está no resultado da SQL da rotina.")
+
+
+class Marca:
+    """Acompanha o maior valor da coluna incremental nos lotes que passam pelo relatório."""
+
+    def __init__(self, inicial: Any, posicao: int):
+        # A SQL já filtra pela marca inicial: ela só é mantida se não vier nenhuma linha
+        self.valor = inicial
+        self.posicao = posicao
+        self.linhas = 0
+        self._atualizada = False
+
+    def acompanhar(self, lotes: Iterable[List[tuple]]) -> Iterator[List[tuple]]:
+        for lote in lotes:
+            valores = [linha[self.posicao] for linha in lote if linha[self.posicao] is not None]
+            if valores:
+                maior = max(valores)
+                if not self._atualizada or maior > self.valor:
+                    self.valor, self._atualizada = maior, True
+            self.linhas += len(lote)
+            yield lote
+
+    def texto(self) -> Optional[str]:
+        return marca_para_texto(self.valor)
+
+
+class CacheIncremental:
+    """
+    Linhas já extraídas de uma rotina no modo acumulado: lotes serializados em
+    '<id>.lotes' e, em '<id>.json', a marca e as colunas correspondentes.
+
+    O estado é apagado antes de qualquer alteração nos lotes e só volta a ser gravado
+    depois que a nova marca é confirmada; cache sem estado (ou com marca diferente da
+    do banco) obriga uma carga completa, evitando linhas perdidas ou duplicadas.
+    """
+
+    def __init__(self, pasta: Path, id_rotina: Any):
+        self.pasta = Path(pasta)
+        self.lotes_path = self.pasta / f"{id_rotina}.lotes"
+        self.estado_path = self.pasta / f"{id_rotina}.json"
+
+    def _estado(self) -> dict:
+        try:
+            return json.loads(self.estado_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def marca(self) -> Optional[str]:
+        return self._estado().get("marca") if self.lotes_path.exists() else None
+
+    def compativel(self, colunas: List[str]) -> bool:
+        gravadas = self._estado().get("colunas") or []
+        return [c.upper() for c in gravadas] == [c.upper() for c in colunas]
+
+    def lotes(self) -> Iterator[List[tuple]]:
+        with open(self.lotes_path, "rb") as arquivo:
+            while True:
+                try:
+                    yield pickle.load(arquivo)
+                except EOFError:
+                    return
+
+    def gravando(self, lotes: Iterable[List[tuple]], reiniciar: bool) -> Iterator[List[tuple]]:
+        """Repassa os lotes novos, acrescentando-os ao cache (ou recriando-o)."""
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        self.estado_path.unlink(missing_ok=True)
+        with open(self.lotes_path, "wb" if reiniciar else "ab") as arquivo:
+            for lote in lotes:
+                pickle.dump([tuple(linha) for linha in lote], arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+                yield lote
+
+    def confirmar(self, marca: Optional[str], colunas: List[str]):
+        temporario = self.estado_path.with_suffix(".tmp")
+        temporario.write_text(json.dumps({"marca": marca, "colunas": list(colunas)}), encoding="utf-8")
+        replace(temporario, self.estado_path)
+        logging.debug(f"Cache incremental '{self.lotes_path.name}' confirmado na marca {marca}.")
@@ -0,0 +1,279 @@
+"""Substituto local (sqlite3) do pool Oracle, para testes e benchmarks sem banco real."""
+
+import logging
+import re
+import sqlite3
+from contextlib import contextmanager
+from os import environ
+from threading import Condition, Lock
+from typing import Any, Dict, Iterator, Optional
+
+# Parâmetros posicionais do Oracle (:1, :2) viram parâmetros numerados do sqlite (?1, ?2)
+_BIND = re.compile(r":(\d+)")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS cadastro_rotinas (
+    id INTEGER PRIMARY KEY,
+    nome TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    intervalo INTEGER NOT NULL DEFAULT 1,
+    dta_inicial TIMESTAMP,
+    dta_proxima TIMESTAMP,
+    dta_final TIMESTAMP,
+    sql TEXT,
+    status TEXT,
+    sucesso TEXT,
+    tipo TEXT NOT NULL,
+    prioridade INTEGER NOT NULL DEFAULT 0,
+    ativo TEXT NOT NULL DEFAULT 'S',
+    lease_dono TEXT,
+    lease_expira TIMESTAMP,
+    versao INTEGER NOT NULL DEFAULT 0,
+    formato TEXT NOT NULL DEFAULT 'xlsx',
+    coluna_incremental TEXT,
+    modo_incremental TEXT,
+    marca_incremental TEXT,
+    antecedencia INTEGER
+);
+CREATE TRIGGER IF NOT EXISTS cadastro_rotinas_versao AFTER UPDATE ON cadastro_rotinas
+WHEN NEW.versao = OLD.versao
+BEGIN
+    UPDATE cadastro_rotinas SET versao = (SELECT COALESCE(MAX(versao), 0) + 1 FROM cadastro_rotinas)
+    WHERE id = NEW.id;
+END;
+CREATE TABLE IF NOT EXISTS email_rotinas (
+    id_rotina INTEGER NOT NULL,
+    email TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hiperlink_rotinas (
+    id_rotina INTEGER NOT NULL,
+    arquivo TEXT NOT NULL,
+    link TEXT
+);
+"""
+
+_COLUNAS = (
+    "id, nome, periodo, intervalo, dta_inicial, dta_proxima, dta_final, sql, status, sucesso, tipo, "
+    "prioridade, ativo, versao, formato, coluna_incremental, modo_incremental, marca_incremental, "
+    "antecedencia"
+)
+
+# SQLs equivalentes às do .env, escritas para o sqlite
+SQL_LOCAL: Dict[str, str] = {
+    "SQL_ROUTINES_TO_EXECUTE": (
+        f"SELECT {_COLUNAS} FROM cadastro_rotinas "
+        "WHERE ativo = 'S' AND COALESCE(dta_proxima, dta_inicial) <= datetime('now', 'localtime') "
+        "AND (lease_dono IS NULL OR lease_expira < datetime('now', 'localtime')) "
+        "ORDER BY prioridade, COALESCE(dta_proxima, dta_inicial)"
+    ),
+    "SQL_ROUTINES_SCHEDULE": f"SELECT {_COLUNAS} FROM cadastro_rotinas WHERE ativo = 'S'",
+    "SQL_ROUTINES_TO_PREPARE": (
+        f"SELECT {_COLUNAS} FROM cadastro_rotinas "
+        "WHERE ativo = 'S' AND tipo = 'RE' AND antecedencia > 0 "
+        "AND dta_proxima > datetime('now', 'localtime') "
+        "AND dta_proxima <= datetime('now', 'localtime', '+' || antecedencia || ' minutes')"
+    ),
+    "SQL_ROUTINES_CHANGED": f"SELECT {_COLUNAS} FROM cadastro_rotinas WHERE versao > :1",
+    "SQL_CLAIM_ROUTINE": (
+        "UPDATE cadastro_rotinas SET status = 'E', sucesso = 'N', lease_dono = :1, "
+        "lease_expira = datetime('now', 'localtime', '+' || :2 || ' seconds') "
+        "WHERE id = :3 AND COALESCE(dta_proxima, dta_inicial) <= datetime('now', 'localtime') "
+        "AND (lease_dono IS NULL OR lease_expira < datetime('now', 'localtime'))"
+    ),
+    "SQL_CLAIM_PREPARE": (
+        "UPDATE cadastro_rotinas SET lease_dono = :1, "
+        "lease_expira = datetime('now', 'localtime', '+' || :2 || ' seconds') "
+        "WHERE id = :3 AND (lease_dono IS NULL OR lease_expira < datetime('now', 'localtime'))"
+    ),
+    "SQL_RENEW_CLAIM": (
+        "UPDATE cadastro_rotinas SET lease_expira = datetime('now', 'localtime', '+' || :2 || ' seconds') "
+        "WHERE lease_dono = :1 AND id = :3"
+    ),
+    "SQL_RELEASE_CLAIM": "UPDATE cadastro_rotinas SET lease_dono = NULL, lease_expira = NULL WHERE lease_dono = :1 AND id = :2",
+    "SQL_UPDATE_SET_TO_E_N": "UPDATE cadastro_rotinas SET status = 'E', sucesso = 'N' WHERE id = :1",
+    "SQL_UPDATE_SET_TO_F_S": "UPDATE cadastro_rotinas SET status = 'F', sucesso = 'S' WHERE id = :1",
+    "SQL_UPDATE_SET_STATUS_TO_NULL": "UPDATE cadastro_rotinas SET status = NULL WHERE id = :1",
+    "SQL_UPDATE_DISABLE_ROUTINE": "UPDATE cadastro_rotinas SET ativo = 'N' WHERE id = :1",
+    "SQL_UPDATE_WATERMARK": "UPDATE cadastro_rotinas SET marca_incremental = :1 WHERE id = :2",
+    "SQL_UPDATE_SCHEDULE_MINUTE": "UPDATE cadastro_rotinas SET dta_proxima = datetime(:1, '+' || :2 || ' minutes') WHERE id = :3",
+    "SQL_UPDATE_SCHEDULE_HOUR": "UPDATE cadastro_rotinas SET dta_proxima = datetime(:1, '+' || :2 || ' hours') WHERE id = :3",
+    "SQL_UPDATE_SCHEDULE_DAY": "UPDATE cadastro_rotinas SET dta_proxima = datetime(:1, '+' || :2 || ' days') WHERE id = :3",
+    "SQL_UPDATE_SCHEDULE_MONTH": "UPDATE cadastro_rotinas SET dta_proxima = datetime(:1, '+' || :2 || ' months') WHERE id = :3",
+    "SQL_GET_NEXT_RUN": "SELECT dta_proxima FROM cadastro_rotinas WHERE id = :1",
+    "SQL_GET_RECIPIENTS": "SELECT email FROM email_rotinas WHERE id_rotina = :1",
+    "SQL_GET_HIPERLINK": "SELECT arquivo, link FROM hiperlink_rotinas WHERE id_rotina = :1",
+    "SQL_GET_RECIPIENTS_BULK": "SELECT id_rotina, email FROM email_rotinas WHERE id_rotina IN ({ids})",
+    "SQL_GET_HIPERLINK_BULK": "SELECT id_rotina, arquivo, link FROM hiperlink_rotinas WHERE id_rotina IN ({ids})",
+    "SQL_CONTACTS_SIGNATURE": (
+        "SELECT id_rotina, COUNT(*) || ':' || group_concat(valor, ';') FROM ("
+        "SELECT id_rotina, email AS valor FROM email_rotinas UNION ALL "
+        "SELECT id_rotina, arquivo || '=' || COALESCE(link, '') FROM hiperlink_rotinas ORDER BY 1, 2"
+        ") GROUP BY id_rotina"
+    ),
+}
+
+
+def aplicar_sqls_locais(sobrescrever: bool = False):
+    """Preenche as variáveis de ambiente SQL_* com as versões para o sqlite."""
+    for chave, sql in SQL_LOCAL.items():
+        if sobrescrever or not environ.get(chave):
+            environ[chave] = sql
+
+
+class _Cursor:
+    """Cursor com a interface usada pelo DB (context manager, arraysize, prefetchrows)."""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+        self.prefetchrows = 0
+
+    @property
+    def arraysize(self) -> int:
+        return self._cursor.arraysize
+
+    @arraysize.setter
+    def arraysize(self, valor: int):
+        self._cursor.arraysize = valor
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def execute(self, sql: str, params: Optional[Any] = None):
+        self._cursor.execute(_BIND.sub(r"?\1", sql), params or [])
+
+    def parse(self, sql: str):
+        """Preenche description sem trazer linhas (binds como NULL), como o parse do oracledb."""
+        binds = max((int(n) for n in _BIND.findall(sql)), default=0)
+        self.execute(f"SELECT * FROM ({sql}) LIMIT 0", [None] * binds)
+
+    def executemany(self, sql: str, params: Any):
+        self._cursor.executemany(_BIND.sub(r"?\1", sql), params)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size: Optional[int] = None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Connection:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self.call_timeout = 0
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def ping(self):
+        self._conn.execute("SELECT 1")
+
+    def cancel(self):
+        self._conn.interrupt()
+
+    def rollback(self):
+        self._conn.rollback()
+
+
+class _ArrowConnection(_Connection):
+    """Conexão com fetch_df_batches (pyarrow), para exercitar o caminho Arrow sem Oracle."""
+
+    def fetch_df_batches(self, statement: str, parameters: Optional[Any] = None, size: int = 5000):
+        import pyarrow as pa
+        with self.cursor() as cursor:
+            cursor.execute(statement, parameters)
+            nomes = [c[0] for c in cursor.description]
+            while True:
+                lote = cursor.fetchmany(size)
+                if not lote:
+                    break
+                colunas = []
+                for valores in zip(*lote):
+                    coluna = pa.array(valores)
+                    # Inteiros chegam como NUMBER do Oracle (decimal128), como no driver real
+                    if pa.types.is_integer(coluna.type):
+                        coluna = coluna.cast(pa.decimal128(38, 0))
+                    colunas.append(coluna)
+                yield pa.Table.from_arrays(colunas, names=nomes)
+
+
+class LocalPool:
+    """
+    Pool com a mesma interface mínima do pool do oracledb (acquire/busy/opened/max).
+
+    Cada acquire abre uma conexão sqlite ao mesmo arquivo (ou banco em memória
+    compartilhado), permitindo simular várias instâncias do serviço. Com 'arrow', as
+    conexões oferecem fetch_df_batches (requer pyarrow).
+    """
+
+    def __init__(self, caminho: str = "file:rotinas_local?mode=memory&cache=shared", max: int = 10,
+                 espera: float = 30, arrow: bool = False):
+        self.caminho = caminho
+        self._conexao = _ArrowConnection if arrow else _Connection
+        self.max = max
+        self.min = 0
+        self.busy = 0
+        # Como o getmode TIMEDWAIT do oracledb: sem conexão livre, espera até 'espera' segundos
+        self.espera = espera
+        self._livre = Condition(Lock())
+        # Mantém o banco em memória vivo enquanto o pool existir
+        self._ancora = self._conectar()
+        self._ancora.executescript(ESQUEMA)
+        logging.info(f"Banco local (sqlite) pronto em '{caminho}'.")
+
+    @property
+    def opened(self) -> int:
+        return self.busy
+
+    def _conectar(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            self.caminho, uri=self.caminho.startswith("file:"), timeout=30,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, check_same_thread=False
+        )
+
+    @contextmanager
+    def acquire(self) -> Iterator[_Connection]:
+        with self._livre:
+            if not self._livre.wait_for(lambda: self.busy < self.max, self.espera):
+                raise TimeoutError(f"Pool local esgotado: nenhuma conexão livre em {self.espera}s.")
+            self.busy += 1
+        try:
+            conn = self._conectar()
+            try:
+                yield self._conexao(conn)
+            finally:
+                conn.close()
+        finally:
+            with self._livre:
+                self.busy -= 1
+                self._livre.notify()
+
+    def reconfigure(self, min: Optional[int] = None, max: Optional[int] = None):
+        with self._livre:
+            if min is not None:
+                self.min = min
+            if max is not None:
+                self.max = max
+            self._livre.notify_all()
+
+    def executar_script(self, script: str):
+        self._ancora.executescript(script)
+
+    def close(self):
+        self._ancora.close()
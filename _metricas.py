@@ -0,0 +1,262 @@
+"""Métricas do serviço: contadores, histogramas e gauges, com exportação HTTP e/ou arquivo."""
+
+import json
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime as dt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import getenv, replace
+from pathlib import Path
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+# Faixas padrão (segundos) e de tamanho (bytes) dos histogramas
+BUCKETS_SEGUNDOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+BUCKETS_BYTES = tuple(1024 * 4 ** i for i in range(12))  # 1 KiB .. 4 GiB
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> _Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _formatar_labels(labels: _Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    itens = list(labels) + ([extra] if extra else [])
+    if not itens:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in itens) + "}"
+
+
+class _Histograma:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.contagens = [0] * (len(buckets) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.contagens[bisect_left(self.buckets, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+class Cronometro:
+    """Acumula o tempo gasto em cada fase de uma execução de rotina."""
+
+    def __init__(self):
+        self.fases: Dict[str, float] = {}
+        self.resultado = "sucesso"
+
+    def somar(self, nome: str, segundos: float):
+        self.fases[nome] = self.fases.get(nome, 0.0) + segundos
+
+
+_cronometro: ContextVar[Optional[Cronometro]] = ContextVar("cronometro", default=None)
+
+
+@contextmanager
+def fase(nome: str) -> Iterator[None]:
+    """Cronometra o bloco na fase 'nome' da execução atual (sem efeito fora de uma execução)."""
+    cron = _cronometro.get()
+    inicio = perf_counter()
+    try:
+        yield
+    finally:
+        if cron is not None:
+            cron.somar(nome, perf_counter() - inicio)
+
+
+def iterar_fase(iteravel: Iterable[Any], nome: str) -> Iterator[Any]:
+    """Repassa os itens, somando à fase 'nome' apenas o tempo gasto para obtê-los."""
+    cron = _cronometro.get()
+    iterador = iter(iteravel)
+    while True:
+        inicio = perf_counter()
+        try:
+            item = next(iterador)
+        except StopIteration:
+            return
+        finally:
+            if cron is not None:
+                cron.somar(nome, perf_counter() - inicio)
+        yield item
+
+
+class Metrics:
+    """Registro de métricas em memória, seguro entre threads."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._contadores: Dict[Tuple[str, _Labels], float] = {}
+        self._histogramas: Dict[Tuple[str, _Labels], _Histograma] = {}
+        self._gauges: Dict[Tuple[str, _Labels], float] = {}
+        self._coletores: Dict[str, Tuple[str, Callable[[], Dict[Any, float]]]] = {}
+        self._exportando = False
+
+    def incrementar(self, nome: str, valor: float = 1, **labels):
+        chave = (nome, _labels(labels))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome: str, valor: float, buckets: Tuple[float, ...] = BUCKETS_SEGUNDOS, **labels):
+        chave = (nome, _labels(labels))
+        with self._lock:
+            hist = self._histogramas.get(chave)
+            if hist is None:
+                hist = self._histogramas[chave] = _Histograma(buckets)
+            hist.observar(valor)
+
+    def definir(self, nome: str, valor: float, **labels):
+        with self._lock:
+            self._gauges[(nome, _labels(labels))] = valor
+
+    def registrar_gauge(self, nome: str, label: str, coletor: Callable[[], Dict[Any, float]]):
+        """Gauge lido na hora da exportação: 'coletor' retorna {valor_do_label: valor}."""
+        with self._lock:
+            self._coletores[nome] = (label, coletor)
+
+    @contextmanager
+    def cronometrar(self, nome: str, **labels) -> Iterator[None]:
+        inicio = perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nome, perf_counter() - inicio, **labels)
+
+    @contextmanager
+    def execucao(self, **labels) -> Iterator[Cronometro]:
+        """
+        Mede uma execução de rotina: duração total, resultado e o tempo de cada fase
+        registrada com fase()/iterar_fase() enquanto o bloco roda.
+        """
+        cron = Cronometro()
+        token = _cronometro.set(cron)
+        inicio = perf_counter()
+        try:
+            yield cron
+        except Exception:
+            cron.resultado = "falha"
+            raise
+        finally:
+            _cronometro.reset(token)
+            total = perf_counter() - inicio
+            for nome, segundos in cron.fases.items():
+                self.observar("rotina_fase_segundos", segundos, fase=nome, **labels)
+            self.observar("rotina_duracao_segundos", total, resultado=cron.resultado, **labels)
+            self.incrementar("execucoes_total", resultado=cron.resultado, **labels)
+
+    def _coletar_gauges(self) -> Dict[Tuple[str, _Labels], float]:
+        with self._lock:
+            gauges = dict(self._gauges)
+            coletores = list(self._coletores.items())
+        for nome, (label, coletor) in coletores:
+            try:
+                for valor_label, valor in coletor().items():
+                    gauges[(nome, ((label, str(valor_label)),))] = valor
+            except Exception as e:
+                logging.debug(f"Falha ao coletar gauge '{nome}': {e}")
+        return gauges
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado atual em formato serializável (JSON)."""
+        gauges = self._coletar_gauges()
+        with self._lock:
+            return {
+                "gerado_em": dt.now().isoformat(timespec="seconds"),
+                "contadores": [
+                    {"nome": n, "labels": dict(l), "valor": v} for (n, l), v in self._contadores.items()
+                ],
+                "gauges": [{"nome": n, "labels": dict(l), "valor": v} for (n, l), v in gauges.items()],
+                "histogramas": [
+                    {
+                        "nome": n, "labels": dict(l), "total": h.total, "soma": round(h.soma, 6),
+                        "buckets": dict(zip([*map(str, h.buckets), "+Inf"], h.contagens)),
+                    }
+                    for (n, l), h in self._histogramas.items()
+                ],
+            }
+
+    def prometheus(self) -> str:
+        """Estado atual no formato texto do Prometheus."""
+        gauges = self._coletar_gauges()
+        linhas = []
+        with self._lock:
+            for (nome, labels), valor in sorted(self._contadores.items()):
+                linhas.append(f"rotinas_{nome}{_formatar_labels(labels)} {valor}")
+            for (nome, labels), valor in sorted(gauges.items()):
+                linhas.append(f"rotinas_{nome}{_formatar_labels(labels)} {valor}")
+            for (nome, labels), hist in sorted(self._histogramas.items()):
+                acumulado = 0
+                for limite, qtd in zip([*map(str, hist.buckets), "+Inf"], hist.contagens):
+                    acumulado += qtd
+                    linhas.append(f"rotinas_{nome}_bucket{_formatar_labels(labels, ('le', limite))} {acumulado}")
+                linhas.append(f"rotinas_{nome}_sum{_formatar_labels(labels)} {hist.soma}")
+                linhas.append(f"rotinas_{nome}_count{_formatar_labels(labels)} {hist.total}")
+        return "\n".join(linhas) + "\n"
+
+    def iniciar_exportacao(self):
+        """
+        Liga os exportadores configurados no .env:
+        - METRICS_PORT: endpoint HTTP local (/metrics no formato Prometheus, /metrics.json)
+        - METRICS_FILE: arquivo JSON regravado a cada METRICS_FLUSH_SECONDS
+        """
+        with self._lock:
+            if self._exportando:
+                return
+            self._exportando = True
+
+        porta = getenv("METRICS_PORT")
+        if porta:
+            servidor = ThreadingHTTPServer((getenv("METRICS_HOST", "127.0.0.1"), int(porta)), _handler(self))
+            Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+            logging.info(f"Métricas disponíveis em http://{servidor.server_address[0]}:{porta}/metrics")
+
+        arquivo = getenv("METRICS_FILE")
+        if arquivo:
+            intervalo = float(getenv("METRICS_FLUSH_SECONDS", "60"))
+            Thread(target=self._gravar_periodicamente, args=(Path(arquivo), intervalo),
+                   name="metricas-arquivo", daemon=True).start()
+
+    def gravar(self, arquivo: Path):
+        temp = arquivo.with_suffix(arquivo.suffix + ".tmp")
+        temp.write_text(json.dumps(self.snapshot(), ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+        replace(temp, arquivo)
+
+    def _gravar_periodicamente(self, arquivo: Path, intervalo: float):
+        while True:
+            sleep(intervalo)
+            try:
+                self.gravar(arquivo)
+            except Exception as e:
+                logging.warning(f"Falha ao gravar métricas em '{arquivo}': {e}")
+
+
+def _handler(registro: Metrics):
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                corpo, tipo = registro.prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                corpo = json.dumps(registro.snapshot(), ensure_ascii=False, default=str).encode("utf-8")
+                tipo = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    return _MetricsHandler
+
+
+# Registro único usado por todo o serviço
+metricas = Metrics()
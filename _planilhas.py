@@ -0,0 +1,387 @@
+"""Geração de relatórios em memória constante: Excel write-only e CSV (opcionalmente comprimido)."""
+
+import csv
+import gzip
+import io
+import logging
+import zipfile
+from datetime import date, datetime as dt
+from itertools import islice
+from os import getenv
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+# Limite de linhas de uma planilha do Excel (incluindo o cabeçalho)
+EXCEL_MAX_LINHAS = 1_048_576
+
+FORMATO_DATA = "DD/MM/YYYY"
+FORMATO_DATA_HORA = "DD/MM/YYYY HH:MM:SS"
+
+# Tamanho máximo de cada arquivo CSV gerado; acima disso o relatório é dividido em partes.
+# O padrão faz cada parte caber sozinha em um e-mail (EMAIL_MAX_SIZE_MB, contado em base64:
+# 57 bytes viram uma linha de 76 caracteres + CRLF), descontada a folga dos cabeçalhos.
+_FOLGA_CABECALHO_MB = 0.1
+REPORT_MAX_FILE_MB = float(getenv(
+    "REPORT_MAX_FILE_MB", str(float(getenv("EMAIL_MAX_SIZE_MB", "20")) * 57 / 78 - _FOLGA_CABECALHO_MB)
+))
+
+# Formatos de saída aceitos na coluna FORMATO da rotina
+FORMATOS_SAIDA = ("xlsx", "csv", "csv.gz", "zip")
+
+# Relatórios buscados e gravados por coluna (Arrow, se pyarrow estiver instalado) em vez de linha a linha
+REPORT_COLUMNAR = getenv("REPORT_COLUMNAR", "0") != "0"
+
+_STRFTIME = {FORMATO_DATA: "%d/%m/%Y", FORMATO_DATA_HORA: "%d/%m/%Y %H:%M:%S"}
+
+
+def formato_coluna(val: Any) -> Optional[str]:
+    """Define o formato numérico de uma coluna a partir do primeiro valor não nulo."""
+    if isinstance(val, dt):
+        if (val.hour, val.minute, val.second) == (0, 0, 0):
+            return FORMATO_DATA
+        return FORMATO_DATA_HORA
+    if isinstance(val, date):
+        return FORMATO_DATA
+    return None
+
+
+def formato_lote(valores: Sequence[Any], atual: Optional[str]) -> Optional[str]:
+    """
+    Formato de uma coluna considerando um lote inteiro de valores: "" (não é data),
+    data ou data/hora; None enquanto só houver nulos. Data/hora não volta a ser data.
+    """
+    if atual == "" or atual == FORMATO_DATA_HORA:
+        return atual
+    amostra = next((v for v in valores if v is not None), None)
+    if amostra is None:
+        return atual
+    if not isinstance(amostra, date):
+        return ""
+    if any(isinstance(v, dt) and (v.hour or v.minute or v.second) for v in valores if v is not None):
+        return FORMATO_DATA_HORA
+    return FORMATO_DATA
+
+
+def _arrow_para_lista(coluna: Any, atual: Optional[str], como_texto: bool) -> Tuple[List[Any], Optional[str]]:
+    """
+    Converte uma coluna Arrow em lista. Datas são detectadas pelo tipo da coluna e,
+    com 'como_texto', formatadas de uma vez pelo pyarrow.compute (fora do laço Python).
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    tipo = coluna.type
+    if not (pa.types.is_timestamp(tipo) or pa.types.is_date(tipo)):
+        return coluna.to_pylist(), ""
+    if pa.types.is_timestamp(tipo) and tipo.unit != "s":
+        # Frações de segundo (TIMESTAMP) são descartadas, como no strftime do caminho Python
+        coluna = coluna.cast(pa.timestamp("s", tipo.tz), safe=False)
+    if atual != FORMATO_DATA_HORA:
+        tem_hora = pa.types.is_timestamp(tipo) and pc.any(
+            pc.not_equal(coluna, pc.floor_temporal(coluna, unit="day"))
+        ).as_py()
+        atual = FORMATO_DATA_HORA if tem_hora else FORMATO_DATA
+    if not como_texto:
+        return coluna.to_pylist(), atual
+    try:
+        return pc.strftime(coluna, format=_STRFTIME[atual]).to_pylist(), atual
+    except (pa.ArrowException, NotImplementedError):
+        # Ex.: base de fusos do Arrow indisponível no Windows; formata em Python
+        padrao = _STRFTIME[atual]
+        return [v.strftime(padrao) if v is not None else None for v in coluna.to_pylist()], atual
+
+
+def coluna_formatada(coluna: Any, atual: Optional[str], como_texto: bool) -> Tuple[List[Any], Optional[str]]:
+    """
+    Valores de uma coluna do lote (lista/tupla ou array Arrow) e seu formato.
+    Com 'como_texto', datas viram texto no padrão brasileiro (CSV); senão ficam como objetos.
+    """
+    if hasattr(coluna, "to_pylist"):
+        return _arrow_para_lista(coluna, atual, como_texto)
+    atual = formato_lote(coluna, atual)
+    if not atual or not como_texto:
+        return list(coluna), atual
+    padrao = _STRFTIME[atual]
+    return [v.strftime(padrao) if v is not None else None for v in coluna], atual
+
+
+class ExcelWriter:
+    """
+    Escreve linhas em um Workbook write-only conforme chegam do banco.
+
+    - O formato (data ou data/hora) é decidido por coluna, não por célula.
+    - Ao atingir o limite de linhas do Excel, uma nova aba é criada automaticamente.
+    """
+
+    def __init__(self, path: Path, colunas: List[str], max_linhas: int = EXCEL_MAX_LINHAS):
+        self.path = Path(path)
+        self.colunas = list(colunas)
+        self.max_linhas = max_linhas
+        self.total_linhas = 0
+
+        # openpyxl é carregado só quando a primeira planilha é gerada (inicialização mais rápida)
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+        except ImportError as e:
+            logging.error(f"Dependência faltando: {e}")
+            raise
+        self._celula = WriteOnlyCell
+
+        self._wb = Workbook(write_only=True)
+        self._salvo = False
+        self._ws = None
+        self._linhas_aba = 0
+        self._abas = 0
+        # None = ainda não decidido; "" = coluna sem formato especial
+        self._formatos: List[Optional[str]] = [None] * len(self.colunas)
+        self._nova_aba()
+
+    def _nova_aba(self):
+        self._abas += 1
+        self._ws = self._wb.create_sheet(title=f"Planilha{self._abas}")
+        self._ws.append(self.colunas)
+        self._linhas_aba = 1
+
+    def _decidir_formatos(self, linha: List[Any]):
+        for i, val in enumerate(linha):
+            if self._formatos[i] is None and val is not None:
+                self._formatos[i] = formato_coluna(val) or ""
+
+    def escrever(self, linha: Iterable[Any]):
+        """Acrescenta uma linha à aba atual, abrindo uma nova aba se necessário."""
+        if self._linhas_aba >= self.max_linhas:
+            self._nova_aba()
+
+        linha = list(linha)
+        if None in self._formatos:
+            self._decidir_formatos(linha)
+
+        for i, fmt in enumerate(self._formatos):
+            val = linha[i]
+            if fmt and isinstance(val, date):
+                # Coluna iniciada só com datas passa a data/hora no primeiro horário encontrado;
+                # as células já gravadas eram meia-noite e continuam corretas.
+                if fmt == FORMATO_DATA and isinstance(val, dt) and (val.hour or val.minute or val.second):
+                    fmt = self._formatos[i] = FORMATO_DATA_HORA
+                cell = self._celula(self._ws, value=val)
+                cell.number_format = fmt
+                linha[i] = cell
+
+        self._ws.append(linha)
+        self._linhas_aba += 1
+        self.total_linhas += 1
+
+    def escrever_lote(self, linhas: Iterable[Iterable[Any]]):
+        for linha in linhas:
+            self.escrever(linha)
+
+    def escrever_colunas(self, colunas: Sequence[Sequence[Any]]):
+        """Acrescenta um lote em colunas; o formato de data é decidido uma vez por coluna."""
+        valores = []
+        for i, coluna in enumerate(colunas):
+            lista, self._formatos[i] = coluna_formatada(coluna, self._formatos[i], como_texto=False)
+            valores.append(lista)
+        total = len(valores[0]) if valores else 0
+
+        inicio = 0
+        while inicio < total:
+            if self._linhas_aba >= self.max_linhas:
+                self._nova_aba()
+            fim = min(total, inicio + self.max_linhas - self._linhas_aba)
+            # As células com formato pertencem à aba atual, então são criadas por trecho
+            partes = [
+                [self._celula_data(v, fmt) for v in lista[inicio:fim]] if fmt else lista[inicio:fim]
+                for lista, fmt in zip(valores, self._formatos)
+            ]
+            for linha in zip(*partes):
+                self._ws.append(linha)
+            self._linhas_aba += fim - inicio
+            self.total_linhas += fim - inicio
+            inicio = fim
+
+    def _celula_data(self, val: Any, fmt: str) -> Any:
+        if val is None:
+            return None
+        cell = self._celula(self._ws, value=val)
+        cell.number_format = fmt
+        return cell
+
+    def fechar(self) -> List[Path]:
+        """Grava o arquivo em disco (uma única vez) e retorna a lista de arquivos gerados."""
+        if self._salvo:
+            return [self.path]
+        self._salvo = True
+        self._wb.save(self.path)
+        if self._abas > 1:
+            logging.info(f"Planilha '{self.path.name}' dividida em {self._abas} abas ({self.total_linhas} linhas).")
+        return [self.path]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.fechar()
+
+
+class CSVWriter:
+    """
+    Escreve o relatório em CSV (';' e UTF-8 com BOM, como o Excel pt-BR espera),
+    sem compressão, em .csv.gz ou dentro de um .zip.
+
+    Antes de passar de 'max_bytes' (medido no arquivo em disco), a parte atual é fechada
+    e uma nova começa com o cabeçalho repetido: nome.csv, nome_parte2.csv, ...
+    """
+
+    # De quantas em quantas linhas o tamanho do arquivo comprimido é conferido
+    _VERIFICAR_A_CADA = 1000
+    # Saída que o zlib do .zip ainda pode estar retendo (não há como descarregá-la pela API do zipfile)
+    _RETIDO_NO_ZIP = 256 * 1024
+
+    def __init__(self, pasta: Path, nome: str, colunas: List[str], compressao: Optional[str] = None,
+                 max_bytes: int = int(REPORT_MAX_FILE_MB * 1024 * 1024)):
+        if compressao not in (None, "gzip", "zip"):
+            raise ValueError(f"Compressão não suportada: {compressao}")
+        self.pasta = Path(pasta)
+        self.nome = nome
+        self.colunas = list(colunas)
+        self.compressao = compressao
+        self.max_bytes = max_bytes
+        self.total_linhas = 0
+        self.arquivos: List[Path] = []
+
+        self._bruto = None
+        self._zip = None
+        self._gzip = None
+        self._texto = None
+        self._csv = None
+        self._linhas_parte = 0
+        self._formatos: List[Optional[str]] = [None] * len(self.colunas)
+        self._nova_parte()
+
+    def _caminho(self, parte: int) -> Path:
+        sufixo = "" if parte == 1 else f"_parte{parte}"
+        extensao = {None: ".csv", "gzip": ".csv.gz", "zip": ".zip"}[self.compressao]
+        return self.pasta / f"{self.nome}{sufixo}{extensao}"
+
+    def _nova_parte(self):
+        self._fechar_parte()
+        path = self._caminho(len(self.arquivos) + 1)
+        self.arquivos.append(path)
+
+        if self.compressao == "zip":
+            self._bruto = open(path, "wb")
+            self._zip = zipfile.ZipFile(self._bruto, "w", compression=zipfile.ZIP_DEFLATED)
+            binario = self._zip.open(path.with_suffix(".csv").name, "w", force_zip64=True)
+        elif self.compressao == "gzip":
+            self._bruto = open(path, "wb")
+            binario = self._gzip = gzip.GzipFile(fileobj=self._bruto, mode="wb")
+        else:
+            self._bruto = binario = open(path, "wb")
+
+        self._texto = io.TextIOWrapper(binario, encoding="utf-8-sig", newline="")
+        self._csv = csv.writer(self._texto, delimiter=";")
+        self._csv.writerow(self.colunas)
+        self._linhas_parte = 0
+        self._cheio = False
+
+    def _fechar_parte(self):
+        if self._texto is None:
+            return
+        self._texto.close()
+        if self._zip is not None:
+            self._zip.close()
+        if self._bruto is not None and not self._bruto.closed:
+            self._bruto.close()
+        self._texto = self._zip = self._gzip = self._bruto = self._csv = None
+
+    def _tamanho_atual(self) -> int:
+        """Tamanho da parte em disco, incluindo o que ainda está nos buffers de texto e do compressor."""
+        self._texto.flush()
+        if self._gzip is not None:
+            # Z_SYNC_FLUSH: esvazia o zlib mantendo o dicionário (custo de poucos bytes na compressão)
+            self._gzip.flush()
+        elif self._zip is not None:
+            return self._bruto.tell() + self._RETIDO_NO_ZIP
+        return self._bruto.tell()
+
+    def _conferir_tamanho(self):
+        """Fecha a parte se o próximo bloco de linhas, no ritmo atual, passaria de max_bytes."""
+        tamanho = self._tamanho_atual()
+        self._cheio = tamanho + tamanho / self._linhas_parte * self._VERIFICAR_A_CADA >= self.max_bytes
+
+    def _formatar(self, linha: List[Any]) -> List[Any]:
+        for i, val in enumerate(linha):
+            if not isinstance(val, date):
+                continue
+            fmt = self._formatos[i]
+            if fmt is None or (fmt == FORMATO_DATA and isinstance(val, dt) and (val.hour or val.minute or val.second)):
+                fmt = self._formatos[i] = formato_coluna(val)
+            linha[i] = val.strftime("%d/%m/%Y %H:%M:%S" if fmt == FORMATO_DATA_HORA else "%d/%m/%Y")
+        return linha
+
+    def escrever_lote(self, linhas: Iterable[Iterable[Any]]):
+        for linha in linhas:
+            # A troca de parte só acontece quando há mais linhas, evitando uma parte só com cabeçalho
+            if self._cheio:
+                self._nova_parte()
+            self._csv.writerow(self._formatar(list(linha)))
+            self._linhas_parte += 1
+            self.total_linhas += 1
+            if self._linhas_parte % self._VERIFICAR_A_CADA == 0:
+                self._conferir_tamanho()
+
+    def escrever_colunas(self, colunas: Sequence[Sequence[Any]]):
+        """
+        Acrescenta um lote em colunas: datas são formatadas coluna a coluna e as linhas
+        vão ao csv em blocos, conferindo o tamanho da parte a cada bloco.
+        """
+        valores = []
+        for i, coluna in enumerate(colunas):
+            lista, self._formatos[i] = coluna_formatada(coluna, self._formatos[i], como_texto=True)
+            valores.append(lista)
+
+        linhas = zip(*valores)
+        while True:
+            bloco = list(islice(linhas, self._VERIFICAR_A_CADA))
+            if not bloco:
+                break
+            if self._cheio:
+                self._nova_parte()
+            self._csv.writerows(bloco)
+            self._linhas_parte += len(bloco)
+            self.total_linhas += len(bloco)
+            self._conferir_tamanho()
+
+    def fechar(self) -> List[Path]:
+        """Fecha a parte atual e retorna todos os arquivos gerados."""
+        if self._texto is None:
+            return list(self.arquivos)
+        self._fechar_parte()
+        if len(self.arquivos) > 1:
+            logging.info(f"Relatório '{self.nome}' dividido em {len(self.arquivos)} arquivos ({self.total_linhas} linhas).")
+        return list(self.arquivos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.fechar()
+        else:
+            self._fechar_parte()
+
+
+def criar_writer(formato: str, pasta: Path, nome: str, colunas: List[str]):
+    """Writer do formato de saída da rotina ('xlsx', 'csv', 'csv.gz' ou 'zip')."""
+    formato = (formato or "xlsx").lower()
+    if formato == "xlsx":
+        return ExcelWriter(Path(pasta) / f"{nome}.xlsx", colunas)
+    if formato == "csv":
+        return CSVWriter(pasta, nome, colunas)
+    if formato == "csv.gz":
+        return CSVWriter(pasta, nome, colunas, compressao="gzip")
+    if formato == "zip":
+        return CSVWriter(pasta, nome, colunas, compressao="zip")
+    raise ValueError(f"Formato de saída desconhecido: {formato} (aceitos: {', '.join(FORMATOS_SAIDA)})")
@@ -0,0 +1,71 @@
+"""Pré-geração de relatórios: histórico de duração e momento de início antes da dta_proxima."""
+
+import json
+import logging
+from collections import deque
+from datetime import datetime as dt, timedelta
+from math import ceil
+from os import getenv, replace
+from pathlib import Path
+from threading import Lock
+from typing import Deque, Dict, Optional
+
+# Folga sobre a duração estimada: início = dta_proxima - (estimativa * fator + margem)
+PREPARE_SAFETY_FACTOR = float(getenv("PREPARE_SAFETY_FACTOR", "1.5"))
+PREPARE_MARGIN_SECONDS = float(getenv("PREPARE_MARGIN_SECONDS", "60"))
+# Execuções mantidas por rotina para a estimativa
+_HISTORICO_MAX = 20
+
+
+class DurationHistory:
+    """
+    Durações recentes por rotina (geração do relatório, para a pré-geração, ou a
+    execução completa, para o simulador). A estimativa é o percentil 90, para que
+    uma execução mais lenta que a média ainda termine antes do horário.
+    O histórico é gravado em JSON para sobreviver a reinícios do serviço.
+    """
+
+    def __init__(self, arquivo: Optional[Path] = None, maximo: int = _HISTORICO_MAX):
+        self.arquivo = arquivo
+        self.maximo = maximo
+        self._lock = Lock()
+        self._duracoes: Dict[str, Deque[float]] = {}
+        if arquivo is not None and arquivo.exists():
+            try:
+                dados = json.loads(arquivo.read_text(encoding="utf-8"))
+                self._duracoes = {k: deque(v, maxlen=maximo) for k, v in dados.items()}
+            except (OSError, ValueError) as e:
+                logging.warning(f"Histórico de durações ignorado ({arquivo}): {e}")
+
+    def registrar(self, id_rotina: int, segundos: float):
+        with self._lock:
+            self._duracoes.setdefault(str(id_rotina), deque(maxlen=self.maximo)).append(round(segundos, 3))
+            if self.arquivo is None:
+                return
+            # Arquivo pequeno: gravado sob a trava para que threads não disputem o temporário
+            try:
+                self.arquivo.parent.mkdir(parents=True, exist_ok=True)
+                temporario = self.arquivo.with_suffix(".tmp")
+                temporario.write_text(json.dumps({k: list(v) for k, v in self._duracoes.items()}), encoding="utf-8")
+                replace(temporario, self.arquivo)
+            except OSError as e:
+                logging.warning(f"Falha ao gravar o histórico de durações ({self.arquivo}): {e}")
+
+    def estimativa(self, id_rotina: int) -> Optional[float]:
+        """Percentil 90 das durações registradas; None sem histórico."""
+        with self._lock:
+            duracoes = sorted(self._duracoes.get(str(id_rotina), ()))
+        if not duracoes:
+            return None
+        return duracoes[ceil(0.9 * len(duracoes)) - 1]
+
+
+def inicio_preparo(dta_agendada: dt, antecedencia_min: float, estimativa: Optional[float]) -> dt:
+    """
+    Quando começar a gerar o relatório: a estimativa com folga, limitada à
+    ANTECEDENCIA da rotina; sem histórico, usa a antecedência inteira.
+    """
+    segundos = antecedencia_min * 60
+    if estimativa is not None:
+        segundos = min(segundos, estimativa * PREPARE_SAFETY_FACTOR + PREPARE_MARGIN_SECONDS)
+    return dta_agendada - timedelta(seconds=segundos)
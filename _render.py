@@ -0,0 +1,225 @@
+"""Renderização de relatórios em processos separados, fora do GIL das threads de rotina."""
+
+import logging
+import multiprocessing
+from atexit import register
+from multiprocessing.connection import Connection
+from os import getenv
+from pathlib import Path
+from queue import Queue
+from threading import Lock
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+from _metricas import metricas
+from _planilhas import criar_writer
+
+# Processos dedicados à geração de planilhas/CSV; 0 mantém a geração na thread da rotina
+REPORT_RENDER_PROCESSES = int(getenv("REPORT_RENDER_PROCESSES", "0"))
+
+
+def _worker(conn: Connection):
+    """
+    Laço do processo: um relatório por vez.
+    Mensagens: ("abrir", formato, pasta, nome, colunas), ("lote", linhas), ("colunas", valores),
+    ("fechar",), ("abortar",) e None para encerrar. Só "fechar" tem resposta, então os lotes seguem
+    sem esperar confirmação (o buffer do pipe limita quanto o produtor se adianta).
+    """
+    writer = None
+    erro: Optional[str] = None
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        comando = msg[0]
+        try:
+            if comando == "abrir":
+                erro = None
+                writer = criar_writer(*msg[1:])
+            elif comando == "lote":
+                if erro is None:
+                    writer.escrever_lote(msg[1])
+            elif comando == "colunas":
+                if erro is None:
+                    writer.escrever_colunas(msg[1])
+            elif comando == "fechar":
+                if erro is None:
+                    conn.send(("ok", writer.fechar(), writer.total_linhas))
+                else:
+                    if writer is not None:
+                        writer.__exit__(RuntimeError, None, None)
+                    conn.send(("erro", erro, 0))
+                writer = None
+            elif comando == "abortar":
+                if writer is not None:
+                    writer.__exit__(RuntimeError, None, None)
+                writer = None
+        except Exception as e:
+            erro = f"{type(e).__name__}: {e}"
+            if comando == "fechar":
+                conn.send(("erro", erro, 0))
+                writer = None
+
+
+class _Processo:
+    def __init__(self, contexto):
+        self.conn, filho = contexto.Pipe()
+        self.processo = contexto.Process(target=_worker, args=(filho,), name="render", daemon=True)
+        self.processo.start()
+        filho.close()
+
+    def vivo(self) -> bool:
+        return self.processo.is_alive()
+
+    def encerrar(self, timeout: float = 5):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.processo.join(timeout)
+        if self.processo.is_alive():
+            self.processo.terminate()
+        self.conn.close()
+
+
+class RemoteWriter:
+    """Mesma interface dos writers de _planilhas, executando a escrita em um processo do pool."""
+
+    def __init__(self, pool: "RenderPool", processo: _Processo, formato: str, pasta: Path, nome: str,
+                 colunas: List[str]):
+        self._pool = pool
+        self._processo: Optional[_Processo] = processo
+        self.total_linhas = 0
+        self._arquivos: Optional[List[Path]] = None
+        self._enviar(("abrir", formato, Path(pasta), nome, list(colunas)))
+
+    def _enviar(self, msg: Tuple[Any, ...]):
+        try:
+            self._processo.conn.send(msg)
+        except (OSError, EOFError) as e:
+            self._liberar(descartar=True)
+            raise RuntimeError(f"Processo de renderização indisponível: {e}")
+
+    def _liberar(self, descartar: bool = False):
+        if self._processo is not None:
+            self._pool.devolver(self._processo, descartar)
+            self._processo = None
+
+    def escrever_lote(self, linhas: Iterable[Iterable[Any]]):
+        # Tuplas são mais compactas de serializar que as listas/objetos do driver
+        self._enviar(("lote", [tuple(linha) for linha in linhas]))
+
+    def escrever_colunas(self, colunas: Sequence[Sequence[Any]]):
+        # Arrays Arrow são serializados no formato colunar, sem passar por objetos Python
+        self._enviar(("colunas", [c if hasattr(c, "to_pylist") else tuple(c) for c in colunas]))
+
+    def fechar(self) -> List[Path]:
+        if self._arquivos is not None:
+            return list(self._arquivos)
+        self._enviar(("fechar",))
+        try:
+            status, resultado, total = self._processo.conn.recv()
+        except (OSError, EOFError) as e:
+            self._liberar(descartar=True)
+            raise RuntimeError(f"Processo de renderização encerrado inesperadamente: {e}")
+        self._liberar()
+        if status != "ok":
+            raise RuntimeError(f"Erro ao gerar o relatório: {resultado}")
+        self._arquivos, self.total_linhas = resultado, total
+        return list(resultado)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.fechar()
+        elif self._processo is not None:
+            try:
+                self._processo.conn.send(("abortar",))
+                self._liberar()
+            except OSError:
+                self._liberar(descartar=True)
+
+
+class RenderPool:
+    """
+    Processos de renderização reutilizáveis, criados sob demanda até 'workers'.
+    Cada relatório ocupa um processo do início ao fim; com todos ocupados, a
+    rotina espera um ficar livre.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        # 'spawn' funciona igual no Windows (serviço) e no Linux
+        self._contexto = multiprocessing.get_context("spawn")
+        self._livres: Queue = Queue()
+        self._criados = 0
+        self._todos: List[_Processo] = []
+        self._lock = Lock()
+        register(self.encerrar)
+
+    def _obter(self) -> _Processo:
+        with self._lock:
+            if self._livres.empty() and self._criados < self.workers:
+                self._criados += 1
+                processo = _Processo(self._contexto)
+                self._todos.append(processo)
+                return processo
+        while True:
+            processo = self._livres.get()
+            if processo.vivo():
+                return processo
+            # Processo morto (ex.: falta de memória): substitui
+            logging.warning("Processo de renderização encerrado; criando outro.")
+            self.devolver(processo, descartar=True)
+            with self._lock:
+                if self._criados < self.workers:
+                    self._criados += 1
+                    processo = _Processo(self._contexto)
+                    self._todos.append(processo)
+                    return processo
+
+    def devolver(self, processo: _Processo, descartar: bool = False):
+        if not descartar:
+            self._livres.put(processo)
+            return
+        with self._lock:
+            if processo in self._todos:
+                self._todos.remove(processo)
+                self._criados -= 1
+        processo.encerrar(timeout=1)
+
+    def criar_writer(self, formato: str, pasta: Path, nome: str, colunas: List[str]) -> RemoteWriter:
+        return RemoteWriter(self, self._obter(), formato, pasta, nome, colunas)
+
+    def ocupados(self) -> int:
+        return self._criados - self._livres.qsize()
+
+    def encerrar(self):
+        with self._lock:
+            processos, self._todos = self._todos, []
+            self._criados = 0
+        for processo in processos:
+            processo.encerrar()
+
+
+_pool: Optional[RenderPool] = None
+_pool_lock = Lock()
+
+
+def render_pool() -> Optional[RenderPool]:
+    """Pool compartilhado, ou None se REPORT_RENDER_PROCESSES=0."""
+    global _pool
+    if REPORT_RENDER_PROCESSES <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool(REPORT_RENDER_PROCESSES)
+            metricas.registrar_gauge("render_processos", "estado", lambda: {
+                "ocupados": _pool.ocupados(), "max": _pool.workers
+            })
+            logging.info(f"Renderização de relatórios em até {REPORT_RENDER_PROCESSES} processo(s).")
+        return _pool
@@ -1,28 +1,144 @@
-from _database import DB, InterfaceError
-from _emails import Email
-from _utils import notify_error
+from _database import DB, InterfaceError, criar_pool
+from _emails import Email, agrupar_anexos, verificar_smtp
+from _utils import contexto_rotina, notify_error, lock_file
+from _planilhas import REPORT_COLUMNAR, criar_writer
+from _render import render_pool
+from _triggers import TriggerRunner
+from _executor import LANES_PADRAO, RoutineExecutor
+from _agenda import ScheduleIndex, proxima_execucao
+from _cache import DirectoryIndex, SingleFlight, TTLCache
+from _incremental import (
+    MODOS_INCREMENTAIS, CacheIncremental, Marca, posicao_coluna, sql_incremental, texto_para_marca
+)
+from _metricas import BUCKETS_BYTES, fase, iterar_fase, metricas
+from _preparo import DurationHistory, inicio_preparo
 
-from dataclasses import dataclass
-from datetime import datetime as dt
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from datetime import datetime as dt, timedelta
+from functools import lru_cache
 from pathlib import Path
-from threading import Thread
-from typing import List, Optional, Any
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional, Any, Tuple
 from unicodedata import category, normalize
+import re
 
 from atexit import register
-from msvcrt import locking, LK_NBLCK
 from os import getpid, _exit, getenv
-from time import sleep
+from shutil import copyfile
+from socket import gethostname
+from threading import Event, Lock, Thread, Timer
+from time import perf_counter, sleep
 import logging
 
-# Dependências externas
-try:
-    from openpyxl import Workbook
-    from apscheduler.schedulers.blocking import BlockingScheduler
-except ImportError as e:
-    logging.error(f"Dependência faltando: {e}")
 
 
+def column_index(description) -> Dict[str, int]:
+    """Mapeia o nome (maiúsculo) de cada coluna do cursor.description para sua posição."""
+    return {c[0].upper(): i for i, c in enumerate(description or [])}
+
+
+def _col(row, colunas: Optional[Dict[str, int]], nome: str, default: Any = None) -> Any:
+    """Lê uma coluna opcional pelo nome, usando o padrão se ausente ou nula."""
+    idx = (colunas or {}).get(nome)
+    return row[idx] if idx is not None and row[idx] is not None else default
+
+
+def clean_name(nome: str) -> str:
+    """Nome da rotina sem acentos e espaços, usado em arquivos e pastas."""
+    nome = normalize('NFD', nome.lower().replace(' ', '_'))
+    return "".join(c for c in nome if category(c) != 'Mn')
+
+
+# Literais entre aspas simples ('' escapado) são preservados na normalização
+_LITERAL_SQL = re.compile(r"('(?:[^']|'')*')")
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL sem espaços redundantes nem ';' final, para comparar consultas equivalentes."""
+    partes = _LITERAL_SQL.split(sql.strip().rstrip(";").strip())
+    return "".join(p if i % 2 else " ".join(p.split()) for i, p in enumerate(partes))
+
+
+def share_report_files(arquivos: List[Path], origem: str, destino: str) -> List[Path]:
+    """
+    Cópias dos arquivos gerados para a rotina 'origem' com o nome da rotina 'destino',
+    mantendo o sufixo das partes (ex.: origem_parte2.csv -> destino_parte2.csv).
+    """
+    if origem == destino:
+        return list(arquivos)
+    copias = []
+    for arquivo in arquivos:
+        copia = arquivo.with_name(destino + arquivo.name[len(origem):])
+        copyfile(arquivo, copia)
+        copias.append(copia)
+    return copias
+
+
+def schedule_sql(periodo: str) -> Optional[str]:
+    """SQL de reagendamento do período (params: dta_agendada, intervalo, id)."""
+    # Mapeamento de SQLs de update por período
+    sql_map = {
+        'Mi': getenv("SQL_UPDATE_SCHEDULE_MINUTE"),
+        'H': getenv("SQL_UPDATE_SCHEDULE_HOUR"),
+        'D': getenv("SQL_UPDATE_SCHEDULE_DAY"),
+        'M': getenv("SQL_UPDATE_SCHEDULE_MONTH")
+    }
+    return sql_map.get(periodo)
+
+
+@lru_cache(maxsize=None)
+def _info_dirs(base_path: Path) -> Tuple[Path, Path]:
+    """Cria (uma vez por processo) a estrutura informativo/anexos e informativo/corpos."""
+    base_info = base_path / "informativo"
+    for pasta in (base_info / "anexos", base_info / "corpos"):
+        pasta.mkdir(parents=True, exist_ok=True)
+    return base_info / "anexos", base_info / "corpos"
+
+
+# Listagens das pastas de informativos, refeitas só quando a pasta muda
+_info_index = DirectoryIndex()
+
+
+def build_info_email(base_path: Path, routine: "RoutineData", destinatarios: List[str], hiperlinks: Dict[str, Any]) -> Email:
+    """Monta o e-mail do informativo a partir das pastas de anexos e corpos da rotina."""
+    nome = clean_name(routine.nome)
+    anexos_base, corpos_base = _info_dirs(base_path)
+
+    anexos = [str(p) for p in _info_index.listar(anexos_base / nome)]
+    corpos = [str(p) for p in _info_index.listar(corpos_base / nome)]
+
+    posicoes = {nome: i for i, nome in enumerate(hiperlinks.keys())}
+    corpos_organizados = sorted(
+        corpos,
+        key=lambda x: posicoes.get(Path(x).name, len(posicoes))
+    )
+    return Email(
+        user=getenv("EMAIL_INFORMATIVO_USER"),
+        password=getenv("EMAIL_INFORMATIVO_PASS"),
+        cco=destinatarios,
+        titulo=f"Informativo - {routine.nome}",
+        anexos=anexos,
+        corpo_arq=corpos_organizados,
+        hyperlink=hiperlinks,
+        reutilizar_partes=True
+    )
+
+
+def build_report_emails(routine: "RoutineData", destinatarios: List[str], arquivos: List[Path]) -> List[Email]:
+    """Um e-mail por grupo de anexos que cabe no limite de tamanho (EMAIL_MAX_SIZE_MB)."""
+    grupos = agrupar_anexos([str(p) for p in arquivos])
+    emails = []
+    for i, grupo in enumerate(grupos, 1):
+        sufixo = f" ({i}/{len(grupos)})" if len(grupos) > 1 else ""
+        emails.append(Email(
+            para=destinatarios,
+            titulo=f"Relatório - {routine.nome}{sufixo}",
+            corpo_texto="Segue em anexo o relatório solicitado.",
+            anexos=grupo
+        ))
+    return emails
+
 
 @dataclass
 class RoutineData:
@@ -36,22 +152,89 @@ class RoutineData:
     dta_final: Optional[dt]
     sql: Optional[str]
     tipo: str
+    prioridade: int = 0
+    formato: str = "xlsx"
+    ativo: bool = True
+    versao: Any = None
+    timeout: Optional[float] = None
+    antecedencia: Optional[float] = None
+    coluna_incremental: Optional[str] = None
+    modo_incremental: str = "delta"
+    marca: Any = None
 
     @classmethod
-    def from_row(cls, row):
+    def from_row(cls, row, colunas: Optional[Dict[str, int]] = None):
+        """'colunas' (ver column_index) habilita a leitura das colunas opcionais pelo nome."""
         return cls(
             id=row[0], nome=row[1], periodo=row[2], intervalo=row[3],
             dta_inicial=row[4], dta_proxima=row[5], dta_final=row[6],
-            sql=str(row[7]).upper(), tipo=row[10]
+            # Triggers podem conter comandos externos, sensíveis a maiúsculas/minúsculas
+            sql=str(row[7]) if row[10] == 'TRG' else str(row[7]).upper(), tipo=row[10],
+            prioridade=_col(row, colunas, "PRIORIDADE", 0),
+            formato=str(_col(row, colunas, "FORMATO", "xlsx")).lower(),
+            ativo=_col(row, colunas, "ATIVO", 'S') != 'N',
+            versao=_col(row, colunas, "VERSAO"),
+            timeout=_col(row, colunas, "TIMEOUT"),
+            antecedencia=_col(row, colunas, "ANTECEDENCIA"),
+            coluna_incremental=_col(row, colunas, "COLUNA_INCREMENTAL"),
+            modo_incremental=str(_col(row, colunas, "MODO_INCREMENTAL", "delta")).lower(),
+            marca=_col(row, colunas, "MARCA_INCREMENTAL")
         )
 
 
 class RoutineService(DB):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, pool: Any = None):
+        super().__init__(pool)
         self.base_path = Path.cwd()
         self.lock_file_path = self.base_path / "service.lock"
         self.lock_handle = None
+        self.executor: Optional[RoutineExecutor] = None
+
+        # Modo multi-instância: rotinas são reivindicadas com lease no banco
+        self.claim_sql = getenv("SQL_CLAIM_ROUTINE")
+        self.claim_lease = int(getenv("CLAIM_LEASE_SECONDS", "900"))
+        self.node_id = f"{gethostname()}:{getpid()}"
+        self._claimed: set = set()
+        self._claimed_lock = Lock()
+
+        # Modo de agendamento: 'polling' (consulta a cada minuto) ou 'evento' (agenda em memória)
+        self.schedule_mode = getenv("SCHEDULE_MODE", "polling").lower()
+        self.agenda = ScheduleIndex()
+        self._agenda_versao: Any = None
+        self._agenda_lock = Lock()
+        self._parar = Event()
+
+        # Destinatários e hiperlinks mudam pouco: cache com expiração
+        ttl_contatos = float(getenv("CONTACTS_CACHE_TTL_SECONDS", "300"))
+        self._cache_destinatarios = TTLCache(ttl_contatos)
+        self._cache_hiperlinks = TTLCache(ttl_contatos)
+        # Última assinatura dos contatos por rotina (SQL_CONTACTS_SIGNATURE)
+        self._assinaturas_contatos: Optional[Dict[int, Any]] = None
+
+        # Relatórios com a mesma SQL em execução ao mesmo tempo: uma consulta e um arquivo compartilhados
+        self._relatorios = SingleFlight(float(getenv("REPORT_SHARE_SECONDS", "0")))
+
+        # Rotinas incrementais: id -> (marca lida do banco, marca gravada por esta instância),
+        # para que a agenda em memória não repita a marca anterior
+        self._marcas: Dict[int, Tuple[Any, str]] = {}
+
+        # Pré-geração (ANTECEDENCIA): id -> (dta_proxima, resultado); durações para decidir o início
+        self._preparos: Dict[int, Tuple[dt, Future]] = {}
+        self._preparos_lock = Lock()
+        # Rotinas devidas cuja execução espera a pré-geração do mesmo horário terminar
+        self._aguardando_preparo: set = set()
+        self._duracoes = DurationHistory(self.base_path / "planilhas" / "duracoes.json")
+        # Duração completa das execuções bem-sucedidas de qualquer tipo (usada pelo simulador)
+        self._execucoes = DurationHistory(self.base_path / "planilhas" / "execucoes.json")
+
+        # Triggers usam um pool próprio (criado no primeiro uso), fora da disputa com os relatórios
+        self._pool_injetado = pool
+        self._triggers: Optional[TriggerRunner] = None
+        self._triggers_lock = Lock()
+
+        # Pronto = conexões aquecidas e SMTP verificado; as verificações esperam por isso
+        self.pronto = Event()
+        self._criado_em = perf_counter()
         register(self.release_lock)
 
     def release_lock(self):
@@ -67,7 +250,7 @@ class RoutineService(DB):
         for _ in range(5):
             try:
                 self.lock_handle = open(self.lock_file_path, "w")
-                locking(self.lock_handle.fileno(), LK_NBLCK, 1)
+                lock_file(self.lock_handle)
                 self.lock_handle.write(str(getpid()))
                 self.lock_handle.flush()
                 logging.info(f"Lock adquirido (PID: {getpid()})")
@@ -80,17 +263,49 @@ class RoutineService(DB):
         _exit(0)
 
     def run(self):
-        self.acquire_lock()
+        if self.claim_sql:
+            # A exclusão mútua fica a cargo do lease no banco; várias instâncias podem rodar
+            logging.info(f"Modo multi-instância ativo (nó {self.node_id}, lease {self.claim_lease}s).")
+        else:
+            self.acquire_lock()
+        self.executor = RoutineExecutor()
+        self._register_metrics()
+        try:
+            from apscheduler.schedulers.blocking import BlockingScheduler
+        except ImportError as e:
+            logging.error(f"Dependência faltando: {e}")
+            raise
         scheduler = BlockingScheduler()
+        # O aquecimento roda junto com a carga da agenda; as verificações esperam por 'pronto'
+        Thread(target=self.prepare, name="inicializacao", daemon=True).start()
 
-        # Configuração do Job
-        scheduler.add_job(
-            self.check_routines,
-            'cron',
-            second='0',
-            misfire_grace_time=15,
-            coalesce=True
-        )
+        if self.schedule_mode == 'evento':
+            self._iniciar_agenda(scheduler)
+        else:
+            # Configuração do Job
+            scheduler.add_job(
+                self.check_routines,
+                'cron',
+                second='0',
+                misfire_grace_time=15,
+                coalesce=True
+            )
+            # Reinício depois do segundo 0 (ex.: virada da hora): não espera o próximo minuto.
+            # Perto do próximo ciclo, deixa para ele, evitando duas verificações seguidas.
+            if dt.now().second < 55:
+                scheduler.add_job(self.check_routines, id="verificacao-inicial")
+        if getenv("SQL_ROUTINES_TO_PREPARE"):
+            scheduler.add_job(
+                self.check_prepare, 'interval',
+                seconds=int(getenv("PREPARE_CHECK_SECONDS", "30")), coalesce=True
+            )
+        if getenv("SQL_CONTACTS_SIGNATURE"):
+            scheduler.add_job(
+                self._check_contacts, 'interval',
+                seconds=int(getenv("CONTACTS_CHANGE_POLL_SECONDS", "30")), coalesce=True
+            )
+        if self.claim_sql:
+            scheduler.add_job(self._renew_claims, 'interval', seconds=max(1, self.claim_lease // 3))
 
         logging.info("Serviço de Rotinas Iniciado...")
         try:
@@ -98,95 +313,502 @@ class RoutineService(DB):
         except (KeyboardInterrupt, SystemExit, InterfaceError):
             logging.info("Serviço finalizado pelo usuário ou erro de interface.")
         finally:
+            # Rotinas em andamento terminam antes de liberar a trava
+            self._parar.set()
+            self.agenda.acordar()
+            self.executor.encerrar()
+            # Triggers que passaram do prazo de encerramento são interrompidos
+            if self._triggers and self._triggers.cancelar_todos():
+                logging.warning("Triggers em execução interrompidos no encerramento.")
+            self.descarregar_escritas()
             self.release_lock()
 
+    def prepare(self):
+        """
+        Deixa o serviço pronto antes do primeiro ciclo: abre as conexões esperadas para
+        a concorrência configurada (DB_POOL_WARM) e verifica/abre as sessões SMTP.
+        Falhas são registradas, mas não impedem a inicialização. Roda em segundo plano;
+        check_routines, check_prepare e a agenda em memória esperam o evento 'pronto'.
+        """
+        inicio = perf_counter()
+        esperado = int(getenv("DB_POOL_WARM", str(sum(LANES_PADRAO.values()) + 1)))
+        try:
+            conexoes = self.aquecer(esperado)
+            logging.info(f"Pool do banco aquecido: {conexoes} conexão(ões) em {perf_counter() - inicio:.2f}s.")
+        except Exception as e:
+            logging.error(f"Falha ao aquecer o pool do banco: {e}")
+
+        inicio_smtp = perf_counter()
+        falhas = verificar_smtp()
+        if not falhas:
+            logging.info(f"Servidor SMTP verificado em {perf_counter() - inicio_smtp:.2f}s.")
+
+        self.pronto.set()
+        total = perf_counter() - self._criado_em
+        metricas.definir("inicializacao_segundos", total)
+        logging.info(f"Serviço pronto em {total:.2f}s.")
+
+    def _register_metrics(self):
+        """Gauges lidos na exportação: uso do pool de conexões e filas do executor."""
+        metricas.registrar_gauge("db_pool_conexoes", "estado", lambda: {
+            k: v for k, v in self.estatisticas_pool().items() if k in ("ocupadas", "abertas", "min", "max")
+        })
+        metricas.registrar_gauge("executor_fila", "tipo", lambda: {
+            tipo: st["fila"] for tipo, st in self.executor.estatisticas().items()
+        })
+        metricas.registrar_gauge("executor_executando", "tipo", lambda: {
+            tipo: st["executando"] for tipo, st in self.executor.estatisticas().items()
+        })
+        metricas.iniciar_exportacao()
+
+    def _aguardar_pronto(self) -> bool:
+        """Espera o fim da inicialização por até STARTUP_READY_TIMEOUT segundos."""
+        return self.pronto.wait(float(getenv("STARTUP_READY_TIMEOUT", "120")))
+
     def check_routines(self):
+        if not self._aguardar_pronto():
+            logging.warning("Serviço ainda em inicialização; verificação adiada para o próximo ciclo.")
+            return
         logging.info("Verificando rotinas pendentes...")
         try:
-            rows = self.consultar(getenv("SQL_ROUTINES_TO_EXECUTE"))['data']
+            if self.claim_sql:
+                result = self.reivindicar_rotinas(
+                    getenv("SQL_ROUTINES_TO_EXECUTE"), self.claim_sql, self.node_id, self.claim_lease
+                )
+            else:
+                result = self.consultar(getenv("SQL_ROUTINES_TO_EXECUTE"))
+            colunas = column_index(result['description'])
+            self._adjust_pool(len(result['data']))
+            self._preload_contacts([row[0] for row in result['data']])
+
+            for row in result['data']:
+                routine = RoutineData.from_row(row, colunas)
+                if not self.claim_sql:
+                    self._submeter(routine, self.process_routine)
+                    continue
 
-            for row in rows:
-                routine = RoutineData.from_row(row)
-                Thread(target=self.process_routine, args=(routine,), daemon=True).start()
+                with self._claimed_lock:
+                    self._claimed.add(routine.id)
+                aceita = self._submeter(routine, self._process_claimed)
+                if not aceita:
+                    # Devolve a rotina para que outra instância (ou o próximo ciclo) a execute
+                    self._release_claim(routine.id)
+
+            for tipo, st in self.executor.estatisticas().items():
+                if st["fila"] or st["executando"]:
+                    logging.info(
+                        f"Fila {tipo}: {st['fila']} aguardando, {st['executando']}/{st['workers']} em execução "
+                        f"(espera máx {st['espera_max_s']}s, média {st['espera_media_s']}s)"
+                    )
         except Exception as e:
             logging.error(f"Erro ao buscar rotinas: {e}")
             notify_error(e, "Busca por Rotinas")
 
+    def _iniciar_agenda(self, scheduler):
+        """Carrega a agenda em memória e agenda a detecção de alterações no banco."""
+        self._carregar_agenda()
+        scheduler.add_job(
+            self._detectar_alteracoes, 'interval',
+            seconds=int(getenv("SCHEDULE_CHANGE_POLL_SECONDS", "30")), coalesce=True
+        )
+        # Recarga completa periódica cobre exclusões, que não aparecem na consulta por versão
+        scheduler.add_job(
+            self._carregar_agenda, 'interval',
+            minutes=int(getenv("SCHEDULE_FULL_RELOAD_MINUTES", "60")), coalesce=True
+        )
+        Thread(target=self._loop_agenda, name="agenda", daemon=True).start()
+
+    def _atualizar_versao(self, rotinas: List[RoutineData]):
+        versoes = [r.versao for r in rotinas if r.versao is not None]
+        if versoes:
+            maior = max(versoes)
+            with self._agenda_lock:
+                if self._agenda_versao is None or maior > self._agenda_versao:
+                    self._agenda_versao = maior
+
+    def _carregar_agenda(self):
+        try:
+            result = self.consultar(getenv("SQL_ROUTINES_SCHEDULE"))
+            colunas = column_index(result['description'])
+            rotinas = [RoutineData.from_row(row, colunas) for row in result['data']]
+            self.agenda.carregar([r for r in rotinas if r.ativo])
+            self._atualizar_versao(rotinas)
+            logging.info(f"Agenda carregada: {len(self.agenda)} rotina(s) ativas. Próxima: {self.agenda.proxima()}")
+        except Exception as e:
+            logging.error(f"Erro ao carregar agenda: {e}")
+            notify_error(e, "Carga da Agenda")
+
+    def _detectar_alteracoes(self):
+        """Aplica na agenda as rotinas com versão maior que a última vista."""
+        with self._agenda_lock:
+            versao = self._agenda_versao
+        if versao is None:
+            self._carregar_agenda()
+            return
+        try:
+            result = self.consultar(getenv("SQL_ROUTINES_CHANGED"), [versao])
+            colunas = column_index(result['description'])
+            rotinas = [RoutineData.from_row(row, colunas) for row in result['data']]
+            for routine in rotinas:
+                if routine.ativo:
+                    self.agenda.atualizar(routine)
+                else:
+                    self.agenda.remover(routine.id)
+            self._atualizar_versao(rotinas)
+        except Exception as e:
+            logging.error(f"Erro ao detectar alterações na agenda: {e}")
+
+    def _loop_agenda(self):
+        """Acorda quando a próxima rotina vence (ou a agenda muda) e a despacha."""
+        limite = float(getenv("SCHEDULE_MAX_SLEEP_SECONDS", "30"))
+        if not self._aguardar_pronto():
+            logging.warning("Inicialização demorou mais que STARTUP_READY_TIMEOUT; despachando sem aguardar.")
+        while not self._parar.is_set():
+            devidas = self.agenda.retirar_devidas(dt.now())
+            if devidas:
+                self._adjust_pool(len(devidas))
+                self._preload_contacts([r.id for r in devidas])
+            for routine in devidas:
+                self._despachar(routine)
+            self.agenda.aguardar(limite)
+
+    def _adjust_pool(self, novas: int):
+        """Dimensiona o pool (DB_POOL_ADAPTIVE_MAX) para as rotinas em andamento mais as recém-devidas."""
+        estatisticas = self.executor.estatisticas().values()
+        ativas = sum(st["executando"] + st["fila"] for st in estatisticas)
+        workers = sum(st["workers"] for st in estatisticas)
+        # Uma conexão por rotina em execução, mais a verificação e as gravações agrupadas
+        try:
+            self.ajustar_pool(min(ativas + novas, workers) + 2)
+        except Exception as e:
+            logging.warning(f"Falha ao ajustar o tamanho do pool: {e}")
+
+    def _despachar(self, routine: RoutineData):
+        if self.claim_sql:
+            with self._claimed_lock:
+                reivindicada = routine.id in self._claimed
+            if reivindicada:
+                # Pré-gerada por esta instância: ela mesma a executa no horário (ver _iniciar_preparada)
+                return
+            if not self.reivindicar(self.claim_sql, self.node_id, self.claim_lease, routine.id):
+                # Outra instância já executa ou reagendou; a versão nova chega pela detecção de alterações
+                self.agenda.concluir(routine, dt.now() + self._retry_delay())
+                return
+            with self._claimed_lock:
+                self._claimed.add(routine.id)
+            fn = self._process_claimed
+        else:
+            fn = self.process_routine
+
+        if not self._submeter(routine, fn):
+            if self.claim_sql:
+                self._release_claim(routine.id)
+            self.agenda.concluir(routine, dt.now() + self._retry_delay())
+
+    def _submeter(self, routine: RoutineData, fn: Callable[[RoutineData], None]) -> bool:
+        """
+        Entrega a rotina ao executor. Se a pré-geração deste horário ainda estiver rodando,
+        a entrega acontece quando ela terminar, sem ocupar um worker à espera do resultado.
+        """
+        dta_agendada = routine.dta_proxima or routine.dta_inicial
+        with self._preparos_lock:
+            item = self._preparos.get(routine.id)
+            pendente = item is not None and item[0] == dta_agendada and not item[1].done()
+            if pendente:
+                if routine.id in self._aguardando_preparo:
+                    return True
+                self._aguardando_preparo.add(routine.id)
+        if not pendente:
+            return self.executor.submeter(routine.tipo, routine.id, fn, routine, prioridade=routine.prioridade)
+
+        logging.info(f"Rotina {routine.id} aguardando a pré-geração do relatório terminar.")
+        item[1].add_done_callback(lambda _: self._submeter_apos_preparo(routine, fn))
+        return True
+
+    def _submeter_apos_preparo(self, routine: RoutineData, fn: Callable[[RoutineData], None]):
+        with self._preparos_lock:
+            self._aguardando_preparo.discard(routine.id)
+        if not self.executor.submeter(routine.tipo, routine.id, fn, routine, prioridade=routine.prioridade):
+            # Polling: a próxima verificação tenta de novo; evento: volta para a agenda
+            if self.claim_sql:
+                self._release_claim(routine.id)
+            self._agendar_proxima(routine, dt.now() + self._retry_delay())
+
+    @staticmethod
+    def _retry_delay() -> timedelta:
+        return timedelta(seconds=int(getenv("SCHEDULE_RETRY_SECONDS", "60")))
+
+    def _agendar_proxima(self, routine: RoutineData, quando: Optional[dt]):
+        """No modo evento, devolve a rotina à agenda com a próxima data (None = desativada)."""
+        if self.schedule_mode == 'evento':
+            self.agenda.concluir(replace(routine, dta_proxima=quando), quando)
+
+    def _process_claimed(self, routine: RoutineData):
+        try:
+            self.process_routine(routine)
+        finally:
+            self._release_claim(routine.id)
+
+    def _release_claim(self, id_routine: int):
+        with self._claimed_lock:
+            self._claimed.discard(id_routine)
+        # Sem chave: a liberação é imediata, e as gravações da rotina já foram descarregadas em process_routine
+        if not self.executar(getenv("SQL_RELEASE_CLAIM"), [self.node_id, id_routine]):
+            logging.warning(f"Lease da rotina {id_routine} não liberado; expira em até {self.claim_lease}s.")
+
+    def _renew_claims(self):
+        """Renova o lease das rotinas em execução neste nó para que não expirem no meio."""
+        with self._claimed_lock:
+            ids = list(self._claimed)
+        for id_routine in ids:
+            self.executar(getenv("SQL_RENEW_CLAIM"), [self.node_id, self.claim_lease, id_routine])
+
     def process_routine(self, routine: RoutineData):
         agora = dt.now()
         dta_agendada = routine.dta_proxima or routine.dta_inicial
 
         if dta_agendada and dta_agendada <= agora:
-            try:
-                logging.info(f"Iniciando: {routine.nome} (ID: {routine.id})")
+            metricas.observar("rotina_atraso_segundos", (agora - dta_agendada).total_seconds(), tipo=routine.tipo)
 
-                # Status: Executando
-                self.executar(getenv("SQL_UPDATE_SET_TO_E_N"), [routine.id])
+            with contexto_rotina(routine.id), metricas.execucao(tipo=routine.tipo) as cron:
+                inicio = perf_counter()
+                try:
+                    logging.info(f"Iniciando: {routine.nome} (ID: {routine.id})")
 
-                # Dispatcher de tipos
-                if routine.tipo == 'RE':
-                    self._handle_report(routine)
-                elif routine.tipo == 'IN':
-                    self._handle_info(routine)
-                elif routine.tipo == 'TRG':
-                    self._hendle_trigger(routine)
+                    # Status: Executando
+                    self.executar(getenv("SQL_UPDATE_SET_TO_E_N"), [routine.id], chave=routine.id)
 
-                # Finalização e Reagendamento
-                self.executar(getenv("SQL_UPDATE_SET_TO_F_S"), [routine.id])
-                self._reschedule(routine, dta_agendada, agora)
+                    # Dispatcher de tipos
+                    if routine.tipo == 'RE':
+                        self._handle_report(routine)
+                    elif routine.tipo == 'IN':
+                        self._handle_info(routine)
+                    elif routine.tipo == 'TRG':
+                        self._hendle_trigger(routine)
 
-                logging.info(f"Sucesso:  {routine.nome} (ID: {routine.id})")
+                    # Finalização e Reagendamento
+                    self.executar(getenv("SQL_UPDATE_SET_TO_F_S"), [routine.id], chave=routine.id)
+                    self._reschedule(routine, dta_agendada, agora)
 
-            except Exception as e:
-                logging.error(f"Falha na rotina {routine.id} '{routine.nome}': {e}")
-                self.executar(getenv("SQL_UPDATE_SET_STATUS_TO_NULL"), [routine.id])
-                notify_error(e, routine.nome)
+                    self._execucoes.registrar(routine.id, perf_counter() - inicio)
+                    logging.info(f"Sucesso:  {routine.nome} (ID: {routine.id})")
+
+                except Exception as e:
+                    cron.resultado = "falha"
+                    logging.error(f"Falha na rotina {routine.id} '{routine.nome}': {e}")
+                    self.executar(getenv("SQL_UPDATE_SET_STATUS_TO_NULL"), [routine.id], chave=routine.id)
+                    self._agendar_proxima(routine, dt.now() + self._retry_delay())
+                    notify_error(e, routine.nome)
+
+                finally:
+                    # O executor libera a rotina ao retornar: status e dta_proxima precisam estar
+                    # gravados antes, ou a próxima verificação ainda a encontra devida
+                    if not self.aguardar_escritas(routine.id):
+                        logging.error(f"Status/agendamento da rotina {routine.id} não gravados no banco.")
+
+            fases = ", ".join(f"{nome} {seg:.2f}s" for nome, seg in cron.fases.items())
+            if fases:
+                logging.info(f"Fases da rotina {routine.id}: {fases}", extra={"rotina": routine.id, "fases": cron.fases})
 
     def _get_hiperlink(self, id_routine: int) -> dict[str, Any]:
-       return {
+        hiperlinks = self._cache_hiperlinks.get(id_routine)
+        if hiperlinks is None:
+            hiperlinks = {
                 h[0]: h[1] for h in self.consultar(
                     getenv("SQL_GET_HIPERLINK"),
                     [id_routine]
                 )['data']
             }
+            self._cache_hiperlinks.set(id_routine, hiperlinks)
+        return dict(hiperlinks)
 
     def _get_recipient(self, id_routine: int) -> List[str]:
-        return [
-                    r[0] for r in self.consultar(
-                        getenv("SQL_GET_RECIPIENTS"), [id_routine]
-                    )['data']
-                ]
-
-    def _get_column_names(self, sql: str) -> List[str]:
-        """Extrai nomes de colunas dos metadados da consulta."""
+        destinatarios = self._cache_destinatarios.get(id_routine)
+        if destinatarios is None:
+            destinatarios = [
+                r[0] for r in self.consultar(
+                    getenv("SQL_GET_RECIPIENTS"), [id_routine]
+                )['data']
+            ]
+            self._cache_destinatarios.set(id_routine, destinatarios)
+        return list(destinatarios)
+
+    def _preload_contacts(self, ids: List[int]):
+        """
+        Carrega destinatários e hiperlinks de várias rotinas com uma consulta cada.
+
+        SQL_GET_RECIPIENTS_BULK (id_rotina, email) e SQL_GET_HIPERLINK_BULK
+        (id_rotina, arquivo, link) devem conter '{ids}', substituído pelos binds.
+        Sem essas variáveis, cada rotina continua buscando sob demanda.
+        """
+        pendentes = [i for i in ids if i not in self._cache_destinatarios or i not in self._cache_hiperlinks]
+        sql_dest, sql_link = getenv("SQL_GET_RECIPIENTS_BULK"), getenv("SQL_GET_HIPERLINK_BULK")
+        if not pendentes or not (sql_dest or sql_link):
+            return
+
         try:
-            # Pegamos a descrição do cursor que o seu _database agora retorna
-            result = self.consultar(sql)
-            if result and 'description' in result:
-                return [c[0] for c in result['description']]
-            return []
+            # Oracle limita listas IN a 1000 elementos
+            for inicio in range(0, len(pendentes), 1000):
+                bloco = pendentes[inicio:inicio + 1000]
+                binds = ", ".join(f":{n}" for n in range(1, len(bloco) + 1))
+
+                if sql_dest:
+                    destinatarios: Dict[int, List[str]] = {i: [] for i in bloco}
+                    for id_routine, email in self.consultar(sql_dest.format(ids=binds), bloco)['data']:
+                        destinatarios.setdefault(id_routine, []).append(email)
+                    for id_routine, lista in destinatarios.items():
+                        self._cache_destinatarios.set(id_routine, lista)
+
+                if sql_link:
+                    hiperlinks: Dict[int, Dict[str, Any]] = {i: {} for i in bloco}
+                    for id_routine, arquivo, link in self.consultar(sql_link.format(ids=binds), bloco)['data']:
+                        hiperlinks.setdefault(id_routine, {})[arquivo] = link
+                    for id_routine, links in hiperlinks.items():
+                        self._cache_hiperlinks.set(id_routine, links)
         except Exception as e:
-            logging.error(f"Erro ao obter colunas: {e}")
-            return []
+            # Não é fatal: as rotinas buscam individualmente
+            logging.warning(f"Falha na carga em lote de contatos: {e}")
 
-    def _create_excel(self, colunas, conteudo, nome_rotina) -> Path:
+    def _check_contacts(self):
+        """
+        Descarta do cache os contatos das rotinas cujos destinatários ou hiperlinks mudaram.
+
+        SQL_CONTACTS_SIGNATURE retorna (id_rotina, assinatura), sendo a assinatura qualquer
+        valor que mude junto com os e-mails e links da rotina (ex.: contagem e hash).
+        Rotinas que saem do resultado também são invalidadas.
+        """
         try:
-            wb = Workbook()
-            ws = wb.active
-            ws.append(colunas)
-            for row in conteudo:
-                ws.append(row)
+            atuais = {row[0]: row[1] for row in self.consultar(getenv("SQL_CONTACTS_SIGNATURE"))['data']}
+        except Exception as e:
+            logging.error(f"Erro ao verificar alterações nos contatos: {e}")
+            return
+        anteriores, self._assinaturas_contatos = self._assinaturas_contatos, atuais
+        if anteriores is None:
+            # Sem referência anterior: o que já está em cache pode ser de antes da primeira leitura
+            self.invalidate_contacts()
+            return
+        alterados = [i for i in anteriores.keys() | atuais.keys() if anteriores.get(i) != atuais.get(i)]
+        for id_routine in alterados:
+            self.invalidate_contacts(id_routine)
+        if alterados:
+            logging.info(f"Contatos alterados em {len(alterados)} rotina(s); cache descartado para elas.")
 
+    def invalidate_contacts(self, id_routine: Optional[int] = None):
+        """Descarta do cache os contatos de uma rotina (ou de todas)."""
+        if id_routine is None:
+            self._cache_destinatarios.invalidar()
+            self._cache_hiperlinks.invalidar()
+        else:
+            self._cache_destinatarios.invalidar(id_routine)
+            self._cache_hiperlinks.invalidar(id_routine)
+
+    def _generate_report(self, routine: RoutineData) -> Tuple[str, List[Path]]:
+        """Executa a SQL da rotina e grava o relatório; retorna (nome base, arquivos)."""
+        if REPORT_COLUMNAR:
+            # Lotes em colunas: datas detectadas e formatadas uma vez por coluna
+            stream = self.consultar_colunas(routine.sql, timeout=routine.timeout)
+            try:
+                colunas = next(stream)
+                return clean_name(routine.nome), self._create_report(colunas, stream, routine, em_colunas=True)
+            finally:
+                stream.close()
+
+        # Executa a query principal uma única vez: metadados primeiro, depois lotes
+        stream = self.consultar_stream(routine.sql, timeout=routine.timeout)
+        try:
+            colunas = [c[0] for c in next(stream)]
+            return clean_name(routine.nome), self._create_report(colunas, stream, routine)
+        finally:
+            stream.close()
+
+    def _last_watermark(self, routine: RoutineData) -> Any:
+        anterior, gravada = self._marcas.get(routine.id, (None, None))
+        return gravada if gravada is not None and routine.marca == anterior else routine.marca
+
+    def _generate_incremental(self, routine: RoutineData) -> Tuple[str, List[Path], Callable[[], None]]:
+        """
+        Relatório com as linhas de COLUNA_INCREMENTAL acima da última marca gravada.
+
+        - 'delta': arquivo só com as linhas novas (nenhum arquivo se não houver);
+        - 'acumulado': linhas novas somadas às já extraídas, guardadas em planilhas/incremental.
+
+        Sem marca (primeira execução ou MARCA_INCREMENTAL apagada) a SQL roda completa.
+        Retorna também a função que grava a nova marca, chamada só depois que o envio
+        de todos os e-mails foi concluído com sucesso.
+        """
+        if routine.modo_incremental not in MODOS_INCREMENTAIS:
+            raise ValueError(f"Modo incremental desconhecido: {routine.modo_incremental} "
+                             f"(aceitos: {', '.join(MODOS_INCREMENTAIS)})")
+        marca = self._last_watermark(routine)
+        cache = None
+        if routine.modo_incremental == "acumulado":
+            cache = CacheIncremental(self.base_path / "planilhas" / "incremental", routine.id)
+            if marca is not None and cache.marca() != marca:
+                logging.info(f"Cache incremental da rotina {routine.id} ausente ou desatualizado: carga completa.")
+                marca = None
+
+        def _abrir(com_marca: bool):
+            if com_marca:
+                sql = sql_incremental(routine.sql, routine.coluna_incremental)
+                stream = self.consultar_stream(sql, [texto_para_marca(marca)], timeout=routine.timeout)
+            else:
+                stream = self.consultar_stream(routine.sql, timeout=routine.timeout)
+            return stream, [c[0] for c in next(stream)]
+
+        stream, colunas = _abrir(marca is not None)
+        try:
+            if cache is not None and marca is not None and not cache.compativel(colunas):
+                logging.info(f"Colunas da rotina {routine.id} mudaram: carga completa do cache incremental.")
+                stream.close()
+                marca = None
+                stream, colunas = _abrir(False)
+
+            nova = Marca(texto_para_marca(marca), posicao_coluna(colunas, routine.coluna_incremental))
+            lotes = nova.acompanhar(stream)
+            if cache is None:
+                primeiro = next(lotes, None)
+                arquivos = [] if primeiro is None else self._create_report(colunas, chain([primeiro], lotes), routine)
+            else:
+                anteriores = cache.lotes() if marca is not None else []
+                lotes = chain(anteriores, cache.gravando(lotes, reiniciar=marca is None))
+                arquivos = self._create_report(colunas, lotes, routine)
+        finally:
+            stream.close()
+
+        metricas.incrementar("relatorio_incremental_linhas_total", nova.linhas, modo=routine.modo_incremental)
+        logging.info(f"Rotina {routine.id}: {nova.linhas} linha(s) nova(s) desde a marca {marca}.")
+
+        def _confirmar():
+            texto = nova.texto()
+            if texto != marca:
+                self.executar(getenv("SQL_UPDATE_WATERMARK"), [texto, routine.id], chave=routine.id)
+                self._marcas[routine.id] = (routine.marca, texto)
+            if cache is not None:
+                cache.confirmar(texto, colunas)
+
+        return clean_name(routine.nome), arquivos, _confirmar
+
+    def _create_report(self, colunas, lotes: Iterable[Any], routine: RoutineData, em_colunas: bool = False) -> List[Path]:
+        """Grava os lotes (linhas, ou colunas com 'em_colunas') no formato da rotina sem materializar o resultado."""
+        try:
             folder = self.base_path / "planilhas"
             folder.mkdir(exist_ok=True)
 
-            # Sanitização de nome de arquivo
-            clean_name = normalize('NFD', nome_rotina.lower().replace(' ', '_'))
-            clean_name = "".join(c for c in clean_name if category(c) != 'Mn')
+            # Com REPORT_RENDER_PROCESSES, a escrita roda em outro processo e a thread só repassa os lotes
+            render = render_pool()
+            fabrica = render.criar_writer if render else criar_writer
+            with fabrica(routine.formato, folder, clean_name(routine.nome), colunas) as writer:
+                escrever = writer.escrever_colunas if em_colunas else writer.escrever_lote
+                for lote in iterar_fase(lotes, "consulta"):
+                    with fase("render"):
+                        escrever(lote)
+                with fase("render"):
+                    arquivos = writer.fechar()
 
-            file_path = folder / f"{clean_name}.xlsx"
-            wb.save(file_path)
-            return file_path
+            metricas.incrementar("relatorio_linhas_total", writer.total_linhas, formato=routine.formato)
+            for arquivo in arquivos:
+                metricas.observar("anexo_bytes", arquivo.stat().st_size, buckets=BUCKETS_BYTES, formato=routine.formato)
+            return arquivos
         except Exception as e:
             raise e
 
@@ -194,99 +816,249 @@ class RoutineService(DB):
         """Calcula e atualiza a próxima execução."""
         try:
             if routine.periodo == 'U' or (routine.dta_final and routine.dta_final <= agora):
-                self.executar(getenv("SQL_UPDATE_DISABLE_ROUTINE"), [routine.id])
+                self.executar(getenv("SQL_UPDATE_DISABLE_ROUTINE"), [routine.id], chave=routine.id)
+                self._agendar_proxima(routine, None)
                 return
 
-            # Mapeamento de SQLs de update por período
-            sql_map = {
-                'Mi': getenv("SQL_UPDATE_SCHEDULE_MINUTE"),
-                'H': getenv("SQL_UPDATE_SCHEDULE_HOUR"),
-                'D': getenv("SQL_UPDATE_SCHEDULE_DAY"),
-                'M': getenv("SQL_UPDATE_SCHEDULE_MONTH")
-            }
-
-            sql_update = sql_map.get(routine.periodo)
+            sql_update = schedule_sql(routine.periodo)
             if sql_update:
-                self.executar(sql_update, [dta_agendada, routine.intervalo, routine.id])
+                self.executar(sql_update, [dta_agendada, routine.intervalo, routine.id], chave=routine.id)
+                self._agendar_proxima(routine, self._proxima_gravada(routine, dta_agendada))
                 logging.info(f"Rotina {routine.nome} (ID: {routine.id}) reagendada.")
+            else:
+                self._agendar_proxima(routine, None)
         except Exception as e:
             raise Exception(f"Erro ao reagendar a rotina: {e}")
 
+    def _proxima_gravada(self, routine: RoutineData, dta_agendada: dt) -> Optional[dt]:
+        """
+        No modo evento, relê a dta_proxima gravada pela SQL de reagendamento
+        (SQL_GET_NEXT_RUN, parâmetro: id), para que a agenda em memória siga o banco.
+        Sem essa SQL ou se a leitura falhar, usa o cálculo equivalente em Python.
+        """
+        calculada = proxima_execucao(routine.periodo, routine.intervalo, dta_agendada)
+        sql = getenv("SQL_GET_NEXT_RUN")
+        if self.schedule_mode != 'evento' or not sql:
+            return calculada
+        try:
+            if not self.aguardar_escritas(routine.id):
+                logging.warning(f"Reagendamento da rotina {routine.id} não confirmado; usando a data calculada.")
+                return calculada
+            result = self.consultar(sql, [routine.id])
+            if result['data'] and result['data'][0][0] is not None:
+                return result['data'][0][0]
+        except Exception as e:
+            logging.warning(f"Falha ao ler a próxima execução da rotina {routine.id}: {e}")
+        return calculada
+
+    @staticmethod
+    def _enviar(emails: Iterable[Email]):
+        """
+        Entrega os e-mails ao dispatcher e espera o envio. Uma falha sobe para
+        process_routine, que desfaz o status e agenda nova tentativa.
+        """
+        futuros = [email.enfileirar() for email in emails]
+        with fase("envio"):
+            for futuro in futuros:
+                futuro.result()
+
     def _handle_info(self, routine: RoutineData):
         try:
-            clean_name = normalize('NFD', routine.nome.lower().replace(' ', '_'))
-            clean_name = "".join(c for c in clean_name if category(c) != 'Mn')
-            # Lógica de informativo (mantida a estrutura de diretórios do original)
-            base_info = self.base_path / "informativo"
-            base_info.mkdir(exist_ok=True)
-
-            anexos_dir = base_info / "anexos"
-            anexos_dir.mkdir(exist_ok=True)
-            anexos_dir = base_info / "anexos" / clean_name
-
-            corpos_dir = base_info / "corpos"
-            corpos_dir.mkdir(exist_ok=True)
-            corpos_dir = base_info / "corpos" / clean_name
-
-            anexos = [str(p) for p in anexos_dir.glob("*")] if anexos_dir.exists() else []
-            corpos = [str(p) for p in corpos_dir.glob("*")] if corpos_dir.exists() else []
-            destinatarios = self._get_recipient(routine.id)
-            hiperlinks = self._get_hiperlink(routine.id)
-
-            posicoes = {nome: i for i, nome in enumerate(hiperlinks.keys())}
-            corpos_organizados = sorted(
-                corpos,
-                key=lambda x: posicoes.get(Path(x).name, len(posicoes))
-            )
-            Email(
-                user=getenv("EMAIL_INFORMATIVO_USER"),
-                password=getenv("EMAIL_INFORMATIVO_PASS"),
-                cco=destinatarios,
-                titulo=f"Informativo - {routine.nome}",
-                anexos=anexos,
-                corpo_arq=corpos_organizados,
-                hyperlink=hiperlinks
-            ).enviar()
+            with fase("contatos"):
+                destinatarios = self._get_recipient(routine.id)
+                hiperlinks = self._get_hiperlink(routine.id)
+            with fase("email"):
+                email = build_info_email(self.base_path, routine, destinatarios, hiperlinks)
+            self._enviar([email])
         except Exception as e:
             raise e
 
+    def _build_report(self, routine: RoutineData) -> Tuple[List[Path], Optional[Callable[[], None]]]:
+        """
+        Gera os arquivos do relatório (incremental, compartilhado ou próprio).
+        Retorna os arquivos e, nos incrementais, a função que confirma a marca após o envio.
+        """
+        inicio = perf_counter()
+        confirmar = None
+        if routine.coluna_incremental and getenv("SQL_UPDATE_WATERMARK"):
+            # Incrementais dependem da marca da própria rotina: não compartilham o relatório
+            origem, arquivos, confirmar = self._generate_incremental(routine)
+            compartilhado = False
+        else:
+            if routine.coluna_incremental:
+                logging.warning(f"Rotina {routine.id} tem COLUNA_INCREMENTAL, mas SQL_UPDATE_WATERMARK "
+                                f"não está definida: executando a SQL completa.")
+            chave = (normalize_sql(routine.sql), routine.formato)
+            # Resultado já concluído só serve a outras rotinas do mesmo horário agendado
+            (origem, arquivos), compartilhado = self._relatorios.executar(
+                chave, self._generate_report, routine,
+                rodada=routine.dta_proxima or routine.dta_inicial, origem=routine.id
+            )
+        if compartilhado:
+            arquivos = share_report_files(arquivos, origem, clean_name(routine.nome))
+            metricas.incrementar("relatorio_compartilhado_total", formato=routine.formato)
+            logging.info(f"Rotina {routine.id} reaproveitou o relatório gerado para '{origem}'.")
+        else:
+            # Base da antecedência da pré-geração; relatórios reaproveitados não refletem o custo real
+            self._duracoes.registrar(routine.id, perf_counter() - inicio)
+        return arquivos, confirmar
+
     def _handle_report(self, routine: RoutineData):
-        """Lógica de geração e envio de relatório Excel."""
+        """Lógica de geração e envio de relatório (Excel ou CSV, conforme a rotina)."""
         try:
-            # Executa a query principal
-            dados = self.consultar(routine.sql)['data']
-            # logging.info(f"Dados do db: {dados}")
-
-            # Processamento de datas para exibição no Excel
-            dados_formatados = []
-            for linha in dados:
-                nova_linha = []
-                for val in linha:
-                    if isinstance(val, dt) and val.strftime("%H:%M:%S") != "00:00:00":
-                        nova_linha.append(val.strftime("%d/%m/%Y %H:%M:%S"))
-                    elif isinstance(val, dt):
-                        nova_linha.append(val.strftime("%d/%m/%Y"))
-                    else:
-                        nova_linha.append(val)
-
-                dados_formatados.append(nova_linha)
-
-            # Para as colunas, o ideal é que sua classe DB retorne o cursor.description
-            # Aqui mantive a lógica de busca por tabela, mas simplificada
-            colunas = self._get_column_names(routine.sql)
-            path_excel = self._create_excel(colunas, dados_formatados, routine.nome)
-            destinatarios = self._get_recipient(routine.id)
-            Email(
-                para=destinatarios,
-                titulo=f"Relatório - {routine.nome}",
-                corpo_texto="Segue em anexo o relatório solicitado.",
-                anexos=[str(path_excel)]
-            ).enviar()
+            preparado = self._take_prepared(routine)
+            arquivos, confirmar = preparado if preparado is not None else self._build_report(routine)
+            if not arquivos:
+                logging.info(f"Rotina {routine.nome} sem linhas novas: nada a enviar.")
+                if confirmar:
+                    confirmar()
+                return
+
+            with fase("contatos"):
+                destinatarios = self._get_recipient(routine.id)
+            with fase("email"):
+                emails = build_report_emails(routine, destinatarios, arquivos)
+            self._enviar(emails)
+            # _enviar só retorna com todas as partes entregues: se alguma falhar, a marca
+            # (e o estado do cache acumulado) fica como estava e as linhas voltam na próxima tentativa
+            if confirmar:
+                confirmar()
         except Exception as e:
             raise e
 
+    def check_prepare(self):
+        """
+        Inicia a pré-geração dos relatórios com ANTECEDENCIA cuja hora de início estimada
+        (ver _preparo.inicio_preparo) já chegou. SQL_ROUTINES_TO_PREPARE deve retornar as
+        rotinas RE ativas com ANTECEDENCIA e dta_proxima dentro dessa antecedência.
+
+        Com várias instâncias, a rotina é reivindicada antes (SQL_CLAIM_PREPARE: como
+        SQL_CLAIM_ROUTINE, mas sem exigir que já esteja devida) e a instância que a
+        pré-gerou mantém o lease e a executa no horário.
+        """
+        if not self.pronto.is_set():
+            return
+        sql_claim = getenv("SQL_CLAIM_PREPARE")
+        if self.claim_sql and not sql_claim:
+            logging.warning("Modo multi-instância sem SQL_CLAIM_PREPARE: pré-geração desativada.")
+            return
+        try:
+            result = self.consultar(getenv("SQL_ROUTINES_TO_PREPARE"))
+            colunas = column_index(result['description'])
+            agora = dt.now()
+            with self._preparos_lock:
+                # Pré-gerações nunca usadas (rotina desativada ou reagendada)
+                for id_routine, (quando, futuro) in list(self._preparos.items()):
+                    if futuro.done() and quando < agora - timedelta(hours=1):
+                        del self._preparos[id_routine]
+            for row in result['data']:
+                routine = RoutineData.from_row(row, colunas)
+                dta_agendada = routine.dta_proxima
+                if routine.tipo != 'RE' or not routine.antecedencia or dta_agendada is None or dta_agendada <= agora:
+                    continue
+                if agora < inicio_preparo(dta_agendada, routine.antecedencia, self._duracoes.estimativa(routine.id)):
+                    continue
+
+                with self._preparos_lock:
+                    atual = self._preparos.get(routine.id)
+                    if atual is not None and atual[0] == dta_agendada:
+                        continue
+                if self.claim_sql:
+                    if not self.reivindicar(sql_claim, self.node_id, self.claim_lease, routine.id):
+                        continue
+                    with self._claimed_lock:
+                        self._claimed.add(routine.id)
+
+                futuro: Future = Future()
+                with self._preparos_lock:
+                    self._preparos[routine.id] = (dta_agendada, futuro)
+                # Chave própria: a execução no horário não é barrada pela pré-geração em andamento
+                aceita = self.executor.submeter(
+                    'RE', ('preparo', routine.id), self._prepare_report, routine, futuro,
+                    prioridade=routine.prioridade
+                )
+                if not aceita:
+                    with self._preparos_lock:
+                        if self._preparos.get(routine.id, (None, None))[1] is futuro:
+                            del self._preparos[routine.id]
+                    futuro.cancel()
+                    if self.claim_sql:
+                        self._release_claim(routine.id)
+                elif self.claim_sql:
+                    # Com o lease desta instância, as demais não a executam: o horário fica por conta dela
+                    futuro.add_done_callback(lambda f, r=routine: f.cancelled() or self._iniciar_preparada(r))
+        except Exception as e:
+            logging.error(f"Erro ao buscar relatórios para pré-geração: {e}")
+
+    def _prepare_report(self, routine: RoutineData, futuro: Future):
+        if not futuro.set_running_or_notify_cancel():
+            return
+        with contexto_rotina(routine.id):
+            logging.info(f"Pré-gerando o relatório '{routine.nome}' para {routine.dta_proxima:%d/%m/%Y %H:%M}.")
+            try:
+                with metricas.cronometrar("relatorio_pregeracao_segundos"):
+                    resultado = self._build_report(routine)
+                metricas.incrementar("relatorio_pregerado_total", resultado="sucesso")
+                futuro.set_result(resultado)
+            except Exception as e:
+                logging.warning(f"Pré-geração do relatório {routine.id} falhou; será gerado no horário: {e}")
+                metricas.incrementar("relatorio_pregerado_total", resultado="falha")
+                futuro.set_exception(e)
+
+    def _iniciar_preparada(self, routine: RoutineData):
+        """Modo multi-instância: submete a execução da rotina pré-gerada quando ela vence."""
+        espera = (routine.dta_proxima - dt.now()).total_seconds()
+        if espera > 0:
+            timer = Timer(espera, self._iniciar_preparada, [routine])
+            timer.daemon = True
+            timer.start()
+            return
+        if not self.executor.submeter(
+            routine.tipo, routine.id, self._process_claimed, routine, prioridade=routine.prioridade
+        ):
+            # Sem lugar na fila: devolve a rotina para que qualquer instância a execute
+            self._release_claim(routine.id)
+
+    def _take_prepared(self, routine: RoutineData) -> Optional[Tuple[List[Path], Optional[Callable[[], None]]]]:
+        """
+        Resultado da pré-geração para este horário da rotina. A execução só é submetida
+        depois que a pré-geração termina (ver _submeter e _iniciar_preparada); sem
+        pré-geração, ou se ela falhou, retorna None e o relatório é gerado normalmente.
+        """
+        dta_agendada = routine.dta_proxima or routine.dta_inicial
+        with self._preparos_lock:
+            item = self._preparos.get(routine.id)
+            if item is None or item[0] != dta_agendada:
+                return None
+            del self._preparos[routine.id]
+        futuro = item[1]
+        if futuro.cancel():
+            return None
+        try:
+            with fase("preparo"):
+                resultado = futuro.result()
+        except Exception:
+            return None
+        logging.info(f"Rotina {routine.id} enviada com o relatório pré-gerado.")
+        return resultado
+
+    def _get_triggers(self) -> TriggerRunner:
+        with self._triggers_lock:
+            if self._triggers is None:
+                pool = self._pool_injetado or criar_pool(
+                    0, int(getenv("TRIGGER_POOL_MAX", str(LANES_PADRAO['TRG']))), "triggers"
+                )
+                self._triggers = TriggerRunner(pool, self.base_path)
+            return self._triggers
+
+    def cancel_trigger(self, id_routine: int) -> bool:
+        """Interrompe o trigger da rotina se estiver em execução."""
+        return self._triggers is not None and self._triggers.cancelar(id_routine)
+
     def _hendle_trigger(self, routine: RoutineData):
         logging.info(f"---[ ROTINA TRIGGER '{routine.nome}': ID {routine.id} ]---")
+        with fase("trigger"):
+            self._get_triggers().executar(routine.id, routine.sql, routine.timeout)
 
 
 
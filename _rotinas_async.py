@@ -0,0 +1,383 @@
+"""Engine asyncio do serviço de rotinas (alternativa ao RoutineService baseado em threads)."""
+
+import asyncio
+import logging
+from datetime import datetime as dt
+from os import getenv, getpid
+from pathlib import Path
+from socket import gethostname
+from time import monotonic, perf_counter
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from _cache import TTLCache
+from _database import (
+    criar_pool, DB_ACQUIRE_TIMEOUT, DB_CALL_TIMEOUT, DB_USER, DB_PASS, DB_DSN, DB_ARRAYSIZE, DB_PREFETCHROWS
+)
+from _executor import EXECUTOR_DRAIN_TIMEOUT
+from _metricas import fase, metricas
+from _planilhas import criar_writer
+from _triggers import TriggerRunner
+from _render import render_pool
+from _emails import verificar_smtp
+from _rotinas import RoutineData, build_info_email, build_report_emails, clean_name, column_index, schedule_sql
+from _utils import contexto_rotina, notify_error, lock_file
+
+try:
+    import oracledb
+except ImportError:
+    logging.error("Biblioteca 'oracledb' não instalada. Execute: pip install oracledb")
+
+# Rotinas simultâneas por tipo; a espera é em I/O, então os limites podem ser altos
+ASYNC_LANES = {
+    'RE': int(getenv("ASYNC_MAX_RE", "50")),
+    'IN': int(getenv("ASYNC_MAX_IN", "100")),
+    'TRG': int(getenv("ASYNC_MAX_TRG", "50")),
+}
+ASYNC_DB_POOL_MAX = int(getenv("ASYNC_DB_POOL_MAX", "20"))
+
+
+class AsyncRoutineService:
+    """
+    Mesmo ciclo do RoutineService (polling por minuto, reivindicação opcional com lease),
+    executado como corrotinas sobre o pool assíncrono do oracledb.
+
+    Trabalho de CPU/disco (planilha, leitura de anexos) roda no executor padrão do
+    asyncio, que tem um número fixo de threads.
+
+    Não implementa a agenda em memória (SCHEDULE_MODE=evento), o compartilhamento de
+    relatórios (REPORT_SHARE_SECONDS) nem a pré-geração (ANTECEDENCIA), que são avisados
+    e ignorados; rotinas com COLUNA_INCREMENTAL são recusadas, para não reenviar linhas.
+    """
+
+    def __init__(self, pool: Any = None):
+        self.pool = pool
+        self.base_path = Path.cwd()
+        self.lock_file_path = self.base_path / "service.lock"
+        self.lock_handle = None
+        self._limites = {tipo: asyncio.Semaphore(n) for tipo, n in ASYNC_LANES.items()}
+        self._em_andamento: Dict[int, asyncio.Task] = {}
+
+        self.claim_sql = getenv("SQL_CLAIM_ROUTINE")
+        self.claim_lease = int(getenv("CLAIM_LEASE_SECONDS", "900"))
+        self.node_id = f"{gethostname()}:{getpid()}"
+        self._criado_em = perf_counter()
+        self._triggers: Optional[TriggerRunner] = None
+        self._triggers_lock = asyncio.Lock()
+        # Mesmo cache de contatos do engine com threads (sem a invalidação por assinatura)
+        ttl_contatos = float(getenv("CONTACTS_CACHE_TTL_SECONDS", "300"))
+        self._cache_destinatarios = TTLCache(ttl_contatos)
+        self._cache_hiperlinks = TTLCache(ttl_contatos)
+        # Rotinas com ANTECEDENCIA já avisadas, para não repetir o aviso a cada minuto
+        self._avisadas: set = set()
+
+    # ----------------------------------------------------------------- banco
+
+    async def _open_pool(self):
+        if self.pool is None:
+            self.pool = oracledb.create_pool_async(
+                user=DB_USER,
+                password=DB_PASS,
+                dsn=DB_DSN,
+                min=2,
+                max=ASYNC_DB_POOL_MAX,
+                increment=1,
+                getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+                wait_timeout=int(DB_ACQUIRE_TIMEOUT * 1000)
+            )
+            logging.info("Pool assíncrono de conexões Oracle estabelecido com sucesso.")
+
+    async def _prepare(self):
+        """Aquece o pool assíncrono (DB_POOL_WARM, até ASYNC_DB_POOL_MAX) e verifica o SMTP."""
+        esperado = min(int(getenv("DB_POOL_WARM", str(ASYNC_DB_POOL_MAX))), ASYNC_DB_POOL_MAX)
+        inicio = perf_counter()
+        conexoes = []
+        try:
+            for _ in range(esperado):
+                conexoes.append(await self.pool.acquire())
+            await asyncio.gather(*(c.ping() for c in conexoes))
+            logging.info(f"Pool do banco aquecido: {len(conexoes)} conexão(ões) em {perf_counter() - inicio:.2f}s.")
+        except Exception as e:
+            logging.error(f"Falha ao aquecer o pool do banco: {e}")
+        finally:
+            for connection in conexoes:
+                await self.pool.release(connection)
+
+        await asyncio.to_thread(verificar_smtp)
+        total = perf_counter() - self._criado_em
+        metricas.definir("inicializacao_segundos", total)
+        logging.info(f"Serviço pronto em {total:.2f}s.")
+
+    async def consultar(self, query: str, params: Optional[List] = None) -> Dict[str, Any]:
+        try:
+            async with self.pool.acquire() as connection:
+                with connection.cursor() as cursor:
+                    await cursor.execute(query, params or [])
+                    return {
+                        "data": [list(row) for row in await cursor.fetchall()],
+                        "description": cursor.description
+                    }
+        except Exception as e:
+            logging.error(f"Erro ao executar consulta SQL: {e}")
+            raise Exception(f"Erro ao executar consulta SQL: {e}")
+
+    async def consultar_stream(
+        self, query: str, params: Optional[List] = None, timeout: Optional[float] = None
+    ) -> AsyncIterator[Any]:
+        """
+        Como DB.consultar_stream: description primeiro, depois lotes de até DB_ARRAYSIZE
+        linhas; 'timeout' (padrão DB_CALL_TIMEOUT) limita cada ida ao banco.
+        """
+        async with self.pool.acquire() as connection:
+            connection.call_timeout = int((DB_CALL_TIMEOUT if timeout is None else timeout) * 1000)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.arraysize = DB_ARRAYSIZE
+                    cursor.prefetchrows = DB_PREFETCHROWS
+                    await cursor.execute(query, params or [])
+                    yield cursor.description
+                    while True:
+                        lote = await cursor.fetchmany()
+                        if not lote:
+                            break
+                        yield lote
+            finally:
+                connection.call_timeout = 0
+
+    async def executar(self, sql: str, params: Optional[List] = None) -> bool:
+        try:
+            async with self.pool.acquire() as connection:
+                with connection.cursor() as cursor:
+                    await cursor.execute(sql, params or [])
+                await connection.commit()
+                return True
+        except Exception as e:
+            logging.error(f"Erro ao executar comando SQL (Commit cancelado): {e}")
+            return False
+
+    async def reivindicar_rotinas(self) -> Dict[str, Any]:
+        """Mesma semântica de DB.reivindicar_rotinas, em uma única transação."""
+        async with self.pool.acquire() as connection:
+            with connection.cursor() as cursor:
+                await cursor.execute(getenv("SQL_ROUTINES_TO_EXECUTE"))
+                description = cursor.description
+                reivindicadas = []
+                for row in await cursor.fetchall():
+                    await cursor.execute(self.claim_sql, [self.node_id, self.claim_lease, row[0]])
+                    if cursor.rowcount == 1:
+                        reivindicadas.append(list(row))
+            await connection.commit()
+        return {"data": reivindicadas, "description": description}
+
+    # ---------------------------------------------------------------- serviço
+
+    def _acquire_lock(self) -> bool:
+        try:
+            self.lock_handle = open(self.lock_file_path, "w")
+            lock_file(self.lock_handle)
+            self.lock_handle.write(str(getpid()))
+            self.lock_handle.flush()
+            logging.info(f"Lock adquirido (PID: {getpid()})")
+            return True
+        except OSError:
+            logging.error("Outra instância em execução. Encerrando.")
+            return False
+
+    async def run(self):
+        if self.claim_sql:
+            logging.info(f"Modo multi-instância ativo (nó {self.node_id}, lease {self.claim_lease}s).")
+        elif not self._acquire_lock():
+            return
+
+        self._avisar_nao_suportados()
+        await self._open_pool()
+        metricas.registrar_gauge("db_pool_conexoes", "estado", lambda: {
+            "ocupadas": self.pool.busy, "abertas": self.pool.opened, "max": self.pool.max
+        })
+        metricas.registrar_gauge("em_andamento", "engine", lambda: {"async": len(self._em_andamento)})
+        metricas.iniciar_exportacao()
+        await self._prepare()
+        logging.info("Serviço de Rotinas (asyncio) Iniciado...")
+        try:
+            # Reinício depois do segundo 0: verifica já, sem esperar o próximo minuto
+            if dt.now().second < 55:
+                await self.check_routines()
+            while True:
+                # Mesmo ritmo do cron second='0' do engine com threads
+                agora = dt.now()
+                await asyncio.sleep(60 - agora.second - agora.microsecond / 1_000_000)
+                await self.check_routines()
+        except asyncio.CancelledError:
+            logging.info("Serviço finalizado pelo usuário.")
+        finally:
+            await self._drain()
+            await self.pool.close()
+            if self.lock_handle:
+                self.lock_handle.close()
+                logging.info("--- [ Trava de arquivo liberada ] ---\n")
+
+    @staticmethod
+    def _avisar_nao_suportados():
+        if getenv("SCHEDULE_MODE", "polling").lower() == "evento":
+            logging.warning("SCHEDULE_MODE=evento não é suportado pelo engine asyncio: usando polling por minuto.")
+        if float(getenv("REPORT_SHARE_SECONDS", "0")) > 0:
+            logging.warning("REPORT_SHARE_SECONDS é ignorado pelo engine asyncio: cada rotina executa a própria SQL.")
+
+    async def _drain(self):
+        """Aguarda as rotinas em andamento terminarem (até EXECUTOR_DRAIN_TIMEOUT)."""
+        tarefas = list(self._em_andamento.values())
+        if not tarefas:
+            return
+        logging.info(f"Aguardando {len(tarefas)} rotina(s) em andamento...")
+        _, pendentes = await asyncio.wait(tarefas, timeout=EXECUTOR_DRAIN_TIMEOUT)
+        for tarefa in pendentes:
+            tarefa.cancel()
+        if pendentes:
+            logging.error(f"{len(pendentes)} rotina(s) canceladas no encerramento.")
+
+    async def check_routines(self):
+        logging.info("Verificando rotinas pendentes...")
+        try:
+            if self.claim_sql:
+                result = await self.reivindicar_rotinas()
+            else:
+                result = await self.consultar(getenv("SQL_ROUTINES_TO_EXECUTE"))
+            colunas = column_index(result['description'])
+
+            for row in result['data']:
+                routine = RoutineData.from_row(row, colunas)
+                if routine.id in self._em_andamento:
+                    continue
+                if routine.antecedencia and routine.id not in self._avisadas:
+                    self._avisadas.add(routine.id)
+                    logging.warning(f"Rotina {routine.id}: ANTECEDENCIA é ignorada pelo engine asyncio (sem pré-geração).")
+                tarefa = asyncio.create_task(self._run_limited(routine), name=f"rotina-{routine.id}")
+                self._em_andamento[routine.id] = tarefa
+                tarefa.add_done_callback(lambda _, i=routine.id: self._em_andamento.pop(i, None))
+
+            if self._em_andamento:
+                logging.info(f"Rotinas em andamento: {len(self._em_andamento)}")
+        except Exception as e:
+            logging.error(f"Erro ao buscar rotinas: {e}")
+            notify_error(e, "Busca por Rotinas")
+
+    async def _run_limited(self, routine: RoutineData):
+        limite = self._limites.get(routine.tipo)
+        if limite is None:
+            logging.error(f"Tipo de rotina sem limite configurado: {routine.tipo}")
+            return
+        enfileirado = monotonic()
+        try:
+            async with limite:
+                espera = monotonic() - enfileirado
+                if espera > 1:
+                    logging.info(f"Rotina {routine.id} aguardou {espera:.1f}s pela fila {routine.tipo}.")
+                await self.process_routine(routine)
+        finally:
+            if self.claim_sql:
+                await self.executar(getenv("SQL_RELEASE_CLAIM"), [self.node_id, routine.id])
+
+    async def process_routine(self, routine: RoutineData):
+        agora = dt.now()
+        dta_agendada = routine.dta_proxima or routine.dta_inicial
+
+        if dta_agendada and dta_agendada <= agora:
+            metricas.observar("rotina_atraso_segundos", (agora - dta_agendada).total_seconds(), tipo=routine.tipo)
+
+            with contexto_rotina(routine.id), metricas.execucao(tipo=routine.tipo) as cron:
+                try:
+                    logging.info(f"Iniciando: {routine.nome} (ID: {routine.id})")
+                    await self.executar(getenv("SQL_UPDATE_SET_TO_E_N"), [routine.id])
+
+                    if routine.tipo == 'RE':
+                        await self._handle_report(routine)
+                    elif routine.tipo == 'IN':
+                        await self._handle_info(routine)
+                    elif routine.tipo == 'TRG':
+                        await self._hendle_trigger(routine)
+
+                    await self.executar(getenv("SQL_UPDATE_SET_TO_F_S"), [routine.id])
+                    await self._reschedule(routine, dta_agendada, agora)
+
+                    logging.info(f"Sucesso:  {routine.nome} (ID: {routine.id})")
+
+                except Exception as e:
+                    cron.resultado = "falha"
+                    logging.error(f"Falha na rotina {routine.id} '{routine.nome}': {e}")
+                    await self.executar(getenv("SQL_UPDATE_SET_STATUS_TO_NULL"), [routine.id])
+                    notify_error(e, routine.nome)
+
+    async def _reschedule(self, routine: RoutineData, dta_agendada: dt, agora: dt):
+        try:
+            if routine.periodo == 'U' or (routine.dta_final and routine.dta_final <= agora):
+                await self.executar(getenv("SQL_UPDATE_DISABLE_ROUTINE"), [routine.id])
+                return
+
+            sql_update = schedule_sql(routine.periodo)
+            if sql_update:
+                await self.executar(sql_update, [dta_agendada, routine.intervalo, routine.id])
+                logging.info(f"Rotina {routine.nome} (ID: {routine.id}) reagendada.")
+        except Exception as e:
+            raise Exception(f"Erro ao reagendar a rotina: {e}")
+
+    async def _get_recipient(self, id_routine: int) -> List[str]:
+        destinatarios = self._cache_destinatarios.get(id_routine)
+        if destinatarios is None:
+            destinatarios = [r[0] for r in (await self.consultar(getenv("SQL_GET_RECIPIENTS"), [id_routine]))['data']]
+            self._cache_destinatarios.set(id_routine, destinatarios)
+        return list(destinatarios)
+
+    async def _get_hiperlink(self, id_routine: int) -> Dict[str, Any]:
+        hiperlinks = self._cache_hiperlinks.get(id_routine)
+        if hiperlinks is None:
+            hiperlinks = {h[0]: h[1] for h in (await self.consultar(getenv("SQL_GET_HIPERLINK"), [id_routine]))['data']}
+            self._cache_hiperlinks.set(id_routine, hiperlinks)
+        return dict(hiperlinks)
+
+    async def _handle_report(self, routine: RoutineData):
+        if routine.coluna_incremental:
+            # Sem a marca, a SQL completa reenviaria as linhas já entregues
+            raise ValueError(f"Rotina {routine.id} tem COLUNA_INCREMENTAL, que não é suportada pelo "
+                             f"engine asyncio: use SERVICE_ENGINE=threads.")
+        folder = self.base_path / "planilhas"
+        folder.mkdir(exist_ok=True)
+
+        stream = self.consultar_stream(routine.sql, timeout=routine.timeout)
+        try:
+            colunas = [c[0] for c in await anext(stream)]
+            render = render_pool()
+            fabrica = render.criar_writer if render else criar_writer
+            writer = await asyncio.to_thread(fabrica, routine.formato, folder, clean_name(routine.nome), colunas)
+            with writer:
+                async for lote in stream:
+                    with fase("render"):
+                        await asyncio.to_thread(writer.escrever_lote, lote)
+                with fase("render"):
+                    arquivos = await asyncio.to_thread(writer.fechar)
+            metricas.incrementar("relatorio_linhas_total", writer.total_linhas, formato=routine.formato)
+        finally:
+            await stream.aclose()
+
+        destinatarios = await self._get_recipient(routine.id)
+        for email in await asyncio.to_thread(build_report_emails, routine, destinatarios, arquivos):
+            await email.enviar_async()
+
+    async def _handle_info(self, routine: RoutineData):
+        destinatarios = await self._get_recipient(routine.id)
+        hiperlinks = await self._get_hiperlink(routine.id)
+        email = await asyncio.to_thread(build_info_email, self.base_path, routine, destinatarios, hiperlinks)
+        await email.enviar_async()
+
+    async def _hendle_trigger(self, routine: RoutineData):
+        logging.info(f"---[ ROTINA TRIGGER '{routine.nome}': ID {routine.id} ]---")
+        async with self._triggers_lock:
+            if self._triggers is None:
+                # Pool síncrono próprio: TRIGGER_POOL_MAX, por padrão a fila de triggers deste engine
+                maximo = int(getenv("TRIGGER_POOL_MAX", str(ASYNC_LANES['TRG'])))
+                pool = await asyncio.to_thread(criar_pool, 0, maximo, "triggers")
+                self._triggers = TriggerRunner(pool, self.base_path)
+        try:
+            with fase("trigger"):
+                await asyncio.to_thread(self._triggers.executar, routine.id, routine.sql, routine.timeout)
+        except asyncio.CancelledError:
+            self._triggers.cancelar(routine.id)
+            raise
@@ -0,0 +1,175 @@
+"""Execução das rotinas de trigger (TRG): procedures no banco e comandos externos."""
+
+import logging
+import re
+import shlex
+import subprocess
+from os import getenv, name as os_name
+from pathlib import Path
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Tempo máximo de um trigger sem a coluna TIMEOUT (segundos)
+TRIGGER_TIMEOUT_SECONDS = float(getenv("TRIGGER_TIMEOUT_SECONDS", "300"))
+# Caracteres finais da saída de um comando mantidos no log ou na mensagem de erro
+_SAIDA_MAX = 2000
+
+# Nome simples de procedure (ex.: PKG_CARGA.ATUALIZAR), chamado via callproc
+_PROCEDURE = re.compile(r"^[A-Za-z][\w$#]*(\.[A-Za-z][\w$#]*){0,2}$")
+# Comandos de uma palavra e palavras reservadas não são nomes de procedure
+_PALAVRAS_RESERVADAS = frozenset("""
+    BEGIN CALL COMMIT DECLARE END EXEC EXECUTE ROLLBACK SAVEPOINT TRUNCATE MERGE
+    ACCESS ADD ALL ALTER AND ANY AS ASC AUDIT BETWEEN BY CHAR CHECK CLUSTER COLUMN COMMENT
+    COMPRESS CONNECT CREATE CURRENT DATE DECIMAL DEFAULT DELETE DESC DISTINCT DROP ELSE
+    EXCLUSIVE EXISTS FILE FLOAT FOR FROM GRANT GROUP HAVING IDENTIFIED IMMEDIATE IN INCREMENT
+    INDEX INITIAL INSERT INTEGER INTERSECT INTO IS LEVEL LIKE LOCK LONG MAXEXTENTS MINUS
+    MLSLABEL MODE MODIFY NOAUDIT NOCOMPRESS NOT NOWAIT NULL NUMBER OF OFFLINE ON ONLINE
+    OPTION OR ORDER PCTFREE PRIOR PUBLIC RAW RENAME RESOURCE REVOKE ROW ROWID ROWNUM ROWS
+    SELECT SESSION SET SHARE SIZE SMALLINT START SUCCESSFUL SYNONYM SYSDATE TABLE THEN TO
+    TRIGGER UID UNION UNIQUE UPDATE USER VALIDATE VALUES VARCHAR VARCHAR2 VIEW WHENEVER
+    WHERE WITH
+""".split())
+# call_timeout excedido: DPY-4024 (modo thin) / ORA-03156 (modo thick)
+_CODIGOS_TIMEOUT = frozenset({"DPY-4024", "ORA-03156"})
+_PREFIXO_CMD = "CMD:"
+_PREFIXO_EXEC = re.compile(r"^(EXEC|EXECUTE)\s+", re.IGNORECASE)
+
+
+class TriggerCancelado(Exception):
+    """O trigger foi cancelado (encerramento do serviço ou pedido explícito)."""
+
+
+def _procedure(acao: str) -> bool:
+    """Nome de procedure (até esquema.pacote.procedure) sem nenhuma parte que seja palavra reservada."""
+    return bool(_PROCEDURE.match(acao)) and not any(
+        parte.upper() in _PALAVRAS_RESERVADAS for parte in acao.split(".")
+    )
+
+
+def _tempo_esgotado(erro: Exception) -> bool:
+    """True se o erro do driver indica que o call_timeout da conexão foi excedido."""
+    detalhe = erro.args[0] if erro.args else None
+    return getattr(detalhe, "full_code", None) in _CODIGOS_TIMEOUT
+
+
+def _limpar(acao: str) -> str:
+    """Remove o ';' final, exceto em blocos PL/SQL (BEGIN ... END;), que precisam dele."""
+    acao = acao.strip()
+    return acao if acao.upper().endswith("END;") else acao.rstrip(";").strip()
+
+
+class TriggerRunner:
+    """
+    Executa a ação da coluna SQL de uma rotina TRG:
+    - 'CMD: programa args' roda um comando externo (sem shell) na pasta do serviço;
+    - nome de procedure (ex.: PKG.PROC) é chamado via callproc;
+    - 'EXEC proc(args)' vira um bloco anônimo; BEGIN ... END; e CALL são executados como estão.
+
+    Cada execução tem tempo limite (coluna TIMEOUT ou TRIGGER_TIMEOUT_SECONDS): no banco
+    via connection.call_timeout, em comandos via timeout do subprocess. O pool recebido
+    é exclusivo dos triggers, então relatórios longos não atrasam a obtenção de conexão.
+    """
+
+    def __init__(self, pool: Any, base_path: Path, timeout_padrao: float = TRIGGER_TIMEOUT_SECONDS):
+        self.pool = pool
+        self.base_path = base_path
+        self.timeout_padrao = timeout_padrao
+        self._lock = Lock()
+        # id da rotina -> (evento de cancelamento, função que interrompe a execução)
+        self._em_execucao: Dict[Any, Tuple[Event, Callable[[], None]]] = {}
+
+    def _registrar(self, chave: Any, interromper: Callable[[], None]) -> Event:
+        cancelado = Event()
+        with self._lock:
+            self._em_execucao[chave] = (cancelado, interromper)
+        return cancelado
+
+    def _remover(self, chave: Any):
+        with self._lock:
+            self._em_execucao.pop(chave, None)
+
+    def executar(self, chave: Any, acao: str, timeout: Optional[float] = None):
+        """Executa a ação e retorna ao terminar; levanta TimeoutError, TriggerCancelado ou o erro da ação."""
+        acao = (acao or "").strip()
+        if not acao or acao.upper() == "NONE":
+            raise ValueError("Rotina de trigger sem ação na coluna SQL.")
+        timeout = float(timeout or self.timeout_padrao)
+        if acao.upper().startswith(_PREFIXO_CMD):
+            self._comando(chave, acao[len(_PREFIXO_CMD):].strip(), timeout)
+        else:
+            self._banco(chave, acao, timeout)
+
+    def _banco(self, chave: Any, acao: str, timeout: float):
+        acao = _limpar(acao)
+        with self.pool.acquire() as connection:
+            cancelado = self._registrar(chave, connection.cancel)
+            try:
+                connection.call_timeout = int(timeout * 1000)
+                with connection.cursor() as cursor:
+                    if _procedure(acao):
+                        cursor.callproc(acao)
+                    elif _PREFIXO_EXEC.match(acao):
+                        cursor.execute(f"BEGIN {_PREFIXO_EXEC.sub('', acao)}; END;")
+                    else:
+                        cursor.execute(acao)
+                connection.commit()
+            except Exception as e:
+                if cancelado.is_set():
+                    raise TriggerCancelado(f"Trigger {chave} cancelado durante a chamada ao banco.") from e
+                if _tempo_esgotado(e):
+                    raise TimeoutError(f"Trigger {chave} excedeu o tempo limite de {timeout:g}s no banco: {e}") from e
+                raise
+            finally:
+                # A conexão volta ao pool sem o limite deste trigger
+                connection.call_timeout = 0
+                self._remover(chave)
+
+    def _comando(self, chave: Any, comando: str, timeout: float):
+        # No Windows a linha de comando é repassada como está (o CreateProcess faz a separação)
+        args = comando if os_name == "nt" else shlex.split(comando)
+        processo = subprocess.Popen(
+            args, cwd=self.base_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL
+        )
+        cancelado = self._registrar(chave, processo.kill)
+        try:
+            try:
+                saida, _ = processo.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+                processo.communicate()
+                raise TimeoutError(f"Trigger {chave} excedeu o tempo limite de {timeout:g}s: {comando}")
+        finally:
+            self._remover(chave)
+
+        if cancelado.is_set():
+            raise TriggerCancelado(f"Trigger {chave} cancelado: {comando}")
+        texto = saida.decode("utf-8", errors="replace")[-_SAIDA_MAX:].strip()
+        if processo.returncode != 0:
+            raise RuntimeError(f"Comando terminou com código {processo.returncode}: {comando}\n{texto}")
+        if texto:
+            logging.info(f"Saída do trigger {chave}: {texto}")
+
+    def cancelar(self, chave: Any) -> bool:
+        """Interrompe o trigger em execução; False se ele não estiver rodando."""
+        with self._lock:
+            item = self._em_execucao.get(chave)
+        if item is None:
+            return False
+        cancelado, interromper = item
+        cancelado.set()
+        try:
+            interromper()
+        except Exception as e:
+            logging.warning(f"Falha ao interromper o trigger {chave}: {e}")
+        logging.warning(f"Trigger {chave} cancelado.")
+        return True
+
+    def cancelar_todos(self) -> int:
+        with self._lock:
+            chaves = list(self._em_execucao)
+        return sum(self.cancelar(chave) for chave in chaves)
+
+    def em_execucao(self) -> int:
+        with self._lock:
+            return len(self._em_execucao)
@@ -1,61 +1,144 @@
 """Módulo de utilitários e ferramentas de suporte ao sistema."""
 
+import json
 import logging
-import traceback
-from datetime import datetime as dt
+from copy import copy
+from atexit import register
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from os import getenv
 from pathlib import Path
-from _emails import Email
+from queue import SimpleQueue
+from typing import Iterator, Optional
+
+# Trava de arquivo conforme a plataforma
+try:
+    from msvcrt import locking, LK_NBLCK
+
+    def lock_file(handle):
+        """Trava exclusiva e não bloqueante do arquivo (levanta OSError se já travado)."""
+        locking(handle.fileno(), LK_NBLCK, 1)
+except ImportError:
+    from fcntl import flock, LOCK_EX, LOCK_NB
+
+    def lock_file(handle):
+        """Trava exclusiva e não bloqueante do arquivo (levanta OSError se já travado)."""
+        flock(handle.fileno(), LOCK_EX | LOCK_NB)
 
 base_path = Path.cwd()
 
+# Id da rotina em execução no contexto atual (thread ou task), anexado aos registros de log
+_rotina_atual: ContextVar[Optional[int]] = ContextVar("rotina_atual", default=None)
+
+
+@contextmanager
+def contexto_rotina(id_rotina: int) -> Iterator[None]:
+    """Marca os logs emitidos dentro do bloco com o id da rotina."""
+    token = _rotina_atual.set(id_rotina)
+    try:
+        yield
+    finally:
+        _rotina_atual.reset(token)
+
+
+class _FiltroRotina(logging.Filter):
+    """Copia o id da rotina do contexto para o registro (roda na thread que gerou o log)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "rotina", None) is None:
+            record.rotina = _rotina_atual.get()
+        return True
+
+
+class _FilaHandler(QueueHandler):
+    """
+    Envia à fila uma cópia do registro com a mensagem já formatada (args podem não ser
+    serializáveis/estáveis) e o traceback como texto, preservando os campos extras.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro, com id da rotina e duração das fases quando houver."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        dados = {
+            "ts": self.formatTime(record, self.datefmt),
+            "nivel": record.levelname,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "rotina", None) is not None:
+            dados["rotina"] = record.rotina
+        fases = getattr(record, "fases", None)
+        if fases:
+            dados["fases"] = {nome: round(seg, 3) for nome, seg in fases.items()}
+        if record.exc_info or record.exc_text:
+            dados["erro"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
 def setup_logging():
-    """Configura o logging para console e arquivo simultaneamente."""
+    """
+    Configura o logging para console e arquivo sem bloquear as threads das rotinas:
+    os registros vão para uma fila e uma thread dedicada grava no console e no arquivo.
+
+    - O arquivo logs/service.log é rotacionado por tempo (LOG_ROTATE_WHEN, padrão
+      'midnight') e mantém LOG_RETENTION arquivos antigos (padrão 30).
+    - LOG_FORMAT=json grava no arquivo uma linha JSON por registro.
+    """
     log_dir = base_path / "logs"
     log_dir.mkdir(exist_ok=True)
 
-    log_file = log_dir / f"service_{dt.now().strftime('%Y-%m')}.log"
+    formato_texto = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8'),
-            logging.StreamHandler()  # Mantém o log no terminal
-        ]
+    arquivo = TimedRotatingFileHandler(
+        log_dir / "service.log",
+        when=getenv("LOG_ROTATE_WHEN", "midnight"),
+        backupCount=int(getenv("LOG_RETENTION", "30")),
+        encoding='utf-8'
     )
+    if getenv("LOG_FORMAT", "texto").lower() == "json":
+        arquivo.setFormatter(JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S'))
+    else:
+        arquivo.setFormatter(formato_texto)
+
+    console = logging.StreamHandler()  # Mantém o log no terminal
+    console.setFormatter(formato_texto)
+
+    fila: SimpleQueue = SimpleQueue()
+    listener = QueueListener(fila, arquivo, console, respect_handler_level=True)
+    listener.start()
+    # Ao sair, a thread de escrita esvazia a fila antes de terminar
+    register(listener.stop)
+
+    entrada = _FilaHandler(fila)
+    entrada.setFormatter(logging.Formatter('%(message)s'))
+    entrada.addFilter(_FiltroRotina())
+    logging.basicConfig(level=logging.INFO, handlers=[entrada])
     logging.info("--- [ Sistema de logs inicializado ] ---")
 
 
 def notify_error(err: str|Exception, routine_name: str) -> None:
     """
-    Envia um alerta por e-mail com os detalhes técnicos da falha.
+    Registra a falha para alerta por e-mail e retorna sem esperar pelo envio.
+    Falhas repetidas são agrupadas em resumos periódicos (ver _alertas.ErrorNotifier).
     """
-    # Se for uma exceção real, pegamos o rastro completo (traceback)
-    detalhes_erro = "".join(traceback.format_exception(None, err, err.__traceback__))\
-        if isinstance(err,Exception) else str(err)
-
-    corpo = (
-        f"⚠️ ALERTA DE FALHA EM ROTINA\n"
-        f"------------------------------------------\n"
-        f"Rotina: {routine_name}\n"
-        f"Data/Hora: {dt.now().strftime('%d/%m/%Y %H:%M:%S')}\n"
-        f"\nDetalhes Técnicos:\n"
-        f"{detalhes_erro}\n"
-        f"------------------------------------------\n"
-        f"Favor verificar o servidor de automações."
-    )
-
     try:
-        Email(
-            para=getenv("EMAIL_RECIPIENTS_ERROR"),
-            titulo=f"🚨 ERRO CRÍTICO: {routine_name}",
-            corpo_texto=corpo
-        ).enviar()
-        logging.warning(f"Notificação de erro enviada para a rotina: {routine_name}")
+        # Importado aqui para que _utils não carregue o módulo de e-mail na inicialização
+        from _alertas import ErrorNotifier
+        ErrorNotifier.instancia().registrar(err, routine_name)
     except Exception as e:
-        logging.critical(f"Falha ao enviar e-mail de notificação de erro: {e}", exc_info=True)
+        logging.critical(f"Falha ao registrar notificação de erro: {e}", exc_info=True)
 
 def create_essential_folders():
     log_dir = base_path / "logs"
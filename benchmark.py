@@ -0,0 +1,294 @@
+"""
+Benchmark / teste de carga do RoutineService sem Oracle nem servidor de e-mail reais.
+
+Sobe um banco sqlite local (_local_db) com rotinas e destinatários sintéticos e um
+SMTP "sink" local, dispara um ciclo de check_routines e mede:
+rotinas/minuto, latência por fase, pico de memória (RSS) e de threads.
+
+Uso:
+    python benchmark.py --rotinas 40 --linhas 20000 --formato xlsx
+    python benchmark.py --saida atual.json --baseline anterior.json --tolerancia 0.2
+    python benchmark.py --formato csv --saida linhas.json
+    python benchmark.py --formato csv --colunar --baseline linhas.json
+    python benchmark.py --formato csv --arrow --baseline linhas.json
+"""
+
+import argparse
+import json
+import logging
+import socketserver
+import sys
+import tempfile
+import threading
+from importlib.util import find_spec
+from os import chdir, environ
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Any, Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Servidor SMTP mínimo: aceita AUTH LOGIN e descarta as mensagens, contando-as."""
+
+    def _responder(self, linha: str):
+        self.wfile.write(f"{linha}\r\n".encode("ascii"))
+
+    def handle(self):
+        self._responder("220 sink ESMTP")
+        etapa_auth = None
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                break
+            comando = linha.strip().decode("utf-8", errors="replace")
+
+            if etapa_auth == "usuario":
+                etapa_auth = "senha"
+                self._responder("334 UGFzc3dvcmQ6")
+                continue
+            if etapa_auth == "senha":
+                etapa_auth = None
+                self._responder("235 Autenticado")
+                continue
+
+            verbo = comando.split(" ", 1)[0].upper()
+            if verbo == "EHLO":
+                self.wfile.write(b"250-sink\r\n250-AUTH LOGIN\r\n250 8BITMIME\r\n")
+            elif verbo == "AUTH":
+                etapa_auth = "usuario"
+                self._responder("334 VXNlcm5hbWU6")
+            elif verbo == "DATA":
+                self._responder("354 Fim com <CRLF>.<CRLF>")
+                tamanho = 0
+                while True:
+                    dado = self.rfile.readline()
+                    if not dado or dado == b".\r\n":
+                        break
+                    tamanho += len(dado)
+                self.server.registrar(tamanho)
+                self._responder("250 OK")
+            elif verbo == "QUIT":
+                self._responder("221 Tchau")
+                break
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                self._responder("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.mensagens = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, tamanho: int):
+        with self._lock:
+            self.mensagens += 1
+            self.bytes += tamanho
+
+    def iniciar(self) -> int:
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+        return self.server_address[1]
+
+
+class _Amostrador:
+    """Amostra periodicamente o número de threads ativas."""
+
+    def __init__(self, intervalo: float = 0.05):
+        self.intervalo = intervalo
+        self.pico_threads = threading.active_count()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="amostrador", daemon=True)
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            self.pico_threads = max(self.pico_threads, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+
+def _pico_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KiB, macOS em bytes
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _sql_relatorio(linhas: int, variante: int = 0) -> str:
+    """Consulta sintética com 'linhas' registros: número, texto, valor e data/hora."""
+    return (
+        f"WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {linhas}) "
+        f"SELECT n AS id, 'linha ' || n AS descricao, n * 1.5 + {variante} AS valor, "
+        "datetime('2024-01-01', '+' || n || ' minutes') AS \"criado_em [timestamp]\" FROM seq"
+    )
+
+
+def _semear(pool, rotinas: int, linhas: int, formato: str, proporcao_in: float, destinatarios: int, consultas: int):
+    qtd_in = int(rotinas * proporcao_in)
+    valores, emails = [], []
+    for i in range(1, rotinas + 1):
+        tipo = "IN" if i <= qtd_in else "RE"
+        sql = _sql_relatorio(linhas, i % consultas).replace("'", "''") if tipo == "RE" else ""
+        valores.append(
+            f"({i}, 'bench {tipo} {i}', 'D', 1, datetime('now', 'localtime', '-1 minutes'), '{sql}', '{tipo}', '{formato}')"
+        )
+        emails.extend(f"({i}, 'dest{j}@bench.local')" for j in range(destinatarios))
+    pool.executar_script(
+        "INSERT INTO cadastro_rotinas (id, nome, periodo, intervalo, dta_inicial, sql, tipo, formato) VALUES "
+        + ", ".join(valores) + ";"
+        "INSERT INTO email_rotinas (id_rotina, email) VALUES " + ", ".join(emails) + ";"
+    )
+
+
+def _fases(snapshot: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Média por fase (e total) a partir dos histogramas das métricas."""
+    fases: Dict[str, Dict[str, float]] = {}
+    for hist in snapshot["histogramas"]:
+        if hist["nome"] == "rotina_fase_segundos":
+            nome = f"{hist['labels']['tipo']}:{hist['labels']['fase']}"
+        elif hist["nome"] in ("rotina_duracao_segundos", "smtp_envio_segundos", "rotina_atraso_segundos"):
+            nome = hist["nome"] + (f":{hist['labels']['tipo']}" if "tipo" in hist["labels"] else "")
+        else:
+            continue
+        atual = fases.setdefault(nome, {"total": 0, "soma": 0.0})
+        atual["total"] += hist["total"]
+        atual["soma"] += hist["soma"]
+    return {
+        nome: {"execucoes": v["total"], "media_s": round(v["soma"] / v["total"], 4) if v["total"] else 0.0}
+        for nome, v in sorted(fases.items())
+    }
+
+
+def executar_benchmark(args) -> Dict[str, Any]:
+    pasta = Path(tempfile.mkdtemp(prefix="bench_rotinas_"))
+    chdir(pasta)
+
+    sink = SMTPSink()
+    environ.update({
+        "EMAIL_HOST": "127.0.0.1",
+        "EMAIL_PORT": str(sink.iniciar()),
+        "EMAIL_SSL": "0",
+        "EMAIL_DEFAULT_USER": "bench@bench.local",
+        "EMAIL_DEFAULT_PASSWORD": "bench",
+        "EMAIL_INFORMATIVO_USER": "bench@bench.local",
+        "EMAIL_INFORMATIVO_PASS": "bench",
+        "EMAIL_RECIPIENTS_ERROR": "erros@bench.local",
+        "EMAIL_RATE_LIMIT": str(args.taxa_email),
+        "REPORT_COLUMNAR": "1" if args.colunar or args.arrow else "0",
+    })
+
+    # Importados só agora: os módulos leem o .env/ambiente na importação
+    from _local_db import LocalPool, aplicar_sqls_locais
+    aplicar_sqls_locais(sobrescrever=True)
+    from _emails import EmailDispatcher
+    from _executor import RoutineExecutor
+    from _metricas import metricas
+    from _rotinas import RoutineService
+
+    pool = LocalPool(str(pasta / "bench.db"), arrow=args.arrow)
+    _semear(pool, args.rotinas, args.linhas, args.formato, args.proporcao_informativos, args.destinatarios,
+            args.consultas or args.rotinas)
+
+    service = RoutineService(pool)
+    service.executor = RoutineExecutor()
+    service.prepare()
+
+    with _Amostrador() as amostrador:
+        inicio = perf_counter()
+        service.check_routines()
+        while not service.executor.ocioso():
+            sleep(0.05)
+        service.descarregar_escritas()
+        EmailDispatcher.instancia().aguardar()
+        duracao = perf_counter() - inicio
+    service.executor.encerrar()
+
+    snapshot = metricas.snapshot()
+    execucoes = sum(c["valor"] for c in snapshot["contadores"] if c["nome"] == "execucoes_total")
+    falhas = sum(
+        c["valor"] for c in snapshot["contadores"]
+        if c["nome"] == "execucoes_total" and c["labels"].get("resultado") == "falha"
+    )
+    return {
+        "parametros": vars(args),
+        "duracao_s": round(duracao, 3),
+        "rotinas_executadas": int(execucoes),
+        "falhas": int(falhas),
+        "rotinas_por_minuto": round(execucoes / duracao * 60, 1) if duracao else 0.0,
+        "emails_recebidos": sink.mensagens,
+        "bytes_recebidos": sink.bytes,
+        "pico_rss_mb": _pico_rss_mb(),
+        "pico_threads": amostrador.pico_threads,
+        "fases": _fases(snapshot),
+    }
+
+
+def _comparar(atual: Dict[str, Any], baseline: Dict[str, Any], tolerancia: float) -> bool:
+    """True se o resultado atual não piorou além da tolerância em relação ao baseline."""
+    ok = True
+    verificacoes = [
+        ("rotinas_por_minuto", atual["rotinas_por_minuto"] >= baseline["rotinas_por_minuto"] * (1 - tolerancia)),
+    ]
+    if atual.get("pico_rss_mb") and baseline.get("pico_rss_mb"):
+        verificacoes.append(("pico_rss_mb", atual["pico_rss_mb"] <= baseline["pico_rss_mb"] * (1 + tolerancia)))
+    for metrica, passou in verificacoes:
+        status = "OK" if passou else "REGRESSÃO"
+        print(f"  {metrica}: {baseline[metrica]} -> {atual[metrica]} [{status}]")
+        ok &= passou
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do serviço de rotinas com banco e SMTP locais.")
+    parser.add_argument("--rotinas", type=int, default=20, help="quantidade de rotinas devidas no ciclo")
+    parser.add_argument("--linhas", type=int, default=10_000, help="linhas por relatório")
+    parser.add_argument("--formato", default="xlsx", help="formato dos relatórios (xlsx, csv, csv.gz, zip)")
+    parser.add_argument("--proporcao-informativos", type=float, default=0.0,
+                        help="fração das rotinas do tipo informativo (IN)")
+    parser.add_argument("--consultas", type=int, default=0,
+                        help="SQLs distintas entre os relatórios (0 = uma por rotina)")
+    parser.add_argument("--destinatarios", type=int, default=3, help="destinatários por rotina")
+    parser.add_argument("--taxa-email", type=float, default=0, help="EMAIL_RATE_LIMIT durante o teste (0 = sem limite)")
+    parser.add_argument("--colunar", action="store_true",
+                        help="busca e grava os relatórios em colunas (REPORT_COLUMNAR=1)")
+    parser.add_argument("--arrow", action="store_true",
+                        help="como --colunar, com lotes Arrow (fetch_df_batches) entregues aos writers; requer pyarrow")
+    parser.add_argument("--saida", help="grava o resultado em JSON")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="piora relativa aceita em relação ao baseline")
+    args = parser.parse_args(argv)
+    if args.arrow and find_spec("pyarrow") is None:
+        parser.error("--arrow requer pyarrow (pip install pyarrow)")
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+    saida = Path(args.saida).resolve() if args.saida else None
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")) if args.baseline else None
+
+    resultado = executar_benchmark(args)
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+
+    if saida:
+        saida.write_text(json.dumps(resultado, ensure_ascii=False, indent=2), encoding="utf-8")
+    if baseline and not _comparar(resultado, baseline, args.tolerancia):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,31 @@
 import logging
 import sys
+from os import getenv
+from time import perf_counter
 from dotenv import load_dotenv
 from _utils import setup_logging, create_essential_folders
-from _rotinas import RoutineService
 
-# Configura o log antes de qualquer outra coisa
-setup_logging()
-
-# Carrega as variáveis de ambiente
-load_dotenv(verbose=True)
-
-create_essential_folders()
+# Os módulos do serviço (e suas dependências pesadas) só são importados no engine escolhido
+INICIO = perf_counter()
 
 def start_service():
     logging.info("--- [ Iniciando Sistema de Gestão de Rotinas ] ---")
 
+    # Engine: 'threads' (padrão) ou 'async', via SERVICE_ENGINE ou argumento --async
+    engine = "async" if "--async" in sys.argv else getenv("SERVICE_ENGINE", "threads").lower()
+
     try:
-        # Instancia o serviço
-        rotinas = RoutineService()
-        rotinas.run()
+        if engine == "async":
+            import asyncio
+            from _rotinas_async import AsyncRoutineService
+            logging.info(f"Módulos carregados em {perf_counter() - INICIO:.2f}s.")
+            asyncio.run(AsyncRoutineService().run())
+        else:
+            from _rotinas import RoutineService
+            logging.info(f"Módulos carregados em {perf_counter() - INICIO:.2f}s.")
+            # Instancia o serviço
+            rotinas = RoutineService()
+            rotinas.run()
 
     except KeyboardInterrupt:
         logging.info("Serviço interrompido manualmente (Ctrl+C).")
@@ -30,4 +37,15 @@ def start_service():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # Só no processo principal: os processos de renderização (spawn) reimportam este módulo
+    # e não devem abrir outro handler no mesmo arquivo de log.
+
+    # Carrega as variáveis de ambiente antes do log, que lê LOG_ROTATE_WHEN/LOG_RETENTION/LOG_FORMAT
+    load_dotenv(verbose=True)
+
+    # Configura o log antes do restante da inicialização
+    setup_logging()
+
+    create_essential_folders()
+
     start_service()
\ No newline at end of file
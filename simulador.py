@@ -0,0 +1,349 @@
+"""
+Simulador de agenda em tempo virtual, para planejamento de capacidade.
+
+Carrega as rotinas ativas (SQL_ROUTINES_SCHEDULE ou um snapshot em JSON), repete um
+período de agendamento com as mesmas regras do serviço (verificação a cada minuto ou
+agenda por evento, filas por tipo do executor, reagendamento a partir da data agendada,
+dta_final e período 'U') usando as durações registradas em planilhas/execucoes.json, e
+mostra picos de concorrência, espera em fila e atraso esperado por rotina.
+Não acessa o banco (exceto para ler a agenda sem --snapshot) nem o SMTP.
+
+Uso:
+    python simulador.py --exportar agenda.json            # lê o banco uma vez e salva o snapshot
+    python simulador.py --snapshot agenda.json --dias 7
+    python simulador.py --snapshot agenda.json --workers-re 8 --modo evento --saida simulacao.json
+"""
+
+import argparse
+import heapq
+import json
+import sys
+from dataclasses import asdict, fields
+from datetime import datetime as dt, timedelta
+from itertools import count
+from math import ceil
+from os import getenv
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+from _agenda import proxima_execucao
+from _database import DB_POOL_MAX
+from _executor import EXECUTOR_QUEUE_MAX, LANES_PADRAO
+from _preparo import DurationHistory
+from _rotinas import RoutineData, column_index
+
+_CAMPOS_DATA = ("dta_inicial", "dta_proxima", "dta_final")
+
+# Ordem de processamento de eventos no mesmo instante: términos liberam workers antes das verificações
+_FIM, _DEVIDA, _VERIFICACAO = 0, 1, 2
+
+
+def carregar_banco() -> List[RoutineData]:
+    from _database import DB
+    result = DB().consultar(getenv("SQL_ROUTINES_SCHEDULE"))
+    colunas = column_index(result['description'])
+    return [RoutineData.from_row(row, colunas) for row in result['data']]
+
+
+def salvar_snapshot(rotinas: List[RoutineData], arquivo: Path):
+    dados = []
+    for routine in rotinas:
+        item = asdict(routine)
+        for campo in _CAMPOS_DATA:
+            item[campo] = item[campo].isoformat() if item[campo] else None
+        # A SQL não é usada na simulação e pode ser grande
+        item["sql"] = None
+        dados.append(item)
+    arquivo.write_text(json.dumps(dados, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+
+
+def carregar_snapshot(arquivo: Path) -> List[RoutineData]:
+    nomes = {f.name for f in fields(RoutineData)}
+    rotinas = []
+    for item in json.loads(arquivo.read_text(encoding="utf-8")):
+        for campo in _CAMPOS_DATA:
+            if item.get(campo):
+                item[campo] = dt.fromisoformat(item[campo])
+        rotinas.append(RoutineData(**{k: v for k, v in item.items() if k in nomes}))
+    return rotinas
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[max(0, ceil(p * len(ordenados)) - 1)]
+
+
+def _resumo(valores: List[float]) -> Dict[str, float]:
+    return {
+        "media_s": round(sum(valores) / len(valores), 1) if valores else 0.0,
+        "p95_s": round(_percentil(valores, 0.95), 1),
+        "max_s": round(max(valores), 1) if valores else 0.0,
+    }
+
+
+class _Lane:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executando = 0
+        self.fila: List[Any] = []
+        self.pico_execucao = 0
+        self.pico_fila = 0
+
+
+class Simulacao:
+    """
+    Execução da agenda em tempo virtual (eventos em um heap, sem esperas reais).
+
+    Modela o RoutineExecutor (filas por tipo, prioridade, limite de fila e uma única
+    entrada por rotina) e o reagendamento de process_routine; todas as execuções são
+    tratadas como sucesso e duram o estimado para a rotina.
+    """
+
+    def __init__(self, rotinas: List[RoutineData], duracoes: Dict[int, float], lanes: Dict[str, int],
+                 modo: str = "polling", max_fila: int = EXECUTOR_QUEUE_MAX, retry_segundos: int = 60):
+        self.rotinas = {r.id: r for r in rotinas if r.ativo}
+        self.duracoes = duracoes
+        self.lanes = {tipo: _Lane(workers) for tipo, workers in lanes.items()}
+        self.modo = modo
+        self.max_fila = max_fila
+        self.retry = timedelta(seconds=retry_segundos)
+
+        self._eventos: List[Any] = []
+        self._seq = count()
+        self._proxima: Dict[int, Optional[dt]] = {}
+        self._pendentes: set = set()
+        self._agora: Optional[dt] = None
+
+        self.execucoes: List[Dict[str, Any]] = []
+        self.recusadas = 0
+        self.pico_total = 0
+        self.pico_conexoes = 0
+        self.devidas_por_minuto: Dict[dt, int] = {}
+
+    def _evento(self, quando: dt, ordem: int, *dados):
+        heapq.heappush(self._eventos, (quando, ordem, next(self._seq), dados))
+
+    def _agendar(self, routine: RoutineData, quando: Optional[dt]):
+        self._proxima[routine.id] = quando
+        if quando is None:
+            return
+        minuto = quando.replace(second=0, microsecond=0)
+        self.devidas_por_minuto[minuto] = self.devidas_por_minuto.get(minuto, 0) + 1
+        if self.modo == "evento":
+            # Datas já vencidas (atraso ou recuperação) são despachadas no instante atual
+            self._evento(max(quando, self._agora), _DEVIDA, routine.id, quando)
+
+    def _submeter(self, routine: RoutineData, agora: dt):
+        lane = self.lanes.get(routine.tipo)
+        if lane is None or routine.id in self._pendentes:
+            return
+        if len(lane.fila) >= self.max_fila:
+            self.recusadas += 1
+            if self.modo == "evento":
+                self._evento(agora + self.retry, _DEVIDA, routine.id, self._proxima[routine.id])
+            return
+        self._pendentes.add(routine.id)
+        heapq.heappush(lane.fila, (routine.prioridade, next(self._seq), agora, routine.id))
+        lane.pico_fila = max(lane.pico_fila, len(lane.fila))
+        self._iniciar(lane, agora)
+
+    def _iniciar(self, lane: _Lane, agora: dt):
+        while lane.executando < lane.workers and lane.fila:
+            _, _, enfileirada, id_routine = heapq.heappop(lane.fila)
+            routine = self.rotinas[id_routine]
+            agendada = self._proxima[id_routine]
+            lane.executando += 1
+            lane.pico_execucao = max(lane.pico_execucao, lane.executando)
+            self._registrar_picos()
+            duracao = timedelta(seconds=self.duracoes.get(id_routine, 0))
+            self._evento(agora + duracao, _FIM, id_routine, agendada, agora, enfileirada)
+
+    def _registrar_picos(self):
+        total = sum(l.executando for l in self.lanes.values())
+        self.pico_total = max(self.pico_total, total)
+        # Relatórios e informativos usam o pool principal; triggers têm pool próprio
+        conexoes = sum(l.executando for tipo, l in self.lanes.items() if tipo != 'TRG')
+        self.pico_conexoes = max(self.pico_conexoes, conexoes)
+
+    def _concluir(self, id_routine: int, agendada: dt, inicio: dt, enfileirada: dt, agora: dt):
+        routine = self.rotinas[id_routine]
+        lane = self.lanes[routine.tipo]
+        lane.executando -= 1
+        self._pendentes.discard(id_routine)
+        self.execucoes.append({
+            "id": id_routine, "agendada": agendada, "atraso": (inicio - agendada).total_seconds(),
+            "espera": (inicio - enfileirada).total_seconds(), "conclusao": (agora - agendada).total_seconds(),
+        })
+        # Mesmas regras de _reschedule: 'U' e dta_final desativam; senão, a partir da data agendada
+        if routine.periodo == 'U' or (routine.dta_final and routine.dta_final <= inicio):
+            self._agendar(routine, None)
+        else:
+            self._agendar(routine, proxima_execucao(routine.periodo, routine.intervalo, agendada))
+        self._iniciar(lane, agora)
+
+    def executar(self, inicio: dt, fim: dt):
+        self._agora = inicio
+        for routine in self.rotinas.values():
+            self._agendar(routine, routine.dta_proxima or routine.dta_inicial)
+
+        if self.modo != "evento":
+            minuto = inicio.replace(second=0, microsecond=0)
+            if minuto < inicio:
+                minuto += timedelta(minutes=1)
+            while minuto < fim:
+                self._evento(minuto, _VERIFICACAO)
+                minuto += timedelta(minutes=1)
+
+        while self._eventos and self._eventos[0][0] < fim:
+            agora, ordem, _, dados = heapq.heappop(self._eventos)
+            self._agora = agora
+            if ordem == _FIM:
+                id_routine, agendada, iniciada, enfileirada = dados
+                self._concluir(id_routine, agendada, iniciada, enfileirada, agora)
+            elif ordem == _DEVIDA:
+                id_routine, quando = dados
+                # Eventos de datas já substituídas são descartados, como no ScheduleIndex
+                if id_routine in self.rotinas and self._proxima.get(id_routine) == quando:
+                    self._submeter(self.rotinas[id_routine], agora)
+            else:
+                devidas = [
+                    r for r in self.rotinas.values()
+                    if self._proxima.get(r.id) is not None and self._proxima[r.id] <= agora
+                    and r.id not in self._pendentes
+                ]
+                # Mesma ordem de SQL_ROUTINES_TO_EXECUTE: prioridade e data agendada
+                for routine in sorted(devidas, key=lambda r: (r.prioridade, self._proxima[r.id])):
+                    self._submeter(routine, agora)
+
+    def relatorio(self, inicio: dt, fim: dt, top: int = 15) -> Dict[str, Any]:
+        por_rotina: Dict[int, List[Dict[str, Any]]] = {}
+        for execucao in self.execucoes:
+            por_rotina.setdefault(execucao["id"], []).append(execucao)
+        rotinas = sorted((
+            {
+                "id": id_routine,
+                "nome": self.rotinas[id_routine].nome,
+                "tipo": self.rotinas[id_routine].tipo,
+                "execucoes": len(lista),
+                "duracao_s": self.duracoes.get(id_routine, 0),
+                "atraso_medio_s": round(sum(e["atraso"] for e in lista) / len(lista), 1),
+                "atraso_max_s": round(max(e["atraso"] for e in lista), 1),
+                "conclusao_max_s": round(max(e["conclusao"] for e in lista), 1),
+            }
+            for id_routine, lista in por_rotina.items()
+        ), key=lambda r: -r["atraso_max_s"])
+        colisoes = sorted(
+            ((m, n) for m, n in self.devidas_por_minuto.items() if inicio <= m < fim),
+            key=lambda item: (-item[1], item[0])
+        )[:top]
+        return {
+            "inicio": inicio.isoformat(sep=" ", timespec="minutes"),
+            "fim": fim.isoformat(sep=" ", timespec="minutes"),
+            "modo": self.modo,
+            "rotinas": len(self.rotinas),
+            "execucoes": len(self.execucoes),
+            "recusadas_fila_cheia": self.recusadas,
+            "pico_execucao": {
+                **{tipo: lane.pico_execucao for tipo, lane in self.lanes.items()}, "total": self.pico_total
+            },
+            "workers": {tipo: lane.workers for tipo, lane in self.lanes.items()},
+            "pico_fila": {tipo: lane.pico_fila for tipo, lane in self.lanes.items()},
+            "pico_conexoes": self.pico_conexoes,
+            "pool_max": DB_POOL_MAX,
+            "espera_fila": _resumo([e["espera"] for e in self.execucoes]),
+            "atraso_inicio": _resumo([e["atraso"] for e in self.execucoes]),
+            "colisoes": [{"minuto": m.strftime("%d/%m %H:%M"), "devidas": n} for m, n in colisoes],
+            "por_rotina": rotinas[:top],
+        }
+
+
+def _duracoes(rotinas: List[RoutineData], historico: DurationHistory, padrao: Dict[str, float]) -> Dict[int, float]:
+    """Percentil 90 do histórico da rotina; sem histórico, a duração padrão do tipo."""
+    return {
+        r.id: historico.estimativa(r.id) or padrao.get(r.tipo, 0.0)
+        for r in rotinas
+    }
+
+
+def _imprimir(resultado: Dict[str, Any]):
+    print(f"Período: {resultado['inicio']} a {resultado['fim']} (modo {resultado['modo']})")
+    print(f"Rotinas ativas: {resultado['rotinas']} | execuções: {resultado['execucoes']} | "
+          f"recusadas (fila cheia): {resultado['recusadas_fila_cheia']}")
+    picos = ", ".join(
+        f"{tipo} {resultado['pico_execucao'][tipo]}/{workers}" for tipo, workers in resultado["workers"].items()
+    )
+    print(f"Pico em execução: {picos} | total {resultado['pico_execucao']['total']}")
+    print(f"Pico de fila: {', '.join(f'{t} {n}' for t, n in resultado['pico_fila'].items())}")
+    print(f"Pico de conexões (RE+IN): {resultado['pico_conexoes']} de {resultado['pool_max']}")
+    for nome in ("espera_fila", "atraso_inicio"):
+        r = resultado[nome]
+        print(f"{nome.replace('_', ' ').capitalize()}: média {r['media_s']}s, p95 {r['p95_s']}s, máx {r['max_s']}s")
+    if resultado["colisoes"]:
+        print("\nMinutos com mais rotinas devidas:")
+        for c in resultado["colisoes"]:
+            print(f"  {c['minuto']}  {c['devidas']}")
+    if resultado["por_rotina"]:
+        print("\nRotinas com maior atraso:")
+        print(f"  {'ID':>6}  {'TIPO':<4} {'EXEC':>5} {'DUR(s)':>8} {'ATRASO MÉD':>11} {'ATRASO MÁX':>11}  NOME")
+        for r in resultado["por_rotina"]:
+            print(f"  {r['id']:>6}  {r['tipo']:<4} {r['execucoes']:>5} {r['duracao_s']:>8.1f} "
+                  f"{r['atraso_medio_s']:>10.1f}s {r['atraso_max_s']:>10.1f}s  {r['nome']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Simula a agenda de rotinas em tempo virtual.")
+    parser.add_argument("--snapshot", help="JSON com as rotinas (gerado por --exportar); sem ele, lê o banco")
+    parser.add_argument("--exportar", help="salva as rotinas lidas do banco neste JSON e encerra")
+    parser.add_argument("--inicio", help="início da simulação (ISO, ex.: 2025-01-06T00:00); padrão: agora")
+    parser.add_argument("--dias", type=float, default=1, help="dias simulados (ex.: 7 para uma semana)")
+    parser.add_argument("--modo", choices=("polling", "evento"), default=getenv("SCHEDULE_MODE", "polling").lower())
+    parser.add_argument("--duracoes", default="planilhas/execucoes.json",
+                        help="histórico de durações das execuções por rotina (gravado pelo serviço)")
+    parser.add_argument("--duracao-re", type=float, default=60, help="duração (s) de relatórios sem histórico")
+    parser.add_argument("--duracao-in", type=float, default=5, help="duração (s) de informativos sem histórico")
+    parser.add_argument("--duracao-trg", type=float, default=30, help="duração (s) de triggers sem histórico")
+    parser.add_argument("--workers-re", type=int, default=LANES_PADRAO['RE'])
+    parser.add_argument("--workers-in", type=int, default=LANES_PADRAO['IN'])
+    parser.add_argument("--workers-trg", type=int, default=LANES_PADRAO['TRG'])
+    parser.add_argument("--top", type=int, default=15, help="linhas nas listas de colisões e de rotinas")
+    parser.add_argument("--saida", help="grava o resultado em JSON")
+    args = parser.parse_args(argv)
+
+    if args.snapshot:
+        rotinas = carregar_snapshot(Path(args.snapshot))
+    else:
+        rotinas = carregar_banco()
+        if args.exportar:
+            salvar_snapshot(rotinas, Path(args.exportar))
+            print(f"{len(rotinas)} rotina(s) salvas em {args.exportar}.")
+            return 0
+
+    inicio = dt.fromisoformat(args.inicio) if args.inicio else dt.now().replace(microsecond=0)
+    fim = inicio + timedelta(days=args.dias)
+    arquivo = Path(args.duracoes)
+    duracoes = _duracoes(
+        rotinas, DurationHistory(arquivo if arquivo.exists() else None),
+        {'RE': args.duracao_re, 'IN': args.duracao_in, 'TRG': args.duracao_trg}
+    )
+
+    relogio = perf_counter()
+    simulacao = Simulacao(
+        rotinas, duracoes, {'RE': args.workers_re, 'IN': args.workers_in, 'TRG': args.workers_trg},
+        modo=args.modo, retry_segundos=int(getenv("SCHEDULE_RETRY_SECONDS", "60"))
+    )
+    simulacao.executar(inicio, fim)
+    resultado = simulacao.relatorio(inicio, fim, args.top)
+    resultado["tempo_simulacao_s"] = round(perf_counter() - relogio, 2)
+
+    _imprimir(resultado)
+    print(f"\nSimulado em {resultado['tempo_simulacao_s']}s.")
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(resultado, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())